@@ -0,0 +1,643 @@
+# Benchmarks of the pysci hot paths on synthetic articles; runs offline: python -m pysci.benchmark
+import gc
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import xml.etree.ElementTree as ET
+
+from pysci import docutils as du
+from pysci import geoparse as gp
+from pysci import geocode as geo
+from pysci import results
+
+WORDS = ['the', 'samples', 'were', 'collected', 'from', 'apple', 'orchards', 'in', 'and', 'of',
+         'we', 'measured', 'carabid', 'diversity', 'at', 'each', 'site', 'during', 'summer',
+         'plots', 'were', 'located', 'north', 'landscape', 'agricultural', 'habitat', 'traps']
+PLACES = ['Beijing', 'Miyun', 'County', 'Hebei', 'China', 'Pennsylvania', 'Centre']
+# place names as they appear in article text, some with the stopwords and punctuation which
+# clean_for_geocode strips
+PLACE_PHRASES = ['Beijing', 'Miyun County', 'Hebei Province, China', 'Centre County, Pennsylvania',
+                 'northern China', 'the Loess Plateau', 'Ontario, Canada', 'Lleida (Spain)',
+                 'the Netherlands', 'Yanqing District of Beijing', 'Washington State, USA']
+JOURNALS = ['Insect Conservation and Diversity', 'Agriculture, Ecosystems & Environment',
+            'Biological Control', 'Journal of Applied Ecology']
+HEADINGS = ['Introduction', 'Materials and methods', 'Study area', 'Results', 'Sample collection',
+            'Discussion', 'Acknowledgements']
+
+### SYNTHETIC ARTICLES ###
+
+def synthetic_paragraph(rng, n_words=80, location_rate=0.0):
+    """
+    Returns a sentence of random words, with "in <place>" for about location_rate of them.
+    """
+    words = []
+    while len(words) < n_words:
+        if location_rate and rng.random() < location_rate:
+            words.extend(['in', rng.choice(PLACE_PHRASES)])
+        else:
+            words.append(rng.choice(WORDS))
+    text = ' '.join(words)
+    return text[:1].upper() + text[1:] + '.'
+
+def synthetic_text_article(n_pars, words_per_par=80, line_length=70, pars_per_sec=5, location_rate=0.0, seed=0):
+    """
+    Returns raw text looking like pdfminer output: paragraphs broken into lines (with some
+    words split by a hyphen at a line-break), and a section heading every few paragraphs.
+    :param n_pars: number of paragraphs
+    :param words_per_par: number of words in each paragraph
+    :param line_length: approximate number of characters per line
+    :param pars_per_sec: number of paragraphs between section headings
+    :param location_rate: share of the words which are followed by a place name
+    :param seed: seed for the random generator, so articles are reproducible
+    """
+    rng = random.Random(seed)
+    pars = []
+    for i in range(n_pars):
+        if i % pars_per_sec == 0:
+            pars.append(HEADINGS[(i // pars_per_sec) % len(HEADINGS)])
+        text = synthetic_paragraph(rng, words_per_par, location_rate)
+        lines = []
+        while len(text) > line_length:
+            cut = text.rfind(' ', 0, line_length)
+            if rng.random() < 0.2:
+                # split the next word with a hyphen
+                lines.append(text[:cut + 3] + '-')
+                text = text[cut + 3:]
+            else:
+                lines.append(text[:cut])
+                text = text[cut + 1:]
+        lines.append(text)
+        pars.append('\n'.join(lines))
+    return '\n\n'.join(pars)
+
+def synthetic_xml_article(n_secs, pars_per_sec=5, words_per_par=80, location_rate=0.0, front=False, seed=0):
+    """
+    Returns the root of an xml document shaped like Cermine's output: sections with a title
+    and paragraphs, most paragraphs containing xref nodes.
+    :param n_secs: number of sections
+    :param pars_per_sec: number of paragraphs in each section
+    :param words_per_par: number of words in each paragraph
+    :param location_rate: share of the words which are followed by a place name
+    :param front: whether to add the front matter (journal, title, year) read by docutils.extract_xml_fields
+    :param seed: seed for the random generator, so articles are reproducible
+    """
+    rng = random.Random(seed)
+    article = ET.Element('article')
+    if front:
+        meta = ET.SubElement(article, 'front')
+        journal_group = ET.SubElement(ET.SubElement(meta, 'journal-meta'), 'journal-title-group')
+        ET.SubElement(journal_group, 'journal-title').text = rng.choice(JOURNALS)
+        article_meta = ET.SubElement(meta, 'article-meta')
+        title = 'Carabid diversity in apple orchards in %s' % rng.choice(PLACE_PHRASES)
+        ET.SubElement(ET.SubElement(article_meta, 'title-group'), 'article-title').text = title
+        ET.SubElement(ET.SubElement(article_meta, 'pub-date'), 'year').text = str(rng.randint(1990, 2018))
+    body = ET.SubElement(article, 'body')
+    for i in range(n_secs):
+        sec = ET.SubElement(body, 'sec')
+        ET.SubElement(sec, 'title').text = HEADINGS[i % len(HEADINGS)]
+        for j in range(pars_per_sec):
+            p = ET.SubElement(sec, 'p')
+            p.text = synthetic_paragraph(rng, words_per_par // 2, location_rate)
+            if rng.random() < 0.8:
+                xref = ET.SubElement(p, 'xref')
+                xref.text = 'Smith et al. 2015'
+                xref.tail = synthetic_paragraph(rng, words_per_par // 2, location_rate)
+    return article
+
+def write_synthetic_corpus(out_dir, n_docs, n_secs=10, pars_per_sec=5, words_per_par=80, location_rate=0.02,
+                           seed=0):
+    """
+    Writes a corpus of synthetic articles, each as a pdfminer-style .txt file and a Cermine-style
+    .cermxml file with the same file name, as the pdf conversion would leave them next to the pdfs.
+    :param out_dir: directory to write to, created if needed
+    :param n_docs: number of articles
+    :param n_secs: number of sections in each article
+    :param pars_per_sec: number of paragraphs in each section
+    :param words_per_par: number of words in each paragraph
+    :param location_rate: share of the words which are followed by a place name
+    :param seed: seed for the random generator, so corpora are reproducible
+    :return: list of the file names, without extension
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    file_names = []
+    for i in range(n_docs):
+        file_name = 'synthetic_%05d' % i
+        text = synthetic_text_article(n_secs * pars_per_sec, words_per_par, pars_per_sec=pars_per_sec,
+                                      location_rate=location_rate, seed=seed + i)
+        with open(os.path.join(out_dir, file_name + du.TXT_extension), 'w', encoding='utf-8') as f:
+            f.write(text)
+        xml_root = synthetic_xml_article(n_secs, pars_per_sec, words_per_par, location_rate=location_rate,
+                                         front=True, seed=seed + i)
+        ET.ElementTree(xml_root).write(os.path.join(out_dir, file_name + du.XML_extension), encoding='utf-8')
+        file_names.append(file_name)
+    return file_names
+
+def synthetic_tagged_sentence(rng, n_words=30, location_rate=0.1):
+    """
+    Returns a sentence as tagged by the NER tagger: a list of (word, tag) tuples, with place
+    names tagged LOCATION, a few of them in parentheses or followed by a comma.
+    """
+    tagged = []
+    while len(tagged) < n_words:
+        if rng.random() < location_rate:
+            if rng.random() < 0.2:
+                tagged.append(('(', 'O'))
+            tagged.append((rng.choice(PLACES), 'LOCATION'))
+            if rng.random() < 0.3:
+                tagged.extend([(',', 'O'), (rng.choice(PLACES), 'LOCATION')])
+        else:
+            tagged.append((rng.choice(WORDS), 'O'))
+    return tagged + [('.', 'O')]
+
+def synthetic_location_strings(rng, n, distinct=200):
+    """
+    Returns location strings as the chunk extraction leaves them, to be cleaned and geocoded:
+    drawn from a pool of 'distinct' strings, so repeats hit the geocode cache.
+    """
+    pool = []
+    for i in range(distinct):
+        place = rng.choice(PLACE_PHRASES)
+        if i >= len(PLACE_PHRASES):
+            place = '%s %s' % (rng.choice(PLACES), place)
+        pool.append(rng.choice(['', 'in ', 'the ']) + place + rng.choice(['', ',', ' (', '.', ' in', ' of the']))
+    return [rng.choice(pool) for _ in range(n)]
+
+class FakeGeocoder:
+    """
+    Stands in for googlemaps.Client, so geocoding can be timed offline: answers every query with
+    a made-up location derived from a hash of it, or no result for about no_result_rate of them.
+    """
+    def __init__(self, latency=0.0, no_result_rate=0.1):
+        """
+        :param latency: seconds each query takes, as a round trip to the geocoding service would
+        :param no_result_rate: share of the queries with no result
+        """
+        self.latency = latency
+        self.no_result_rate = no_result_rate
+
+    def geocode(self, query):
+        if self.latency:
+            time.sleep(self.latency)
+        h = zlib.crc32(query.encode('utf-8'))
+        if h % 1000 < 1000 * self.no_result_rate:
+            return []
+        return [{'formatted_address': query,
+                 'geometry': {'location': {'lat': (h % 18000) / 100.0 - 90, 'lng': (h // 18000 % 36000) / 100.0 - 180},
+                              'location_type': 'APPROXIMATE'}}]
+
+### TIMING ###
+
+def time_call(func, *args, repeat=3, setup=None, **kwargs):
+    """
+    Times a function call, best of a few repeats. The garbage collector is off while timing, as
+    in timeit, so functions building many objects aren't charged for collecting earlier garbage.
+    :param func: function to time
+    :param repeat: number of times to call it
+    :param setup: optional function called (untimed) before each call, e.g. to clear a cache
+    :return: the smallest time taken, in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def print_rows(rows, out=sys.stdout):
+    """
+    Prints (benchmark, scale, seconds, per-unit microseconds) rows as a table.
+    """
+    out.write("%-32s %10s %12s %14s\n" % ('benchmark', 'scale', 'seconds', 'us per unit'))
+    for name, scale, seconds in rows:
+        out.write("%-32s %10s %12.5f %14.3f\n" % (name, scale, seconds, 1e6 * seconds / scale))
+
+### BENCHMARKS ###
+
+def bench_paragraphs(scales=(100, 1000, 10000, 50000)):
+    """
+    Time of the paragraph-based text assembly functions as the number of paragraphs grows:
+    the time per paragraph should stay flat. Trying both raw-text pattern sets is timed with
+    two extract_methods_text calls and with one HeadingDetector pass. The split_paragraphs cache is cleared before
+    each call, so every call does the full work.
+    :param scales: numbers of paragraphs
+    :return: list of (benchmark, scale, seconds) rows
+    """
+    rows = []
+    for n_pars in scales:
+        text = synthetic_text_article(n_pars)
+        rows.append(('extract_methods_text', n_pars,
+                     time_call(gp.extract_methods_text, text, re_to_match=gp.RE_ORCHARDS_METHODS_TEXT,
+                               setup=du.split_paragraphs.cache_clear)))
+        rows.append(('detect_methods_text', n_pars,
+                     time_call(gp.detect_methods_text, text, setup=du.split_paragraphs.cache_clear)))
+        rows.append(('extract_methods_text both sets', n_pars,
+                     time_call(lambda: [gp.extract_methods_text(text, re_to_match=pattern)
+                                        for pattern in gp.METHODS_TEXT_PATTERNS.values()],
+                               setup=du.split_paragraphs.cache_clear)))
+        detector = gp.get_heading_detector(gp.METHODS_TEXT_PATTERNS)
+        rows.append(('HeadingDetector both sets', n_pars,
+                     time_call(lambda: [detector.detect(text).text(name) for name in gp.METHODS_TEXT_PATTERNS],
+                               setup=du.split_paragraphs.cache_clear)))
+        xml_root = synthetic_xml_article(n_pars // 5, pars_per_sec=5)
+        rows.append(('extract_content_text', n_pars, time_call(du.extract_content_text, xml_root)))
+        rows.append(('extract_methods_xml', n_pars,
+                     time_call(gp.extract_methods_xml, xml_root, re_to_match=gp.RE_ORCHARDS_METHODS_HEADINGS,
+                               par_range=5)))
+    return rows
+
+def _multireplace_compile_per_call(string, replacements=gp.DEFAULT_REPLACEMENTS):
+    # how geoparse.multireplace used to work, for comparison
+    regexp = re.compile('|'.join(map(re.escape, replacements)))
+    return regexp.sub(lambda match: replacements[match.group(0)], string)
+
+def bench_multireplace(scales=(100, 1000, 10000)):
+    """
+    Time of normalizing paragraphs of pdfminer-style text (with split accents and ligatures):
+    compiling the regex on every call, the cached Replacer one paragraph at a time, and the
+    bulk multireplace_all.
+    :param scales: numbers of paragraphs
+    :return: list of (benchmark, scale, seconds) rows
+    """
+    rows = []
+    for n_pars in scales:
+        rng = random.Random(n_pars)
+        pars = [synthetic_paragraph(rng).replace('ou', 'ou¨ ').replace('fl', 'ﬂ').replace('e ', 'e´ ')
+                for _ in range(n_pars)]
+        rows.append(('multireplace compile per call', n_pars,
+                     time_call(lambda: [_multireplace_compile_per_call(par) for par in pars])))
+        rows.append(('multireplace', n_pars, time_call(lambda: [gp.multireplace(par) for par in pars])))
+        rows.append(('multireplace_all', n_pars, time_call(gp.multireplace_all, pars)))
+    return rows
+
+def bench_chunking(scales=(1000, 10000, 50000)):
+    """
+    Time of extracting and filtering the location chunks of tagged sentences: one sentence
+    at a time with extract_chunks_from_sentence and filter_chunk_candidates, as the notebooks
+    do, and all at once with Chunker.chunk_sentences; of finding the token offsets and chunk
+    strings; and of the sentence prefilter.
+    :param scales: numbers of sentences
+    :return: list of (benchmark, scale, seconds) rows
+    """
+    rows = []
+    chunker = gp.get_chunker()
+    for n_sents in scales:
+        rng = random.Random(n_sents)
+        tagged_sentences = [synthetic_tagged_sentence(rng) for _ in range(n_sents)]
+        token_lists = [[word for word, _ in tagged] for tagged in tagged_sentences]
+
+        def chunk_one_at_a_time():
+            for tagged, tokens in zip(tagged_sentences, token_lists):
+                chunks = gp.extract_chunks_from_sentence(tagged)
+                if chunks:
+                    gp.filter_chunk_candidates(tokens, chunks)
+
+        rows.append(('chunk one sentence at a time', n_sents, time_call(chunk_one_at_a_time)))
+        rows.append(('Chunker.chunk_sentences', n_sents,
+                     time_call(chunker.chunk_sentences, tagged_sentences, token_lists)))
+        rows.append(('extract_chunks_from_sentence', n_sents,
+                     time_call(lambda: [gp.extract_chunks_from_sentence(tagged) for tagged in tagged_sentences])))
+        chunks = [gp.extract_chunks_from_sentence(tagged) for tagged in tagged_sentences]
+        with_chunks = [(tokens, sent_chunks) for tokens, sent_chunks in zip(token_lists, chunks) if sent_chunks]
+        rows.append(('filter_chunk_candidates', n_sents,
+                     time_call(lambda: [gp.filter_chunk_candidates(tokens, sent_chunks)
+                                        for tokens, sent_chunks in with_chunks])))
+        sentences = [' '.join(tokens) for tokens in token_lists]
+        rows.append(('token_offsets', n_sents,
+                     time_call(lambda: [gp.token_offsets(sent, tokens) for sent, tokens in zip(sentences, token_lists)])))
+        offsets = [gp.token_offsets(sent, tokens) for sent, tokens in zip(sentences, token_lists)]
+        spans = [chunker.extract_spans(tagged) for tagged in tagged_sentences]
+        rows.append(('chunk_string from offsets', n_sents,
+                     time_call(lambda: [[gp.chunk_string(tagged, span, sent, sent_offsets) for span in sent_spans]
+                                        for tagged, sent, sent_offsets, sent_spans
+                                        in zip(tagged_sentences, sentences, offsets, spans)])))
+        rows.append(('SentencePrefilter.keep_all', n_sents, time_call(gp.SentencePrefilter().keep_all, token_lists)))
+    return rows
+
+def bench_geocoding(scales=(1000, 10000, 50000)):
+    """
+    Time of cleaning and geocoding location strings against a FakeGeocoder with no latency, so
+    what is timed is our side of it: clean_for_geocode, geocode_with_cache_google with a dict
+    cache, first empty (all misses) then full (all hits), geocode_batch, indexing the strings
+    by canonical form and geocode_canonical, and geocode_batch with a SqliteGeocodeCache, also
+    empty then full.
+    :param scales: numbers of location strings, drawn from a few hundred distinct ones
+    :return: list of (benchmark, scale, seconds) rows
+    """
+    rows = []
+    geocoder = FakeGeocoder()
+    for n_strings in scales:
+        rng = random.Random(n_strings)
+        strings = synthetic_location_strings(rng, n_strings)
+        rows.append(('clean_for_geocode', n_strings, time_call(lambda: [geo.clean_for_geocode(s) for s in strings])))
+        queries = [geo.clean_for_geocode(s) for s in strings]
+        cache = {}
+
+        def geocode_one_at_a_time():
+            for query in queries:
+                geo.geocode_with_cache_google(query, geocoder, cache, delay=0)
+
+        rows.append(('geocode_with_cache_google cold', n_strings, time_call(geocode_one_at_a_time, setup=cache.clear)))
+        rows.append(('geocode_with_cache_google warm', n_strings, time_call(geocode_one_at_a_time)))
+        # no rate limit to speak of: the geocoder answers at once
+        rows.append(('geocode_batch', n_strings,
+                     time_call(geo.geocode_batch, queries, geocoder, rate=1e9, burst=1e9)))
+        rows.append(('CanonicalIndex', n_strings, time_call(geo.CanonicalIndex, queries)))
+        rows.append(('geocode_canonical', n_strings,
+                     time_call(geo.geocode_canonical, queries, geocoder, rate=1e9, burst=1e9)))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sqlite_cache = geo.SqliteGeocodeCache(os.path.join(tmp_dir, 'geocode_cache.sqlite'))
+
+            def clear_sqlite_cache():
+                with sqlite_cache.conn:
+                    sqlite_cache.conn.execute('DELETE FROM geocode_cache')
+
+            rows.append(('geocode_batch sqlite cache cold', n_strings,
+                         time_call(geo.geocode_batch, queries, geocoder, sqlite_cache, rate=1e9, burst=1e9,
+                                   setup=clear_sqlite_cache)))
+            rows.append(('geocode_batch sqlite cache warm', n_strings,
+                         time_call(geo.geocode_batch, queries, geocoder, sqlite_cache, rate=1e9, burst=1e9)))
+            sqlite_cache.close()
+    return rows
+
+def bench_corpus(scales=(10, 100), location_rate=0.02):
+    """
+    Time of reading a synthetic corpus written to disk, per document: docutils.extract_xml_fields
+    on the .cermxml files, and the methods extraction on the .txt files.
+    :param scales: numbers of documents
+    :param location_rate: share of the words which are followed by a place name
+    :return: list of (benchmark, scale, seconds) rows
+    """
+    rows = []
+    for n_docs in scales:
+        with tempfile.TemporaryDirectory() as corpus_dir:
+            file_names = write_synthetic_corpus(corpus_dir, n_docs, location_rate=location_rate)
+            xml_paths = [os.path.join(corpus_dir, name + du.XML_extension) for name in file_names]
+            rows.append(('extract_xml_fields corpus', n_docs,
+                         time_call(lambda: [du.extract_xml_fields(path, re_to_match=gp.RE_ORCHARDS_METHODS_HEADINGS)
+                                            for path in xml_paths])))
+            texts = []
+            for name in file_names:
+                with open(os.path.join(corpus_dir, name + du.TXT_extension), 'r', encoding='utf-8') as f:
+                    texts.append(f.read())
+            rows.append(('extract_methods_text corpus', n_docs,
+                         time_call(lambda: [gp.extract_methods_text(text, re_to_match=gp.RE_ORCHARDS_METHODS_TEXT)
+                                            for text in texts], setup=du.split_paragraphs.cache_clear)))
+    return rows
+
+def synthetic_results(rng, n_docs, locations_per_doc=10):
+    """
+    Located ScienceDocs with their rows of locations_geocoded.tsv, at random points, some without a result.
+    :return: list of (ScienceDoc, rows)
+    """
+    documents = []
+    for i in range(n_docs):
+        scidoc = du.ScienceDoc('synthetic', 'synthetic_%05d' % i, has_text=True, has_xml=True)
+        scidoc.use_xml = True
+        scidoc.title = 'Carabid diversity in apple orchards'
+        scidoc.title_locations = []
+        scidoc.methods_sections = ['Materials and methods']
+        scidoc.content_locations = [rng.choice(PLACE_PHRASES) for _ in range(locations_per_doc)]
+        scidoc.content_locations_filtered = list(scidoc.content_locations)
+        scidoc.location_sentences = ['Samples were collected in %s.' % place for place in scidoc.content_locations]
+        rows = []
+        for place, sentence in zip(scidoc.content_locations, scidoc.location_sentences):
+            if rng.random() < 0.1:
+                found = (geo.NO_RESULT_STRING,) * 4
+            else:
+                found = (place, 'APPROXIMATE', rng.uniform(-60, 70), rng.uniform(-180, 180))
+            rows.append((scidoc.file_name, place, geo.clean_for_geocode(place)) + found + (True, sentence))
+        documents.append((scidoc, rows))
+    return documents
+
+def bench_results(scales=(100, 1000)):
+    """
+    Time of writing a results store, and of its queries: all the articles with locations in a
+    bounding box (with the grid index, and by reading the coordinates of every location), and
+    all the locations of one article.
+    :param scales: numbers of documents, with 10 locations each
+    :return: list of (benchmark, scale, seconds) rows
+    """
+    rows = []
+    box = (45.8, 5.9, 47.8, 10.5)
+    for n_docs in scales:
+        documents = synthetic_results(random.Random(n_docs), n_docs)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'store')
+            rows.append(('write_results_store', n_docs,
+                         time_call(results.write_results_store, path, [scidoc for scidoc, _ in documents],
+                                   [doc_rows for _, doc_rows in documents])))
+            with results.ResultsStore(path) as store:
+                rows.append(('ResultsStore.articles_in_bbox', n_docs, time_call(store.articles_in_bbox, *box)))
+
+                def scan_bbox():
+                    lat, lon, article = (store.locations.column(name) for name in ('lat', 'lon', 'article'))
+                    return sorted(set(article[row] for row in range(len(lat)) if lat[row] is not None and
+                                      box[0] <= lat[row] <= box[2] and box[1] <= lon[row] <= box[3]))
+
+                rows.append(('articles in bbox by full scan', n_docs, time_call(scan_bbox)))
+                rows.append(('ResultsStore.article_locations', n_docs,
+                             time_call(store.article_locations, documents[-1][0].file_name)))
+    return rows
+
+### IMPORT TIMES ###
+
+# import time budget of each module in seconds, and the heavy dependencies it must not load on
+# import: they are loaded on first use, so that worker processes only pay for what they use
+IMPORT_BUDGETS = {'pysci.instrument': (0.05, []),
+                  'pysci.docutils': (0.1, ['numpy', 'pandas']),
+                  'pysci.geoparse': (0.1, ['nltk']),
+                  'pysci.convertpdf': (0.1, ['pdfminer']),
+                  'pysci.cermine': (0.1, ['pdfminer']),
+                  'pysci.geocode': (0.1, ['googlemaps', 'requests']),
+                  'pysci.results': (0.1, ['numpy', 'pandas']),
+                  'pysci.pipeline': (1.0, ['nltk', 'pdfminer', 'googlemaps', 'folium']),
+                  'pysci.streaming': (1.0, ['nltk', 'pdfminer', 'googlemaps', 'folium'])}
+HEAVY_MODULES = ['nltk', 'pdfminer', 'googlemaps', 'requests', 'numpy', 'pandas', 'folium']
+
+_IMPORT_SCRIPT = """
+import sys, time, json, importlib
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'loaded': [name for name in sys.argv[2:] if name in sys.modules]}))
+"""
+
+def measure_import(module, repeat=3, heavy_modules=HEAVY_MODULES):
+    """
+    Times the import of a module in fresh interpreters, as a worker process would pay it.
+    :param module: module name, e.g. 'pysci.geoparse'
+    :param repeat: number of interpreters to start, the fastest import is kept
+    :param heavy_modules: top level modules to look for in sys.modules after the import
+    :return: (seconds, list of the heavy modules the import loaded)
+    """
+    env = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([package_root] + [path for path in [env.get('PYTHONPATH')] if path])
+    best, loaded = None, []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT, module] + list(heavy_modules), env=env,
+                                stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if best is None or result['seconds'] < best:
+            best = result['seconds']
+        loaded = result['loaded']
+    return best, loaded
+
+def check_import_budget(budgets=IMPORT_BUDGETS, repeat=3):
+    """
+    Checks the import time of each module against its budget, and that it doesn't load any of
+    the heavy dependencies it should only load on first use.
+    :return: list of (module, seconds, budget, heavy modules loaded) for the modules over budget
+    or loading any of their forbidden modules
+    """
+    violations = []
+    for module, (budget, forbidden) in budgets.items():
+        seconds, loaded = measure_import(module, repeat=repeat, heavy_modules=forbidden)
+        if seconds > budget or loaded:
+            violations.append((module, seconds, budget, loaded))
+    return violations
+
+def bench_imports(repeat=3):
+    """
+    Import time of each module of IMPORT_BUDGETS in a fresh interpreter.
+    :param repeat: number of interpreters started per module
+    :return: list of (benchmark, scale, seconds) rows
+    """
+    return [('import ' + module, 1, measure_import(module, repeat=repeat)[0]) for module in IMPORT_BUDGETS]
+
+# benchmark group: (function, scales (or repeats) for a quick run)
+BENCHMARKS = {'paragraphs': (bench_paragraphs, (100, 1000)),
+              'multireplace': (bench_multireplace, (100, 1000)),
+              'chunking': (bench_chunking, (1000,)),
+              'geocoding': (bench_geocoding, (1000,)),
+              'corpus': (bench_corpus, (10,)),
+              'results': (bench_results, (100,)),
+              'imports': (bench_imports, 1)}
+
+def run_benchmarks(groups=None, quick=False):
+    """
+    Runs benchmark groups (see BENCHMARKS).
+    :param groups: names of the groups to run, default all
+    :param quick: run each group at its small scales only
+    :return: list of (benchmark, scale, seconds) rows
+    """
+    rows = []
+    for group in groups or BENCHMARKS:
+        func, quick_scales = BENCHMARKS[group]
+        rows.extend(func(quick_scales) if quick else func())
+    return rows
+
+### STORING AND COMPARING RESULTS ###
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+                              universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_results(rows, path, label=None):
+    """
+    Writes benchmark rows to a JSON file, with when and where they were run, so later runs can
+    be compared with them (see compare_results).
+    :param label: optional name for the run, e.g. a branch name
+    """
+    results = {'label': label, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'git_commit': _git_commit(),
+               'python': platform.python_version(), 'platform': platform.platform(),
+               'rows': [{'benchmark': name, 'scale': scale, 'seconds': seconds} for name, scale, seconds in rows]}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=1)
+
+def load_results(path):
+    """
+    Reads the rows saved by save_results.
+    :return: list of (benchmark, scale, seconds) rows
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    return [(row['benchmark'], row['scale'], row['seconds']) for row in results['rows']]
+
+def compare_results(baseline_rows, rows, threshold=0.25, min_seconds=1e-3):
+    """
+    Compares benchmark rows with the rows of an earlier run, benchmark by benchmark and scale
+    by scale. Timings shorter than min_seconds in both runs are too noisy to flag.
+    :param threshold: relative slowdown (or speedup) above which a benchmark is flagged
+    :return: list of (benchmark, scale, baseline seconds, seconds, ratio, flag) for the rows in
+    both runs, flag being 'regression', 'improvement' or ''
+    """
+    baseline = {(name, scale): seconds for name, scale, seconds in baseline_rows}
+    comparison = []
+    for name, scale, seconds in rows:
+        if (name, scale) not in baseline:
+            continue
+        baseline_seconds = baseline[(name, scale)]
+        ratio = seconds / baseline_seconds if baseline_seconds else float('inf')
+        flag = ''
+        if max(seconds, baseline_seconds) >= min_seconds:
+            if ratio > 1 + threshold:
+                flag = 'regression'
+            elif ratio < 1 / (1 + threshold):
+                flag = 'improvement'
+        comparison.append((name, scale, baseline_seconds, seconds, ratio, flag))
+    return comparison
+
+def print_comparison(comparison, out=sys.stdout):
+    out.write("%-32s %10s %12s %12s %8s\n" % ('benchmark', 'scale', 'baseline s', 'seconds', 'ratio'))
+    for name, scale, baseline_seconds, seconds, ratio, flag in comparison:
+        out.write("%-32s %10s %12.5f %12.5f %8.2f %s\n" % (name, scale, baseline_seconds, seconds, ratio, flag))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pysci.benchmark',
+                                     description="Benchmarks of the pysci hot paths on synthetic articles.")
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS), help="benchmark group to run")
+    parser.add_argument('--quick', action='store_true', help="run at small scales only")
+    parser.add_argument('--save', metavar='RESULTS_JSON', help="write the results to this file")
+    parser.add_argument('--label', help="name of the run stored with the results")
+    parser.add_argument('--compare', metavar='BASELINE_JSON', help="compare with the results of an earlier run")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="relative slowdown flagged as a regression (default 0.25)")
+    parser.add_argument('--check-imports', action='store_true',
+                        help="only check the import time budgets (see IMPORT_BUDGETS), failing if any is exceeded")
+    args = parser.parse_args(argv)
+    if args.check_imports:
+        violations = check_import_budget()
+        for module, seconds, budget, loaded in violations:
+            print("%-24s %8.3fs (budget %0.3fs)%s" % (module, seconds, budget,
+                                                       ', loads ' + ', '.join(loaded) if loaded else ''))
+        if violations:
+            sys.exit("%d modules over their import budget" % len(violations))
+        print("all %d modules within their import budget" % len(IMPORT_BUDGETS))
+        return
+    rows = run_benchmarks(args.only, quick=args.quick)
+    print_rows(rows)
+    if args.save:
+        save_results(rows, args.save, label=args.label)
+    if args.compare:
+        comparison = compare_results(load_results(args.compare), rows, threshold=args.threshold)
+        print()
+        print_comparison(comparison)
+        regressions = [row for row in comparison if row[-1] == 'regression']
+        if regressions:
+            sys.exit("%d regressions against %s" % (len(regressions), args.compare))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+# Pool of long-lived Cermine workers: each worker is one JVM which keeps running between pdfs
+import os
+import time
+import queue
+import tempfile
+import threading
+import subprocess
+import collections
+
+from pysci import docutils as du
+from pysci import convertpdf as pdf
+from pysci import instrument
+
+CERMINE_URL = r'https://maven.ceon.pl/artifactory/kdd-releases/pl/edu/icm/cermine/cermine-impl/1.13/cermine-impl-1.13-jar-with-dependencies.jar'
+
+# one of these per pdf; status is one of the convertpdf STATUS_ strings, or the Java exception class name
+CermineResult = collections.namedtuple('CermineResult',
+                                       ['pdf_filepath', 'xml_filepath', 'status', 'error', 'seconds'])
+
+# Java side of a worker, run with Java 11+ single-file source launching. It reads one
+# "pdf path<TAB>xml path" line per document from stdin and answers with one line on stdout.
+# Cermine's own output goes to stderr so it can't get mixed up with the answers.
+WORKER_CLASS = 'CermineWorker'
+WORKER_SOURCE = r'''
+import java.io.*;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.*;
+import org.jdom.Element;
+import org.jdom.output.Format;
+import org.jdom.output.XMLOutputter;
+import pl.edu.icm.cermine.ContentExtractor;
+
+public class CermineWorker {
+    public static void main(String[] args) throws IOException {
+        PrintStream answers = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        System.setOut(System.err);
+        BufferedReader requests = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        XMLOutputter outputter = new XMLOutputter(Format.getPrettyFormat());
+        answers.println("READY");
+        String line;
+        while ((line = requests.readLine()) != null) {
+            String[] paths = line.split("\t");
+            try (InputStream pdf = new FileInputStream(paths[0])) {
+                ContentExtractor extractor = new ContentExtractor();
+                extractor.setPDF(pdf);
+                Element nlm = extractor.getContentAsNLM();
+                Path part = Paths.get(paths[1] + ".part");
+                try (Writer out = Files.newBufferedWriter(part, StandardCharsets.UTF_8)) {
+                    outputter.output(nlm, out);
+                }
+                Files.move(part, Paths.get(paths[1]), StandardCopyOption.REPLACE_EXISTING);
+                answers.println("OK\t" + paths[0]);
+            } catch (Exception e) {
+                String message = String.valueOf(e.getMessage()).replace('\t', ' ').replace('\n', ' ');
+                answers.println(e.getClass().getSimpleName() + "\t" + paths[0] + "\t" + message);
+            }
+        }
+    }
+}
+'''
+
+def xml_filepath_for(pdf_filepath):
+    """
+    Returns the path Cermine's ContentExtractor would write to for a pdf: same name with
+    the docutils.XML_extension, next to the pdf.
+    """
+    return du.remove_extension(pdf_filepath) + du.XML_extension
+
+def write_worker_source(source_dir=None):
+    """
+    Writes the Java source of the worker to a file, by default in a new temporary directory.
+    :return: path to the source file
+    """
+    if not source_dir:
+        source_dir = tempfile.mkdtemp(prefix='pysci-cermine-')
+    source_path = os.path.join(source_dir, WORKER_CLASS + '.java')
+    with open(source_path, 'w', encoding='utf-8') as f:
+        f.write(WORKER_SOURCE)
+    return source_path
+
+def _read_lines(stream, lines):
+    for line in stream:
+        lines.put(line.rstrip('\r\n'))
+    # end of stream: the JVM is gone
+    lines.put(None)
+
+class CermineWorker:
+    """
+    One persistent JVM running Cermine. Documents are converted one at a time; a document
+    which takes longer than the timeout, or which brings the JVM down, gets the worker restarted.
+    """
+    def __init__(self, jar_path, source_path, java='java', jvm_options=(), startup_timeout=120):
+        self.command = [java] + list(jvm_options) + ['-cp', jar_path, source_path]
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.lines = None
+        self.restarts = 0
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, encoding='utf-8', bufsize=1)
+        self.lines = queue.Queue()
+        threading.Thread(target=_read_lines, args=(self.process.stdout, self.lines), daemon=True).start()
+
+    def wait_ready(self):
+        try:
+            line = self.lines.get(timeout=self.startup_timeout)
+        except queue.Empty:
+            line = None
+        if line != 'READY':
+            self.stop()
+            raise RuntimeError("Cermine worker failed to start: %s" % ' '.join(self.command))
+
+    def stop(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def restart(self):
+        self.stop()
+        self.restarts += 1
+        self.start()
+        self.wait_ready()
+
+    def convert(self, pdf_filepath, xml_filepath, timeout=None):
+        """
+        Converts one pdf to Cermine xml.
+        :param pdf_filepath: path to the pdf
+        :param xml_filepath: path for the output xml file
+        :param timeout: seconds to wait before giving up on this document, None to wait forever
+        :return: a CermineResult
+        """
+        start = time.time()
+        try:
+            self.process.stdin.write(pdf_filepath + '\t' + xml_filepath + '\n')
+            self.process.stdin.flush()
+            line = self.lines.get(timeout=timeout)
+        except queue.Empty:
+            self.restart()
+            return CermineResult(pdf_filepath, xml_filepath, pdf.STATUS_TIMEOUT,
+                                 'no result after %ss' % timeout, time.time() - start)
+        except OSError:
+            line = None
+        if line is None:
+            try:
+                exit_code = self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                exit_code = None
+            self.restart()
+            return CermineResult(pdf_filepath, xml_filepath, pdf.STATUS_CRASHED,
+                                 'exit code %s' % exit_code, time.time() - start)
+        answer = line.split('\t', 2)
+        if answer[0] == 'OK':
+            return CermineResult(pdf_filepath, xml_filepath, pdf.STATUS_OK, None, time.time() - start)
+        return CermineResult(pdf_filepath, xml_filepath, answer[0], answer[-1], time.time() - start)
+
+class CerminePool:
+    """
+    A pool of persistent Cermine workers. PDFs handed to submit() are shared out over the
+    workers as they become free, and collect() yields a CermineResult for each as it finishes.
+    The .cermxml outputs are written next to the pdfs, as Cermine's ContentExtractor does.
+    Example use:
+        with CerminePool('cermine-impl-1.13-jar-with-dependencies.jar', workers=4) as pool:
+            pool.submit(convertpdf.find_pdf_files('pdfs'))
+            for result in pool.collect():
+                print(result.status, result.pdf_filepath)
+    """
+    def __init__(self, jar_path, workers=None, timeout=600, skip_existing=True, java='java',
+                 jvm_options=('-Xmx2g',), startup_timeout=120):
+        """
+        :param jar_path: path to the Cermine jar with dependencies (see CERMINE_URL)
+        :param workers: number of JVMs to run, defaults to the number of cpus
+        :param timeout: per-document timeout in seconds, None for no timeout
+        :param skip_existing: don't convert pdfs which already have a .cermxml file
+        :param java: java executable, Java 11 or later
+        :param jvm_options: extra options for each JVM, e.g. its maximum heap size
+        """
+        if not workers:
+            workers = os.cpu_count() or 1
+        self.timeout = timeout
+        self.skip_existing = skip_existing
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.submitted = 0
+        self.collected = 0
+        self.source_path = write_worker_source()
+        self.workers = [CermineWorker(jar_path, self.source_path, java=java, jvm_options=jvm_options,
+                                      startup_timeout=startup_timeout) for _ in range(workers)]
+        try:
+            # start all the JVMs before waiting on any of them
+            for worker in self.workers:
+                worker.start()
+            for worker in self.workers:
+                worker.wait_ready()
+        except Exception:
+            for worker in self.workers:
+                worker.stop()
+            raise
+        self.threads = [threading.Thread(target=self._run_worker, args=(worker,), daemon=True)
+                        for worker in self.workers]
+        for thread in self.threads:
+            thread.start()
+
+    def _run_worker(self, worker):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            pdf_filepath, xml_filepath = job
+            try:
+                result = worker.convert(pdf_filepath, xml_filepath, timeout=self.timeout)
+            except Exception as e:
+                # e.g. the worker couldn't be restarted: report it rather than lose the document
+                result = CermineResult(pdf_filepath, xml_filepath, pdf.STATUS_CRASHED, str(e), 0.0)
+            self.results.put(result)
+
+    def submit(self, pdf_filepaths):
+        """
+        Queues pdfs for conversion; can be called again while earlier pdfs are being converted.
+        :param pdf_filepaths: a list of pdf file paths, or a single path
+        :return: number of pdfs queued
+        """
+        if isinstance(pdf_filepaths, str):
+            pdf_filepaths = [pdf_filepaths]
+        for pdf_filepath in pdf_filepaths:
+            xml_filepath = xml_filepath_for(pdf_filepath)
+            self.submitted += 1
+            if self.skip_existing and os.path.isfile(xml_filepath):
+                self.results.put(CermineResult(pdf_filepath, xml_filepath, pdf.STATUS_SKIPPED, None, 0.0))
+            else:
+                self.jobs.put((os.path.abspath(pdf_filepath), os.path.abspath(xml_filepath)))
+        return len(pdf_filepaths)
+
+    def collect(self, timeout=None):
+        """
+        Yields a CermineResult per submitted pdf, in the order they finish, until all pdfs
+        submitted so far are done.
+        :param timeout: seconds to wait for the next result before raising queue.Empty, None to wait forever
+        """
+        while self.collected < self.submitted:
+            result = self.results.get(timeout=timeout)
+            self.collected += 1
+            if instrument.enabled():
+                doc = du.remove_extension(os.path.basename(result.pdf_filepath))
+                instrument.count('cermine.' + result.status, doc=doc)
+                if result.status != pdf.STATUS_SKIPPED:
+                    instrument.record('cermine.convert', result.seconds, doc=doc)
+            yield result
+
+    def close(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        for worker in self.workers:
+            worker.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
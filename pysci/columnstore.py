@@ -0,0 +1,196 @@
+# Simple append-only columnar storage: one data file and one offsets file per column, memory-mapped on read
+import os
+import json
+import mmap
+import array
+import pickle
+
+SCHEMA_FILE = 'schema.json'
+DATA_EXTENSION = '.dat'
+INDEX_EXTENSION = '.idx'
+# a value which was never set is stored as an empty cell (a pickled value is never empty)
+MISSING = object()
+
+class ColumnWriter:
+    """
+    Appends rows to a column store directory, creating it if needed. Each column is a data file
+    holding the pickled values back to back, plus an index file holding the end offset of
+    each value as unsigned 64-bit integers, so any single value can be read without the others.
+    Example use:
+        writer = ColumnWriter('corpus_store', ['file_name', 'title'])
+        writer.append({'file_name': 'Liu_et_al-2015', 'title': 'Effects of plant diversity...'})
+        writer.close()
+    """
+    def __init__(self, path, columns):
+        """
+        :param path: directory of the store
+        :param columns: list of column names; must match the existing columns when appending to a store
+        """
+        self.path = path
+        self.columns = list(columns)
+        os.makedirs(path, exist_ok=True)
+        schema_path = os.path.join(path, SCHEMA_FILE)
+        if os.path.isfile(schema_path):
+            with open(schema_path, 'r', encoding='utf-8') as f:
+                existing = json.load(f)['columns']
+            if existing != self.columns:
+                raise ValueError("Store at %s has columns %s, not %s" % (path, existing, self.columns))
+            self._truncate_to_complete_rows()
+        else:
+            with open(schema_path, 'w', encoding='utf-8') as f:
+                json.dump({'columns': self.columns}, f)
+        self.data_files = {}
+        self.index_files = {}
+        self.offsets = {}
+        for column in self.columns:
+            data_path = os.path.join(path, column + DATA_EXTENSION)
+            self.data_files[column] = open(data_path, 'ab')
+            self.index_files[column] = open(os.path.join(path, column + INDEX_EXTENSION), 'ab')
+            self.offsets[column] = self.data_files[column].tell()
+
+    def _truncate_to_complete_rows(self):
+        # a killed writer may have left a row half-written: drop it so all columns line up again
+        index_paths = [os.path.join(self.path, column + INDEX_EXTENSION) for column in self.columns]
+        n_rows = min(os.path.getsize(index_path) // 8 for index_path in index_paths)
+        for column, index_path in zip(self.columns, index_paths):
+            end = 0
+            if n_rows:
+                with open(index_path, 'rb') as f:
+                    f.seek(8 * (n_rows - 1))
+                    end = array.array('Q', f.read(8))[0]
+            os.truncate(index_path, 8 * n_rows)
+            os.truncate(os.path.join(self.path, column + DATA_EXTENSION), end)
+
+    def append(self, row):
+        """
+        Appends one row.
+        :param row: dict of column name: value; columns not in the dict are stored as missing
+        """
+        for column in self.columns:
+            value = row.get(column, MISSING)
+            data = b'' if value is MISSING else pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            self.data_files[column].write(data)
+            self.offsets[column] += len(data)
+            self.index_files[column].write(array.array('Q', [self.offsets[column]]).tobytes())
+
+    def flush(self):
+        # data before index, so a reader never sees an offset past the end of the data
+        for column in self.columns:
+            self.data_files[column].flush()
+        for column in self.columns:
+            self.index_files[column].flush()
+
+    def close(self):
+        self.flush()
+        for column in self.columns:
+            self.data_files[column].close()
+            self.index_files[column].close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class Column:
+    """
+    Lazy read-only view of one column: values are unpickled one at a time as they are accessed.
+    """
+    def __init__(self, path, name, n_rows):
+        self.name = name
+        self.n_rows = n_rows
+        self.ends = array.array('Q')
+        with open(os.path.join(path, name + INDEX_EXTENSION), 'rb') as f:
+            self.ends.frombytes(f.read(8 * n_rows))
+        self.data_file = open(os.path.join(path, name + DATA_EXTENSION), 'rb')
+        size = self.ends[-1] if n_rows else 0
+        # mmap can't map an empty file
+        self.data = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __len__(self):
+        return self.n_rows
+
+    def get(self, i, default=None):
+        """
+        Returns the value in row i, or default if it was stored as missing.
+        """
+        if i < 0:
+            i += self.n_rows
+        if not 0 <= i < self.n_rows:
+            raise IndexError("row %s out of range for column %s" % (i, self.name))
+        start = self.ends[i - 1] if i else 0
+        end = self.ends[i]
+        if start == end:
+            return default
+        return pickle.loads(self.data[start:end])
+
+    def __getitem__(self, i):
+        return self.get(i)
+
+    def __iter__(self):
+        for i in range(self.n_rows):
+            yield self.get(i)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data_file.close()
+
+class ColumnStore:
+    """
+    Read access to a store written by ColumnWriter. Opening only reads the schema; each column
+    is opened (memory-mapped) the first time it is used, so reading one column never
+    deserializes the others.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, SCHEMA_FILE), 'r', encoding='utf-8') as f:
+            self.columns = json.load(f)['columns']
+        self._columns = {}
+        self._n_rows = None
+
+    def __len__(self):
+        if self._n_rows is None:
+            # rows whose values were all written: a killed writer may have left the last one half-done
+            self._n_rows = min((os.path.getsize(os.path.join(self.path, column + INDEX_EXTENSION)) // 8
+                                for column in self.columns), default=0)
+        return self._n_rows
+
+    def column(self, name):
+        """
+        Returns the lazy Column for a column name.
+        """
+        if name not in self._columns:
+            if name not in self.columns:
+                raise KeyError("No column %s in store at %s" % (name, self.path))
+            self._columns[name] = Column(self.path, name, len(self))
+        return self._columns[name]
+
+    def get(self, i, name, default=None):
+        """
+        Returns the value of one column in row i, or default if it is missing.
+        """
+        return self.column(name).get(i, default)
+
+    def row(self, i, columns=None):
+        """
+        Returns row i as a dict, leaving out missing values.
+        :param columns: column names to read, default all
+        """
+        row = {}
+        for name in columns or self.columns:
+            value = self.column(name).get(i, MISSING)
+            if value is not MISSING:
+                row[name] = value
+        return row
+
+    def close(self):
+        for column in self._columns.values():
+            column.close()
+        self._columns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
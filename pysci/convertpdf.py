@@ -1,19 +1,47 @@
 # Python 3 version of pdf conversion
 import sys
+import io
+import re
 import logging
-import six
 import os
-import pdfminer
-import pdfminer.settings
-pdfminer.settings.STRICT = False
-from pdfminer.image import ImageWriter
-from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
-from pdfminer.converter import TextConverter
-from pdfminer.layout import LAParams
-from pdfminer.pdfpage import PDFPage
-from pdfminer.pdfdocument import PDFTextExtractionNotAllowed
-from pdfminer.psparser import PSSyntaxError
-import pdfminer.high_level
+import time
+import json
+import collections
+import multiprocessing
+import multiprocessing.connection
+
+from pysci import docutils as du
+from pysci import instrument
+
+STATUS_OK = 'ok'
+STATUS_SKIPPED = 'skipped'
+STATUS_TIMEOUT = 'timeout'
+STATUS_CRASHED = 'crashed'
+
+def _pdfminer():
+    """
+    Imports pdfminer on first use, so importing this module (e.g. for find_pdf_files, or in a
+    process which never converts anything) stays quick.
+    """
+    import pdfminer.settings
+    import pdfminer.layout
+    import pdfminer.high_level
+    pdfminer.settings.STRICT = False
+    return pdfminer
+
+def __getattr__(name):
+    # errors which pdfminer raises on pdfs it can't handle: we keep track of these rather than crash
+    if name == 'CONVERSION_ERRORS':
+        _pdfminer()
+        from pdfminer.pdfdocument import PDFTextExtractionNotAllowed
+        from pdfminer.psparser import PSSyntaxError
+        return (TypeError, PDFTextExtractionNotAllowed, IndexError, PSSyntaxError)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+# one of these per pdf in a batch conversion; status is STATUS_OK, STATUS_SKIPPED, STATUS_TIMEOUT,
+# STATUS_CRASHED, or else the class name of the error raised on that file (e.g. 'PSSyntaxError')
+ConversionResult = collections.namedtuple('ConversionResult',
+                                          ['pdf_filepath', 'txt_filepath', 'status', 'error', 'seconds'])
 
 def convert_pdf_to_text(pdf_filepath, txt_filepath, verbose=False):
     """
@@ -24,9 +52,14 @@ def convert_pdf_to_text(pdf_filepath, txt_filepath, verbose=False):
     :param verbose: print info for each file or not.
     :return:
     """
+    _pdfminer()
+    from pdfminer.pdfdocument import PDFTextExtractionNotAllowed
+    from pdfminer.psparser import PSSyntaxError
     no_error = False
     try:
-        outFile = extract_text(files=[pdf_filepath], outfile=txt_filepath)
+        with instrument.timer('convertpdf.pdfminer', nbytes=lambda: os.path.getsize(pdf_filepath),
+                              doc=du.remove_extension(os.path.basename(pdf_filepath))):
+            outFile = extract_text(files=[pdf_filepath], outfile=txt_filepath)
         if verbose:
             print("Succesfully read file at " + pdf_filepath)
             print("Succesfully output string contents to file at " + txt_filepath)
@@ -66,6 +99,7 @@ def extract_text(files=[], outfile='-',
         raise ValueError("Too many positional arguments passed.")
     if not files:
         raise ValueError("Must provide files to work upon!")
+    pdfminer = _pdfminer()
 
     # If any LAParams group arguments were passed, create an LAParams object and
     # populate with given args. Otherwise, set it to None.
@@ -79,10 +113,11 @@ def extract_text(files=[], outfile='-',
         laparams = None
 
     # NOTE: eacheson modified this to suppress (most) console-style output
-    logging.getLogger().setLevel(logging.ERROR)
+    logging.getLogger('pdfminer').setLevel(logging.ERROR)
 
     imagewriter = None
     if output_dir:
+        from pdfminer.image import ImageWriter
         imagewriter = ImageWriter(output_dir)
 
     if output_type == "text" and outfile != "-":
@@ -104,3 +139,259 @@ def extract_text(files=[], outfile='-',
         with open(fname, "rb") as fp:
             pdfminer.high_level.extract_text_to_fp(fp, **locals())
     return outfp
+
+# a line starting like the heading of a section that follows the methods
+RE_AFTER_METHODS_HEADINGS = r'[0-9.]*[ \t]{0,2}(results|discussion|conclusion|acknowledg|references)'
+
+def stop_after_section(re_section, re_next_section=RE_AFTER_METHODS_HEADINGS):
+    """
+    Creates a stop_when function for extract_text_pages, which says to stop once a line matching
+    re_section (e.g. one of the methods regular expressions in geoparse) has been seen, followed
+    later by a line matching re_next_section. Lines are matched lower-cased, from their start.
+    :param re_section: regular expression for the heading of the section we want
+    :param re_next_section: regular expression for the heading of a section coming after it
+    :return: a function taking (file, page_number, text) and returning True when we can stop
+    """
+    state = {'file': None, 'found': False}
+    def stop_when(fname, page_number, text):
+        if fname != state['file']:
+            state['file'] = fname
+            state['found'] = False
+        for line in text.lower().split('\n'):
+            if not state['found']:
+                state['found'] = re.match(re_section, line) is not None
+            elif re.match(re_next_section, line):
+                return True
+        return False
+    return stop_when
+
+def extract_text_pages(files=[], maxpages=0, page_numbers=None, password="", stop_when=None,
+                       no_laparams=False, all_texts=None, detect_vertical=None,  # LAParams
+                       word_margin=None, char_margin=None, line_margin=None, boxes_flow=None,  # LAParams
+                       codec='utf-8', disable_caching=True):
+    """
+    Generator version of extract_text: converts PDF text content to plain text page by page,
+    yielding each page as soon as it is laid out, so only one page of text is held at a time.
+    Object caching is off by default to keep memory flat on very large documents.
+    :param files: list of pdf file paths
+    :param maxpages: stop after this many pages of each file (0 for no limit)
+    :param page_numbers: zero-indexed page numbers to extract, None for all pages
+    :param password: for encrypted PDFs, the password to decrypt
+    :param stop_when: optional function taking (file, page_number, text), returning True to stop
+    reading the current file after this page, e.g. stop_after_section(geoparse.RE_ORCHARDS_METHODS_TEXT)
+    :return: yields (file, page_number, text) tuples, page_number being zero-indexed
+    """
+    if not files:
+        raise ValueError("Must provide files to work upon!")
+    pdfminer = _pdfminer()
+    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+    from pdfminer.converter import TextConverter
+    from pdfminer.pdfpage import PDFPage
+
+    if not no_laparams:
+        laparams = pdfminer.layout.LAParams()
+        for param in ("all_texts", "detect_vertical", "word_margin", "char_margin", "line_margin", "boxes_flow"):
+            paramv = locals().get(param, None)
+            if paramv is not None:
+                setattr(laparams, param, paramv)
+    else:
+        laparams = None
+
+    # NOTE: as in extract_text, suppress (most) console-style output
+    logging.getLogger('pdfminer').setLevel(logging.ERROR)
+
+    page_numbers = set(page_numbers) if page_numbers else None
+    for fname in files:
+        with open(fname, "rb") as fp:
+            rsrcmgr = PDFResourceManager(caching=not disable_caching)
+            page_text = io.StringIO()
+            device = TextConverter(rsrcmgr, page_text, codec=codec, laparams=laparams)
+            interpreter = PDFPageInterpreter(rsrcmgr, device)
+            pages_done = 0
+            try:
+                for page_number, page in enumerate(PDFPage.get_pages(fp, password=password,
+                                                                     caching=not disable_caching)):
+                    if page_numbers is not None and page_number not in page_numbers:
+                        continue
+                    interpreter.process_page(page)
+                    text = page_text.getvalue()
+                    page_text.seek(0)
+                    page_text.truncate(0)
+                    yield fname, page_number, text
+                    pages_done += 1
+                    if maxpages and pages_done >= maxpages:
+                        break
+                    if stop_when is not None and stop_when(fname, page_number, text):
+                        break
+            finally:
+                device.close()
+
+
+### BATCH CONVERSION ###
+
+def find_pdf_files(pdf_dir):
+    """
+    Walks a directory and returns the paths of all the pdf files in it, in a stable order.
+    :param pdf_dir: directory containing the pdfs (sub-directories are included)
+    :return: list of pdf file paths
+    """
+    pdf_filepaths = []
+    for root, dirs, files in os.walk(pdf_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if os.path.splitext(filename)[1].lower() == du.PDF_extension:
+                pdf_filepaths.append(os.path.join(root, filename))
+    return pdf_filepaths
+
+def txt_filepath_for(pdf_filepath, output_dir=None):
+    """
+    Returns the path of the txt file that goes with a pdf: same name with a .txt extension,
+    next to the pdf unless an output directory is given.
+    """
+    pdf_dir, filename_pdf = os.path.split(pdf_filepath)
+    filename_txt = du.remove_extension(filename_pdf) + du.TXT_extension
+    return os.path.join(output_dir if output_dir else pdf_dir, filename_txt)
+
+def load_manifest(manifest_path):
+    """
+    Reads a conversion manifest written by convert_pdfs, one json record per line.
+    Lines that can't be parsed (e.g. cut off when a run was killed) are ignored.
+    :param manifest_path: path to the manifest file
+    :return: dict of absolute pdf path: ConversionResult, the latest record winning
+    """
+    done = {}
+    if not manifest_path or not os.path.isfile(manifest_path):
+        return done
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            result = ConversionResult(**record)
+            done[os.path.abspath(result.pdf_filepath)] = result
+    return done
+
+def _convert_one(pdf_filepath, txt_filepath):
+    """
+    Converts a single file, writing to a temporary file which is only renamed to txt_filepath
+    on success, so we never leave a half-written txt file behind.
+    :return: (status, error message) tuple
+    """
+    part_filepath = txt_filepath + '.part'
+    try:
+        outFile = extract_text(files=[pdf_filepath], outfile=part_filepath)
+        outFile.close()
+        os.replace(part_filepath, txt_filepath)
+        return STATUS_OK, None
+    except Exception as e:
+        # CONVERSION_ERRORS are the usual suspects, but in a batch nothing should take the run down
+        if os.path.isfile(part_filepath):
+            os.remove(part_filepath)
+        return e.__class__.__name__, str(e)
+
+def _conversion_worker(pdf_filepath, txt_filepath, conn):
+    start = time.time()
+    status, error = _convert_one(pdf_filepath, txt_filepath)
+    conn.send((status, error, time.time() - start))
+    conn.close()
+
+def convert_pdfs(pdfs, output_dir=None, processes=None, timeout=600, manifest_path=None,
+                 skip_existing=True, retry_failed=False, verbose=False):
+    """
+    Converts many pdfs to text in parallel, one worker process per file and at most 'processes'
+    workers at a time. A worker taking longer than 'timeout' seconds is killed, so a pathological
+    pdf can't stall the run. If a manifest path is given, each finished file is appended to it
+    straight away, and files already in the manifest are not converted again: a killed run can
+    simply be started again with the same manifest.
+    :param pdfs: a directory of pdfs, or a list of pdf file paths
+    :param output_dir: where to write the txt files; default is next to each pdf
+    :param processes: max number of worker processes, defaults to the number of cpus
+    :param timeout: per-file timeout in seconds, None for no timeout
+    :param manifest_path: file in which to record finished files, e.g. 'conversion_manifest.jsonl'
+    :param skip_existing: don't convert pdfs which already have a txt file
+    :param retry_failed: convert files the manifest has as failed again (successes are always skipped)
+    :param verbose: print a line per finished file
+    :return: list of ConversionResult, in the same order as the input pdfs
+    """
+    if isinstance(pdfs, str):
+        pdfs = find_pdf_files(pdfs) if os.path.isdir(pdfs) else [pdfs]
+    if not processes:
+        processes = multiprocessing.cpu_count()
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    done = load_manifest(manifest_path)
+    results = [None] * len(pdfs)
+    pending = collections.deque()
+    for i, pdf_filepath in enumerate(pdfs):
+        txt_filepath = txt_filepath_for(pdf_filepath, output_dir)
+        previous = done.get(os.path.abspath(pdf_filepath))
+        if previous and (previous.status in (STATUS_OK, STATUS_SKIPPED) or not retry_failed):
+            results[i] = previous
+        elif skip_existing and os.path.isfile(txt_filepath):
+            results[i] = ConversionResult(pdf_filepath, txt_filepath, STATUS_SKIPPED, None, 0.0)
+        else:
+            pending.append((i, pdf_filepath, txt_filepath))
+
+    manifest = open(manifest_path, 'a', encoding='utf-8') if manifest_path else None
+    running = {}  # receiving end of pipe: (process, job, start time)
+
+    def finish(i, result):
+        results[i] = result
+        part_filepath = result.txt_filepath + '.part'
+        if result.status != STATUS_OK and os.path.isfile(part_filepath):
+            os.remove(part_filepath)
+        if manifest:
+            manifest.write(json.dumps(result._asdict()) + '\n')
+            manifest.flush()
+        if instrument.enabled():
+            # the conversion ran in a worker process, so it is recorded here from its result
+            doc = du.remove_extension(os.path.basename(result.pdf_filepath))
+            instrument.count('convertpdf.' + result.status, doc=doc)
+            if result.status != STATUS_SKIPPED:
+                instrument.record('convertpdf.convert', result.seconds, doc=doc,
+                                  nbytes=os.path.getsize(result.pdf_filepath))
+        if verbose:
+            print("%s on file %s (%0.1fs)" % (result.status, os.path.basename(result.pdf_filepath), result.seconds))
+
+    try:
+        while pending or running:
+            while pending and len(running) < processes:
+                i, pdf_filepath, txt_filepath = pending.popleft()
+                recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+                proc = multiprocessing.Process(target=_conversion_worker,
+                                               args=(pdf_filepath, txt_filepath, send_conn), daemon=True)
+                proc.start()
+                send_conn.close()
+                running[recv_conn] = (proc, (i, pdf_filepath, txt_filepath), time.time())
+            wait_for = None
+            if timeout is not None:
+                oldest_start = min(start for proc, job, start in running.values())
+                wait_for = max(0.0, oldest_start + timeout - time.time())
+            for conn in multiprocessing.connection.wait(list(running), timeout=wait_for):
+                proc, (i, pdf_filepath, txt_filepath), start = running.pop(conn)
+                try:
+                    status, error, seconds = conn.recv()
+                except EOFError:
+                    # worker died without reporting back, e.g. killed for using too much memory
+                    status, error, seconds = STATUS_CRASHED, 'exit code %s' % proc.exitcode, time.time() - start
+                conn.close()
+                proc.join()
+                finish(i, ConversionResult(pdf_filepath, txt_filepath, status, error, seconds))
+            if timeout is not None:
+                now = time.time()
+                for conn, (proc, (i, pdf_filepath, txt_filepath), start) in list(running.items()):
+                    if now - start >= timeout:
+                        del running[conn]
+                        proc.terminate()
+                        proc.join()
+                        conn.close()
+                        finish(i, ConversionResult(pdf_filepath, txt_filepath, STATUS_TIMEOUT,
+                                                   'no result after %ss' % timeout, now - start))
+    finally:
+        for conn, (proc, job, start) in running.items():
+            proc.terminate()
+            conn.close()
+        if manifest:
+            manifest.close()
+    return results
@@ -0,0 +1,167 @@
+# Coordinates stated in article text: decimal degrees, degrees-minutes-seconds, and the forms pdfminer mangles them into
+import re
+import math
+import collections
+
+# geocode_type of the locations placed at coordinates stated in their sentence rather than geocoded
+COORDINATES_TYPE = 'STATED_COORDINATES'
+# a stated point and a geocoding result further apart than this are taken to disagree
+MAX_DISTANCE_KM = 100.0
+# decimals kept for the coordinates of a point, about 10 cm
+PRECISION = 6
+EARTH_RADIUS_KM = 6371.0
+
+# degree signs, including the ordinal, ring and bullet pdfminer gives for some fonts
+DEGREE = '[°º˚◦]'
+MINUTE = '[′\'’´]'
+SECOND = '(?:″|"|”|′′|\'\'|’’)'
+# one angle, in any of the forms below (without its hemisphere):
+# 40°21'15", 40°21.5', 40.35°, 40 21' 15" (degree sign lost), 40.3512 (decimal),
+# and 40 210 as pdfminer gives 40°21′ with some fonts: the degree sign as a space, the prime as a 0
+RE_ANGLE_FORMS = (r'(?P<glyph>\d{1,3}(?:\.\d+)?\s?' + DEGREE + r'(?:\s?\d{1,2}(?:\.\d+)?\s?' + MINUTE +
+                  r'(?:\s?\d{1,2}(?:\.\d+)?\s?' + SECOND + ')?)?)'
+                  r'|(?P<spaced>\d{1,3} \d{1,2}(?:\.\d+)?\s?' + MINUTE + r'(?:\s?\d{1,2}(?:\.\d+)?\s?' + SECOND + ')?)'
+                  r'|(?P<mangled>\d{1,3} [0-5]\d0(?: [0-5]\d00)?)'
+                  r'|(?P<decimal>\d{1,3}\.\d+)')
+RE_ANGLE = re.compile(RE_ANGLE_FORMS)
+_ANGLE = re.sub(r'\(\?P<\w+>', '(?:', RE_ANGLE_FORMS)
+# an angle, or a range of two ("40 210–40 250N"), followed by its hemisphere
+RE_HEMISPHERE_COORDINATE = re.compile(r'(?<![\d.])(?P<value>(?:' + _ANGLE + r')(?:\s?[-–—]\s?(?:' + _ANGLE +
+                                      r'))?)\s?(?P<hemisphere>[NSEW])(?![A-Za-z])')
+# what may separate the latitude and longitude of a point
+RE_PAIR_SEPARATOR = re.compile(r'[\s,;/&]*(?:and)?[\s,;/&]*')
+MAX_SEPARATOR = 10
+# a pair of signed decimal degrees with no hemispheres, e.g. "(coordinates; 40.712019, -77.934192)"; at least
+# three decimals, and not both below 1, so that statistics ("0.051, 0.012") aren't taken for coordinates
+RE_DECIMAL_PAIR = re.compile(r'(?<![\w.])(?P<lat>[-−]?\d{1,2}\.\d{3,})\s?' + DEGREE + r'?\s?[,;/]\s?'
+                             r'(?P<lon>[-−]?\d{1,3}\.\d{3,})\s?' + DEGREE + r'?(?![\d.])')
+# cheap test for texts which may state coordinates, the others aren't parsed
+RE_MAY_HAVE_COORDINATES = re.compile(r'\d\s?(?:' + DEGREE + r'|[NSEW](?![A-Za-z]))|\d\.\d{3}')
+
+# a stated point: its coordinates, the text stating them and where it is, and whether the signs of
+# the coordinates are a guess (decimal degrees with neither hemispheres nor minus signs)
+Point = collections.namedtuple('Point', ['lat', 'lon', 'text', 'start', 'end', 'ambiguous'])
+
+### PARSING ###
+
+def parse_angle(text):
+    """
+    Degrees of one angle, written in any of the forms of RE_ANGLE_FORMS.
+    :return: the angle in decimal degrees, None if it isn't one (e.g. 75 minutes)
+    """
+    match = RE_ANGLE.fullmatch(text.strip())
+    if match is None:
+        return None
+    if match.group('decimal'):
+        return float(match.group('decimal'))
+    if match.group('mangled'):
+        parts = match.group('mangled').split(' ')
+        # drop the 0 standing for the prime, and the 00 standing for the double prime
+        numbers = [float(parts[0]), float(parts[1][:-1])] + [float(part[:-2]) for part in parts[2:]]
+    else:
+        numbers = [float(number) for number in re.findall(r'\d+(?:\.\d+)?', match.group(0))]
+    if any(number >= 60 for number in numbers[1:]):
+        return None
+    return sum(number / 60 ** i for i, number in enumerate(numbers))
+
+def _hemisphere_value(match):
+    # the angle of a coordinate with its hemisphere, the middle of a range, signed (S and W negative)
+    angles = [parse_angle(angle.group(0)) for angle in RE_ANGLE.finditer(match.group('value'))]
+    if not angles or None in angles:
+        return None
+    value = sum(angles) / len(angles)
+    hemisphere = match.group('hemisphere')
+    if value > (90 if hemisphere in 'NS' else 180):
+        return None
+    return -value if hemisphere in 'SW' else value
+
+def find_points(text):
+    """
+    Finds the points stated in a text: latitude and longitude with their hemispheres, in either
+    order, each as decimal degrees, degrees-minutes-seconds or the mangled forms pdfminer
+    gives (see RE_ANGLE_FORMS), or a range of two ("40 210–40 250N", taken as its middle); and
+    pairs of decimal degrees without hemispheres, whose signs may be a guess (see Point).
+    :return: list of Point, in the order of the text
+    """
+    points = []
+    coordinates = list(RE_HEMISPHERE_COORDINATE.finditer(text))
+    used = set()
+    for first, second in zip(coordinates, coordinates[1:]):
+        if first.start() in used:
+            continue
+        hemispheres = first.group('hemisphere') + second.group('hemisphere')
+        if len(set(hemispheres) & set('NS')) != 1 or len(set(hemispheres) & set('EW')) != 1:
+            continue
+        separator = text[first.end():second.start()]
+        if len(separator) > MAX_SEPARATOR or not RE_PAIR_SEPARATOR.fullmatch(separator):
+            continue
+        lat_match, lon_match = (first, second) if hemispheres[0] in 'NS' else (second, first)
+        lat, lon = _hemisphere_value(lat_match), _hemisphere_value(lon_match)
+        if lat is None or lon is None:
+            continue
+        used.update((first.start(), second.start()))
+        points.append(Point(round(lat, PRECISION), round(lon, PRECISION), text[first.start():second.end()],
+                            first.start(), second.end(), False))
+    for match in RE_DECIMAL_PAIR.finditer(text):
+        if any(point.start <= match.start() < point.end for point in points):
+            continue
+        lat_text, lon_text = match.group('lat').replace('−', '-'), match.group('lon').replace('−', '-')
+        lat, lon = float(lat_text), float(lon_text)
+        if abs(lat) > 90 or abs(lon) > 180 or (abs(lat) < 1 and abs(lon) < 1):
+            continue
+        ambiguous = not (lat_text.startswith('-') or lon_text.startswith('-'))
+        points.append(Point(lat, lon, match.group(0), match.start(), match.end(), ambiguous))
+    return sorted(points, key=lambda point: point.start)
+
+def points_in_texts(texts):
+    """
+    Finds the points stated in many texts (e.g. the location sentences of a corpus), parsing
+    each distinct text once, and only the texts passing a cheap test for digits followed by a
+    degree sign or hemisphere, or decimals.
+    :return: dict of text: list of Point, for the texts stating any
+    """
+    found = {}
+    for text in set(texts):
+        if isinstance(text, str) and RE_MAY_HAVE_COORDINATES.search(text):
+            points = find_points(text)
+            if points:
+                found[text] = points
+    return found
+
+def nearest_point(points, text, phrase):
+    """
+    The point of a text closest to a phrase of it (e.g. a place name), the first one if the
+    phrase isn't in the text.
+    """
+    position = text.find(phrase)
+    if position < 0:
+        return points[0]
+    middle = position + len(phrase) / 2
+    return min(points, key=lambda point: abs((point.start + point.end) / 2 - middle))
+
+### CHECKING ###
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance between two points, in km.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def check_point(point, lat, lon, max_km=MAX_DISTANCE_KM):
+    """
+    Cross-checks a stated point with a geocoding result of its place name. When the signs of
+    the point are a guess, the point with the other signs is tried too (decimal coordinates
+    are often given without the minus of western longitudes).
+    :return: (lat, lon) of the stated point, with the signs agreeing with the result, or None
+    if the point is further than max_km from the result
+    """
+    variants = [(point.lat, point.lon)]
+    if point.ambiguous:
+        variants.extend([(point.lat, -point.lon), (-point.lat, point.lon), (-point.lat, -point.lon)])
+    for variant in variants:
+        if distance_km(variant[0], variant[1], lat, lon) <= max_km:
+            return variant
+    return None
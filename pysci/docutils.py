@@ -1,20 +1,49 @@
+import re
 import pickle
-import numpy as np
+import functools
 import xml.etree.ElementTree as ET
 
+from pysci import columnstore
+from pysci import instrument
+
 PDF_extension = '.pdf'
 XML_extension = '.cermxml'
 TXT_extension = '.txt'
 
+RE_PARAGRAPH_BREAK = re.compile('[\n]{2,}')
+# words split by a hyphen at a line-break (but this also de-hyphens hyphenated words broken up by a line-break)
+RE_SPLIT_WORD = re.compile(r'([a-zA-Z])-\n([a-zA-Z])')
+
 ### ScienceDoc CLASS ###
 
+# everything the notebooks set on a ScienceDoc; attributes are left unset until they are given a value
+SCIENCEDOC_FIELDS = ('corpus_name', 'file_name', 'has_text', 'has_xml',
+                     'raw_contents', 'xml_root', 'xml_contents',
+                     'title', 'year', 'journal', 'authors', 'affiliations', 'countries',
+                     'use_xml', 'methods_sections', 'relevant_text',
+                     'title_locations', 'content_locations', 'content_locations_filtered', 'location_sentences',
+                     'locate_error')
+# the fields written to a corpus store: the xml tree can always be re-read from the .cermxml file, and
+# a locate error only concerns the run it happened in
+CORPUS_STORE_FIELDS = tuple(field for field in SCIENCEDOC_FIELDS if field not in ('xml_root', 'locate_error'))
+
 class ScienceDoc:
+    __slots__ = SCIENCEDOC_FIELDS
+
     def __init__(self, corpus_name, file_name, has_text=False, has_xml=False):
         self.corpus_name = corpus_name
         self.file_name = file_name
         self.has_text = has_text
         self.has_xml= has_xml
 
+    def __getstate__(self):
+        return {field: getattr(self, field) for field in SCIENCEDOC_FIELDS if hasattr(self, field)}
+
+    def __setstate__(self, state):
+        # ScienceDocs pickled before __slots__ was added have their attributes in a plain dict too
+        for field, value in state.items():
+            setattr(self, field, value)
+
 
 ### GENERAL FUNCTIONS ###
 
@@ -43,10 +72,85 @@ def pickle_data(data, pathToPickleFile):
     print("pickled data at " + pathToPickleFile)
     return True
 
+def save_corpus(documents, path_to_store):
+    """
+    Appends ScienceDocs to a corpus store, a directory with one file per field (see columnstore),
+    creating it if needed. Unlike pickle_data, the store can be opened instantly and read one
+    field at a time.
+    Example use: save_corpus(documents, 'science_articles_store')
+    :param documents: iterable of ScienceDoc
+    :param path_to_store: directory of the store
+    :return: number of documents written
+    """
+    count = 0
+    with columnstore.ColumnWriter(path_to_store, CORPUS_STORE_FIELDS) as writer:
+        for doc in documents:
+            writer.append(doc.__getstate__())
+            count += 1
+    print("stored %s documents at %s" % (count, path_to_store))
+    return count
+
+class CorpusStore(columnstore.ColumnStore):
+    """
+    A corpus store opened for reading. Fields are read lazily, per document:
+        store = CorpusStore('science_articles_store')
+        texts = store.column('relevant_text')  # nothing read yet
+        texts[10]  # only this one value is read
+        doc = store[10]  # a whole ScienceDoc
+        docs = store.documents(fields=['file_name', 'title'])  # lightweight ScienceDocs
+    """
+    def document(self, i, fields=None):
+        """
+        Returns the ScienceDoc at position i, with only the given fields set (default all stored fields).
+        """
+        doc = ScienceDoc.__new__(ScienceDoc)
+        doc.__setstate__(self.row(i, fields))
+        return doc
+
+    def documents(self, fields=None):
+        """
+        Yields the ScienceDocs in the store one by one, with only the given fields set.
+        """
+        for i in range(len(self)):
+            yield self.document(i, fields)
+
+    def __getitem__(self, i):
+        return self.document(i)
+
+    def __iter__(self):
+        return self.documents()
+
 def remove_extension(filename):
     if filename:
         return str(filename).rsplit(sep='.', maxsplit=1)[0]
-    return np.NaN
+    return float('nan')
+
+
+### PARAGRAPH FUNCTIONS ###
+
+@functools.lru_cache(maxsize=8)
+def split_paragraphs(text):
+    """
+    Splits raw text into 'paragraphs' on two or more line-break chars, with split words fixed.
+    The result is cached for the last few documents, so trying out several methods regular
+    expressions or par_range values on an article only splits it once.
+    :param text: the full raw text contents of an article
+    :return: tuple of paragraph strings, still containing their single line-breaks
+    """
+    # a split word never spans a paragraph break, so we can fix them all in one go
+    return tuple(RE_PARAGRAPH_BREAK.split(RE_SPLIT_WORD.sub(r'\1\2', text)))
+
+def join_paragraphs(pars):
+    """
+    Joins paragraphs into one string, each followed by a paragraph break (two line-breaks).
+    """
+    return ''.join(par + '\n\n' for par in pars)
+
+def xml_paragraph_text(par):
+    """
+    Returns the text of a p node: its own text plus the tails of its (xref) child nodes.
+    """
+    return (par.text or '') + ''.join(' ' + (child.tail or '') for child in par)
 
 
 ### XML PROCESSING FUNCTIONS ###
@@ -69,6 +173,7 @@ def get_journal_title(xml_root):
             if child.tag == 'journal-title':
                 return child.text
 
+@instrument.timed()
 def extract_content_text(xml_root):
     """
     Returns all sections under a p node. After each identified p section, adds a
@@ -76,12 +181,8 @@ def extract_content_text(xml_root):
     :param xml_root: root of xml parse
     :return: the content as a string
     """
-    xml_par_text = ''
-    for par in xml_root.iter('p'):
-        if par:
-            xml_par_text += par.text
-            xml_par_text += '\n\n'
-    return xml_par_text
+    # only p nodes with child nodes count (the truth value of an element is whether it has children)
+    return join_paragraphs(par.text or '' for par in xml_root.iter('p') if len(par))
 
 def get_article_authors_affiliations(xml_root):
     """
@@ -132,3 +233,107 @@ def get_affiliation_countries(xml_root):
                             country = aff_child.attrib['country']
                             countries.append(country)
     return countries
+
+
+### SINGLE-PASS XML PROCESSING ###
+
+# elements whose whole subtree we need when they end: everything else is dropped as it streams past
+_XML_METADATA_GROUPS = ('title-group', 'pub-date', 'journal-title-group', 'contrib-group')
+# metadata group: (record field, child node holding it)
+_XML_FIELDS = {'title-group': ('title', 'article-title'),
+               'pub-date': ('year', 'year'),
+               'journal-title-group': ('journal', 'journal-title')}
+
+@instrument.timed(size=instrument.file_size)
+def extract_xml_fields(xml_source, re_to_match=None, par_range=3):
+    """
+    Reads a Cermine xml file in one incremental pass and returns everything the separate
+    functions above (and geoparse.extract_methods_xml) extract, with the same results. Elements
+    are dropped from the tree as soon as they've been dealt with, so memory use doesn't
+    grow with the size of the document, and no xml_root needs to be kept afterwards.
+    :param xml_source: path to (or file object of) the xml produced by Cermine
+    :param re_to_match: methods headings regular expression (e.g. geoparse.RE_ORCHARDS_METHODS_HEADINGS);
+    if None, methods sections are not looked for
+    :param par_range: how many paragraphs to keep after each methods heading
+    :return: a dict with keys title, year, journal, xml_contents, authors, affiliations,
+    countries and methods, the latter a list of (section_title, text_contents) tuples
+    """
+    record = {'title': None, 'year': None, 'journal': None, 'xml_contents': '',
+              'authors': [], 'affiliations': {}, 'countries': [], 'methods': []}
+    found = set()  # which of title, year, journal we already have: the first one wins
+    content_pars = []
+    sections = []  # one [sec element, section title, paragraphs, found methods] per sec, in document order
+    open_sections = []
+    path = []
+    keep_depth = 0  # number of open metadata groups, whose subtrees we can't drop yet
+    for event, elem in ET.iterparse(xml_source, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            path.append(elem)
+            if tag in _XML_METADATA_GROUPS:
+                keep_depth += 1
+            elif tag == 'sec' and re_to_match is not None:
+                section = [elem, '', [], False]
+                sections.append(section)
+                open_sections.append(section)
+            continue
+        path.pop()
+        parent = path[-1] if path else None
+        if tag == 'p':
+            # only p nodes with child nodes count here, as in extract_content_text
+            if len(elem):
+                content_pars.append(elem.text or '')
+            if open_sections and open_sections[-1][0] is parent:
+                section = open_sections[-1]
+                if section[3] and len(section[2]) < par_range:
+                    section[2].append(xml_paragraph_text(elem))
+        elif tag == 'title':
+            if open_sections and open_sections[-1][0] is parent:
+                section = open_sections[-1]
+                if not section[3] and re.match(re_to_match, (elem.text or '').lower()):
+                    section[1] = elem.text
+                    section[3] = True
+        elif tag == 'sec':
+            if open_sections and open_sections[-1][0] is elem:
+                open_sections.pop()
+        elif tag in _XML_METADATA_GROUPS:
+            keep_depth -= 1
+            if not keep_depth:
+                _read_metadata_group(elem, record, found)
+        # children of a p are needed for its text when the p itself ends
+        if not keep_depth and parent is not None and parent.tag != 'p':
+            elem.clear()
+            # everything before elem has already been removed, so this is cheap
+            parent.remove(elem)
+    record['xml_contents'] = join_paragraphs(content_pars)
+    record['methods'] = [(section[1], join_paragraphs(section[2])) for section in sections if section[3]]
+    return record
+
+def _read_metadata_group(group, record, found):
+    if group.tag == 'contrib-group':
+        for contrib_child in group:
+            if contrib_child.tag == 'contrib':
+                name = contrib_child.find('string-name').text
+                refs = [ref.text for ref in contrib_child.findall('xref')]
+                record['authors'].append((name, refs))
+            if contrib_child.tag == 'aff':
+                affiliation = []
+                label = 'none'
+                for aff_child in contrib_child:
+                    if aff_child.tag == 'label':
+                        label = aff_child.text
+                    else:
+                        affiliation.append(aff_child.text)
+                    if aff_child.tag == 'country' and 'country' in aff_child.attrib:
+                        record['countries'].append(aff_child.attrib['country'])
+                record['affiliations'][label] = affiliation
+    for nested_group in group.iter():
+        if nested_group.tag in _XML_FIELDS:
+            field, child_tag = _XML_FIELDS[nested_group.tag]
+            if field in found:
+                continue
+            for child in nested_group:
+                if child.tag == child_tag:
+                    record[field] = child.text
+                    found.add(field)
+                    break
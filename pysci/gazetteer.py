@@ -0,0 +1,258 @@
+# Offline geocoding against a local GeoNames gazetteer, as a drop-in for the googlemaps client
+import os
+import re
+import math
+import sqlite3
+import threading
+import functools
+import unicodedata
+
+# columns of a GeoNames dump (allCountries.txt, or a single country file), see
+# http://download.geonames.org/export/dump/readme.txt
+GEONAMES_COLUMNS = ['geonameid', 'name', 'asciiname', 'alternatenames', 'latitude', 'longitude',
+                    'feature_class', 'feature_code', 'country_code', 'cc2', 'admin1_code', 'admin2_code',
+                    'admin3_code', 'admin4_code', 'population', 'elevation', 'dem', 'timezone',
+                    'modification_date']
+# bundled tiny gazetteer, enough to try things out without downloading GeoNames
+SAMPLE_GAZETTEER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'data', 'gazetteer_sample.tsv')
+
+# feature codes of the rows giving names to countries and first-level admin divisions
+COUNTRY_CODES = ('PCLI', 'PCLD', 'PCLF', 'PCLS', 'PCLIX', 'PCL', 'TERR')
+ADMIN1_CODE = 'ADM1'
+# how much each feature code counts when ranking candidates with the same name
+FEATURE_WEIGHTS = {'PCLI': 3.0, 'PPLC': 3.0, 'ADM1': 2.5, 'PPLA': 2.0, 'ADM2': 1.5, 'PPLA2': 1.5,
+                   'PPLA3': 1.2, 'ADM3': 1.0, 'PPL': 1.0}
+FEATURE_CLASS_WEIGHTS = {'A': 0.8, 'P': 0.8, 'H': 0.5, 'T': 0.5, 'L': 0.4}
+# each place name given after a comma which matches the candidate's admin1 or country
+CONTEXT_WEIGHT = 10.0
+# words dropped from either end of a query which doesn't match as it is,
+# e.g. "Northeastern Miyun County" is looked up as "Miyun"
+NAME_QUALIFIERS = frozenset(['north', 'south', 'east', 'west', 'northern', 'southern', 'eastern', 'western',
+                             'northeast', 'northwest', 'southeast', 'southwest', 'northeastern',
+                             'northwestern', 'southeastern', 'southwestern', 'central', 'the', 'of',
+                             'county', 'city', 'district', 'province', 'region', 'state', 'town',
+                             'village', 'municipality', 'prefecture', 'township', 'area'])
+
+RE_NOT_WORD = re.compile(r'[\W_]+')
+
+def normalize_name(name):
+    """
+    Normalizes a place name for lookups: no accents, lower case, punctuation and runs of
+    spaces turned into single spaces. Non-latin scripts are kept as they are.
+    """
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return RE_NOT_WORD.sub(' ', stripped.casefold()).strip()
+
+### BUILDING THE INDEX ###
+
+def read_geonames(gazetteer_path):
+    """
+    Yields the rows of a GeoNames dump as dicts keyed by GEONAMES_COLUMNS.
+    """
+    with open(gazetteer_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            yield dict(zip(GEONAMES_COLUMNS, line.rstrip('\r\n').split('\t')))
+
+def _row_names(row):
+    names = [row['name'], row['asciiname']]
+    names.extend(name for name in row['alternatenames'].split(',') if not name.startswith('http'))
+    return set(normalize_name(name) for name in names if name) - {''}
+
+def build_gazetteer_index(gazetteer_path, index_path, feature_classes=None, min_population=0,
+                          batch_size=50000, verbose=False):
+    """
+    Builds the SQLite index used by GazetteerGeocoder from a GeoNames dump, streaming it so a
+    full allCountries.txt needs little memory. The index holds one row per place, one row per
+    (normalized name, place), and the names of countries and admin1 divisions for addresses.
+    :param gazetteer_path: path to the tab-separated GeoNames dump
+    :param index_path: path of the index file to write; an existing index is replaced
+    :param feature_classes: feature classes to keep, e.g. 'APL', default all
+    :param min_population: leave out populated places (class P) with a smaller population
+    :param batch_size: rows inserted per transaction
+    :return: number of places indexed
+    """
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    conn = sqlite3.connect(index_path)
+    conn.execute('CREATE TABLE places (geonameid INTEGER PRIMARY KEY, name TEXT, lat REAL, lng REAL, '
+                 'feature_class TEXT, feature_code TEXT, country_code TEXT, admin1_code TEXT, '
+                 'population INTEGER)')
+    conn.execute('CREATE TABLE names (name TEXT, geonameid INTEGER)')
+    conn.execute('CREATE TABLE admin (code TEXT PRIMARY KEY, name TEXT)')
+    places = []
+    names = []
+    admin = {}
+    count = 0
+
+    def insert():
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO places VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', places)
+            conn.executemany('INSERT INTO names VALUES (?, ?)', names)
+        del places[:]
+        del names[:]
+
+    for row in read_geonames(gazetteer_path):
+        if feature_classes and row['feature_class'] not in feature_classes:
+            continue
+        population = int(row['population'] or 0)
+        if row['feature_class'] == 'P' and population < min_population:
+            continue
+        geonameid = int(row['geonameid'])
+        if row['feature_code'] in COUNTRY_CODES:
+            admin[row['country_code']] = row['name']
+        elif row['feature_code'] == ADMIN1_CODE:
+            admin[row['country_code'] + '.' + row['admin1_code']] = row['name']
+        places.append((geonameid, row['name'], float(row['latitude']), float(row['longitude']),
+                       row['feature_class'], row['feature_code'], row['country_code'], row['admin1_code'],
+                       population))
+        names.extend((name, geonameid) for name in _row_names(row))
+        count += 1
+        if len(places) >= batch_size:
+            insert()
+            if verbose:
+                print("Indexed %d places" % count)
+    insert()
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO admin VALUES (?, ?)', admin.items())
+        # built after the inserts, which is much faster than keeping it up to date row by row
+        conn.execute('CREATE INDEX names_name ON names (name)')
+    conn.close()
+    if verbose:
+        print("Indexed %d places from %s into %s" % (count, gazetteer_path, index_path))
+    return count
+
+def index_words(index_path, min_population=15000):
+    """
+    Single-word names of the bigger places of a gazetteer index, e.g. for geoparse.SentencePrefilter:
+    countries, admin1 divisions, and places with at least min_population inhabitants.
+    :return: set of normalized names
+    """
+    codes = COUNTRY_CODES + (ADMIN1_CODE,)
+    conn = sqlite3.connect(index_path)
+    try:
+        rows = conn.execute('SELECT DISTINCT n.name FROM names n JOIN places p ON p.geonameid = n.geonameid '
+                            'WHERE instr(n.name, \' \') = 0 AND (p.population >= ? OR p.feature_code IN (%s))'
+                            % ', '.join('?' * len(codes)), (min_population,) + codes).fetchall()
+    finally:
+        conn.close()
+    return set(row[0] for row in rows)
+
+### GEOCODING ###
+
+class GazetteerGeocoder:
+    """
+    Geocoder answering from a gazetteer index built by build_gazetteer_index, with no network
+    access. Its geocode() returns results shaped like the googlemaps client's (geometry.location
+    lat/lng, formatted_address, location_type, ...), so it can be passed wherever a
+    googlemaps.Client is, e.g. to geocode.geocode_with_cache_google or geocode.geocode_batch.
+    Queries are matched on the normalized name before the first comma; names after it
+    ("Paris, Texas", "Centre County, PA") favour candidates in that admin1 division or country.
+    Example use:
+        build_gazetteer_index('allCountries.txt', 'geonames.sqlite', feature_classes='APL')
+        geocoder = GazetteerGeocoder('geonames.sqlite')
+        top = geocode.geocode_with_cache_google(clean_text, geocoder, cache, delay=0)
+    """
+    def __init__(self, index_path, max_results=1, cache_size=100000):
+        """
+        :param index_path: path to the index file
+        :param max_results: maximum number of results returned per query, best first; keep it at 1
+            with geocode.geocode_google, which takes the last result of the list
+        :param cache_size: number of queries whose answers are kept in memory
+        """
+        self.index_path = index_path
+        self.max_results = max_results
+        # geocode_batch calls geocode from several threads
+        self.conn = sqlite3.connect(index_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.admin = dict(self.conn.execute('SELECT code, name FROM admin'))
+        self._lookup = functools.lru_cache(maxsize=cache_size)(self._lookup_uncached)
+
+    @classmethod
+    def from_gazetteer(cls, gazetteer_path, index_path, **kwargs):
+        """
+        Builds the index for a gazetteer dump if it doesn't exist yet, then opens it.
+        """
+        if not os.path.isfile(index_path):
+            build_gazetteer_index(gazetteer_path, index_path)
+        return cls(index_path, **kwargs)
+
+    def _candidates(self, name):
+        with self.lock:
+            return self.conn.execute('SELECT p.geonameid, p.name, p.lat, p.lng, p.feature_class, p.feature_code, '
+                                     'p.country_code, p.admin1_code, p.population FROM names n '
+                                     'JOIN places p ON p.geonameid = n.geonameid WHERE n.name = ?',
+                                     (name,)).fetchall()
+
+    def _find(self, name):
+        # the name as it is, then with qualifiers dropped from either end until something matches
+        words = name.split()
+        while words:
+            candidates = self._candidates(' '.join(words))
+            if candidates:
+                return candidates
+            if words[0] in NAME_QUALIFIERS:
+                words = words[1:]
+            elif words[-1] in NAME_QUALIFIERS:
+                words = words[:-1]
+            else:
+                break
+        return []
+
+    def _context_names(self, candidate):
+        country_code, admin1_code = candidate[6], candidate[7]
+        admin1_key = country_code + '.' + admin1_code
+        names = {country_code.lower(), admin1_code.lower()}
+        for key in (country_code, admin1_key):
+            if key in self.admin:
+                names.add(normalize_name(self.admin[key]))
+        return names
+
+    def _score(self, candidate, context):
+        feature_class, feature_code, population = candidate[4], candidate[5], candidate[8]
+        score = FEATURE_WEIGHTS.get(feature_code, FEATURE_CLASS_WEIGHTS.get(feature_class, 0.0))
+        score += math.log10(population + 1) / 10
+        if context:
+            score += CONTEXT_WEIGHT * len(context & self._context_names(candidate))
+        return score
+
+    def _result(self, candidate):
+        geonameid, name, lat, lng, feature_class, feature_code, country_code, admin1_code = candidate[:8]
+        address = [name]
+        for key in (country_code + '.' + admin1_code, country_code):
+            admin_name = self.admin.get(key)
+            if admin_name and admin_name != address[-1]:
+                address.append(admin_name)
+        return {'formatted_address': ', '.join(address),
+                'geometry': {'location': {'lat': lat, 'lng': lng}, 'location_type': 'APPROXIMATE'},
+                'place_id': 'geonames:%d' % geonameid,
+                'types': [feature_class, feature_code],
+                'address_components': [{'long_name': address_name} for address_name in address]}
+
+    def _lookup_uncached(self, query):
+        parts = [normalize_name(part) for part in query.split(',')]
+        parts = [part for part in parts if part]
+        if not parts:
+            return ()
+        candidates = self._find(parts[0])
+        context = set(parts[1:])
+        ranked = sorted(candidates, key=lambda candidate: -self._score(candidate, context))
+        return tuple(self._result(candidate) for candidate in ranked[:self.max_results])
+
+    def geocode(self, address, max_results=None):
+        """
+        Geocodes a place name, like googlemaps.Client.geocode.
+        :param address: the text to geocode
+        :param max_results: maximum number of results, default the geocoder's max_results
+        :return: list of results, best first; empty if nothing matched
+        """
+        results = list(self._lookup(address))
+        if max_results is not None:
+            results = results[:max_results]
+        return results
+
+    def close(self):
+        self.conn.close()
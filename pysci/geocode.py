@@ -1,7 +1,39 @@
+import re
+import sys
+import json
 import time
-import googlemaps
+import random
+import sqlite3
+import threading
+import unicodedata
+import collections
+import concurrent.futures
+
+from pysci import docutils as du
+from pysci import geoparse as gp
+from pysci import instrument
 
 NO_RESULT_STRING = 'no-geocode-result'
+_MISSING = object()
+# anything but letters, digits, spaces and the commas separating the parts of an address
+RE_CANONICAL_PUNCTUATION = re.compile(r'[^\w\s,]+')
+# feature types canonical_key keeps at the end of a name, as the name without them is another place
+# ("Mexico City", "Kansas City", "Washington State"), or a water or landform feature ("Ohio River")
+CANONICAL_KEPT_FEATURE_TYPES = frozenset(['city', 'state', 'river', 'rivers', 'coast', 'coasts', 'park', 'parks'])
+# one-word names of admin divisions (US states, Canadian provinces, Australian states, and countries with
+# namesakes after a cardinal direction): after a cardinal direction they are the name of another division
+# or a region of their own ("West Virginia", "Southern Ontario"), so canonical_key keeps the direction
+CANONICAL_ADMIN_NAMES = frozenset(['alabama', 'alaska', 'arizona', 'arkansas', 'california', 'colorado',
+                                   'connecticut', 'delaware', 'florida', 'georgia', 'hawaii', 'idaho', 'illinois',
+                                   'indiana', 'iowa', 'kansas', 'kentucky', 'louisiana', 'maine', 'maryland',
+                                   'massachusetts', 'michigan', 'minnesota', 'mississippi', 'missouri', 'montana',
+                                   'nebraska', 'nevada', 'ohio', 'oklahoma', 'oregon', 'pennsylvania', 'tennessee',
+                                   'texas', 'utah', 'vermont', 'virginia', 'washington', 'wisconsin', 'wyoming',
+                                   'carolina', 'dakota', 'alberta', 'manitoba', 'ontario', 'quebec', 'saskatchewan',
+                                   'yukon', 'nunavut', 'queensland', 'victoria', 'tasmania', 'australia', 'africa',
+                                   'america', 'korea', 'sudan', 'macedonia', 'ireland', 'cyprus', 'ossetia',
+                                   'timor', 'holland', 'brabant', 'sumatra', 'java', 'kalimantan', 'sulawesi',
+                                   'bengal', 'darfur', 'kordofan'])
 
 def clean_for_geocode(orig_str):
     """
@@ -22,7 +54,131 @@ def clean_for_geocode(orig_str):
         prev_len = len(clean_str)
     return clean_str
 
+### CANONICAL QUERIES ###
+
+def canonical_key(query_text):
+    """
+    Canonical form of a location string, shared by its variants: pdfminer's split accents and
+    ligatures fixed (geoparse.multireplace), then accents dropped, case folded, punctuation
+    other than commas and runs of spaces made single spaces, and in each comma-separated part,
+    trailing cardinal directions and feature types (geoparse's token lists) and a leading
+    cardinal direction dropped. So "Northeastern Miyun County (" and "Miyun County" both give
+    "miyun". Words are only dropped where the rest isn't the name of another place:
+    - "city", "state", and water and landform types are kept (CANONICAL_KEPT_FEATURE_TYPES), so
+      "Mexico City" isn't "Mexico", nor "Ohio River" "Ohio"
+    - no feature type is dropped where a single admin division name (CANONICAL_ADMIN_NAMES) would
+      be left, so "Washington County" isn't "Washington"
+    - a leading cardinal direction is only dropped from a part of more than two words, as in short
+      names it is part of the name ("North Carolina"), and only if a single word is left which
+      isn't an admin division name (CANONICAL_ADMIN_NAMES), so "North Carolina State University"
+      isn't "South Carolina State University", nor "Southern Ontario region" "Ontario"
+    :return: the key, or the string itself if nothing is left of it
+    """
+    decomposed = unicodedata.normalize('NFKD', gp.multireplace(query_text))
+    folded = ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+    parts = []
+    for part in RE_CANONICAL_PUNCTUATION.sub(' ', folded).split(','):
+        words = part.split()
+        n_words = len(words)
+        while len(words) > 1:
+            if words[-1] in gp.CARDINAL_DIRECTION_TOKENS:
+                words = words[:-1]
+            elif (words[-1] in gp.FEATURE_TYPE_TOKENS and words[-1] not in CANONICAL_KEPT_FEATURE_TYPES
+                  and not (len(words) == 2 and words[0] in CANONICAL_ADMIN_NAMES)):
+                words = words[:-1]
+            else:
+                break
+        if (n_words > 2 and len(words) == 2 and words[0] in gp.CARDINAL_DIRECTION_TOKENS
+                and words[1] not in CANONICAL_ADMIN_NAMES):
+            words = words[1:]
+        if words:
+            parts.append(' '.join(words))
+    return ', '.join(parts) or query_text
+
+class CanonicalIndex:
+    """
+    Index of location strings by canonical_key, so that all the variants of a location are
+    geocoded once: one of them is sent to the geocoder, and its result fans out to the others.
+    Example use:
+        index = CanonicalIndex(queries)
+        to_send = index.queries(cache)
+        results = index.fan_out(dict(zip(to_send, geocode_batch(to_send, geocoder, cache))))
+        top_results = [results[query] for query in queries]
+    """
+    def __init__(self, query_texts=()):
+        self.keys = {}  # variant: key
+        self.variants = {}  # key: Counter of its variants, in the order they were first seen
+        self.rows = 0
+        self.add_all(query_texts)
+
+    def add(self, query_text):
+        """
+        Adds a location string, counting its occurrences.
+        :return: its key
+        """
+        self.rows += 1
+        key = self.keys.get(query_text)
+        if key is None:
+            key = self.keys[query_text] = canonical_key(query_text)
+            if key not in self.variants:
+                self.variants[key] = collections.Counter()
+        self.variants[key][query_text] += 1
+        return key
+
+    def add_all(self, query_texts):
+        for query_text in query_texts:
+            self.add(query_text)
+
+    def representative(self, key, cache=None):
+        """
+        The variant of a key to geocode: one already in the cache if any, else the most frequent,
+        the first seen of those.
+        """
+        variants = self.variants[key]
+        if cache is not None:
+            for query_text in variants:
+                if query_text in cache:
+                    return query_text
+        return max(variants, key=variants.get)
+
+    def queries(self, cache=None):
+        """
+        :return: the variants to geocode, one per key
+        """
+        return [self.representative(key, cache) for key in self.variants]
+
+    def fan_out(self, results):
+        """
+        :param results: dict of result per variant geocoded (see queries)
+        :return: dict of result per variant, for every variant of a key with a result
+        """
+        by_key = {self.keys[query_text]: result for query_text, result in results.items()}
+        return {query_text: by_key[key] for query_text, key in self.keys.items() if key in by_key}
+
+    def report(self):
+        """
+        :return: dict with the numbers of strings added (rows), distinct strings (variants),
+        keys, and the dedup ratio: distinct strings per key, the lookups saved being 1 - 1 / ratio
+        """
+        return {'rows': self.rows, 'variants': len(self.keys), 'keys': len(self.variants),
+                'dedup_ratio': len(self.keys) / len(self.variants) if self.variants else 1.0}
+
+def geocode_canonical(query_texts, geocoder, cache=None, **kwargs):
+    """
+    Same as geocode_batch, but geocoding each canonical form (see canonical_key) of the queries
+    once, with the result of one variant for all of them. The cache holds the variants geocoded.
+    :param kwargs: as for geocode_batch
+    :return: list of top results aligned with query_texts
+    """
+    index = CanonicalIndex(query_texts)
+    to_send = index.queries(cache)
+    instrument.count('geocode.canonical_queries', len(to_send))
+    results = index.fan_out(dict(zip(to_send, geocode_batch(to_send, geocoder, cache=cache, **kwargs))))
+    return [results[query_text] for query_text in query_texts]
+
 def create_google_geocoder(api_key):
+    # imported here, so offline runs (e.g. with gazetteer.GazetteerGeocoder) never load googlemaps
+    import googlemaps
     #gmaps_geocoder = googlemaps.Client(key=get_api_key(path_to_key))
     gmaps_geocoder = googlemaps.Client(key=api_key)
     return gmaps_geocoder
@@ -46,20 +202,330 @@ def geocode_google(querytext, geocoder, return_top=True):
             return geocode_result
     return []
 
-def geocode_with_cache_google(query_text, geocoder, cache, verbose=False):
+def geocode_with_cache_google(query_text, geocoder, cache, verbose=False, delay=0.2):
     """
-    Wrapper around geocode_google function which makes it check a cache first.
+    Wrapper around geocode_google function which makes it check a cache first. Queries without
+    a result are cached too, as NO_RESULT_STRING, so they aren't sent again.
+    To geocode many strings, geocode_batch is much faster.
     :param query_text: the string to geocode
     :param geocoder: googlemaps.Client object to do the geocoding with
-    :param cache: a dict of query_string:top_result
+    :param cache: a dict of query_string:top_result, or a SqliteGeocodeCache
+    :param delay: seconds to wait after each query sent to the geocoder
+    :return: the top result, or an empty list if there was none
     """
-    if query_text in cache:
+    stats = getattr(cache, 'stats', None)
+    start = time.time()
+    cached = cache.get(query_text, _MISSING)
+    if stats is not None:
+        stats.lookup_seconds += time.time() - start
+    if cached is not _MISSING:
         if verbose:
             print("We had a cached result.")
-        return cache[query_text]
+        if stats is not None:
+            stats.hits += 1
+        instrument.count('geocode.cache_hits')
+        # older caches stored an empty list for no result
+        return [] if cached == NO_RESULT_STRING else cached
     else:
-        top_result = geocode_google(query_text, geocoder)
-        time.sleep(0.2)
+        start = time.time()
+        with instrument.timer('geocode.query'):
+            top_result = geocode_google(query_text, geocoder)
+        if stats is not None:
+            stats.misses += 1
+            stats.geocode_seconds += time.time() - start
+        instrument.count('geocode.cache_misses')
+        time.sleep(delay)
         # add to cache
-        cache[query_text] = top_result
+        cache[query_text] = top_result if top_result else NO_RESULT_STRING
         return top_result
+
+### BATCH GEOCODING ###
+
+# googlemaps errors worth trying again after a pause (names in googlemaps.exceptions)
+RETRIABLE_ERRORS = ('Timeout', 'TransportError', '_RetriableRequest')
+RETRIABLE_STATUSES = ('OVER_QUERY_LIMIT', 'UNKNOWN_ERROR')
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter: on average 'rate' calls to acquire() per second go
+    through, with bursts of up to 'capacity' calls.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def is_retriable(error):
+    """
+    Whether a geocoding error is worth retrying: timeouts, transport errors and quota errors.
+    """
+    exceptions = sys.modules.get('googlemaps.exceptions')
+    if exceptions is None:
+        # googlemaps was never imported, so this can't be one of its errors
+        return False
+    if isinstance(error, exceptions.HTTPError):
+        # client errors won't go away by trying again, except for too many requests
+        return error.status_code >= 500 or error.status_code == 429
+    if isinstance(error, tuple(getattr(exceptions, name) for name in RETRIABLE_ERRORS)):
+        return True
+    return isinstance(error, exceptions.ApiError) and error.status in RETRIABLE_STATUSES
+
+def geocode_with_retry(query_text, geocoder, rate_limiter=None, max_retries=5, backoff=1.0):
+    """
+    Geocodes one string, retrying retriable errors with exponential backoff (plus jitter).
+    :param rate_limiter: optional TokenBucket to wait on before each attempt
+    :param max_retries: how many times to retry before giving up and raising the error
+    :param backoff: seconds to wait before the first retry, doubled for each further retry
+    :return: the top result, or an empty list if there was none
+    """
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            with instrument.timer('geocode.query'):
+                return geocode_google(query_text, geocoder)
+        except Exception as e:
+            if attempt >= max_retries or not is_retriable(e):
+                raise
+            instrument.count('geocode.retries')
+            time.sleep(backoff * (2 ** attempt) * (1 + random.random()))
+            attempt += 1
+
+def geocode_batch(query_texts, geocoder, cache=None, max_workers=8, rate=10.0, burst=1,
+                  max_retries=5, backoff=1.0, verbose=False):
+    """
+    Geocodes a whole list of (cleaned) location strings. Duplicates are only looked up once,
+    cached strings are not sent at all, and the rest are sent concurrently from a thread pool,
+    at most 'rate' queries per second. Retriable errors are retried with backoff.
+    :param query_texts: list of strings to geocode
+    :param geocoder: googlemaps.Client, or any object with a geocode(query) method returning a list of results
+    :param cache: optional dict or SqliteGeocodeCache, read and updated as in geocode_with_cache_google
+    :param max_workers: number of queries in flight at once
+    :param rate: maximum queries per second, within our quota
+    :param burst: number of queries which may be sent at once after a quiet spell
+    :param max_retries: retries per query for retriable errors
+    :param backoff: seconds to wait before the first retry of a query
+    :param verbose: print the queries which failed
+    :return: list of top results aligned with query_texts, an empty list where there was no result.
+    Queries which still failed after retrying also get an empty list, but are not cached.
+    """
+    results = {}
+    misses = []
+    stats = getattr(cache, 'stats', None)
+    # dict keeps the first-seen order
+    for query_text in dict.fromkeys(query_texts):
+        cached = _MISSING
+        if cache is not None:
+            start = time.time()
+            cached = cache.get(query_text, _MISSING)
+            if stats is not None:
+                stats.lookup_seconds += time.time() - start
+        if cached is _MISSING:
+            misses.append(query_text)
+        else:
+            if stats is not None:
+                stats.hits += 1
+            instrument.count('geocode.cache_hits')
+            results[query_text] = [] if cached == NO_RESULT_STRING else cached
+    rate_limiter = TokenBucket(rate, burst)
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(geocode_with_retry, query_text, geocoder, rate_limiter, max_retries, backoff): query_text
+                   for query_text in misses}
+        # the cache is only touched from this thread
+        for future in concurrent.futures.as_completed(futures):
+            query_text = futures[future]
+            try:
+                top_result = future.result()
+            except Exception as e:
+                if verbose:
+                    print("Failed to geocode %s: %r" % (query_text, e))
+                instrument.count('geocode.failures')
+                results[query_text] = []
+                continue
+            results[query_text] = top_result
+            if cache is not None:
+                cache[query_text] = top_result if top_result else NO_RESULT_STRING
+    if stats is not None:
+        stats.misses += len(misses)
+        stats.geocode_seconds += time.time() - start
+    instrument.count('geocode.cache_misses', len(misses))
+    instrument.record('geocode.batch', time.time() - start)
+    return [results[query_text] for query_text in query_texts]
+
+### PERSISTENT CACHE ###
+
+class CacheStats:
+    """
+    Counters for a geocode cache: hits and misses, and the time spent looking up the cache
+    and geocoding the misses.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+        self.geocode_seconds = 0.0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __repr__(self):
+        return ("CacheStats(hits=%s, misses=%s, hit_rate=%0.3f, lookup_seconds=%0.3f, geocode_seconds=%0.3f)"
+                % (self.hits, self.misses, self.hit_rate(), self.lookup_seconds, self.geocode_seconds))
+
+class SqliteGeocodeCache:
+    """
+    Geocode cache in a local SQLite file, usable wherever a dict cache is (e.g. in
+    geocode_with_cache_google). Every result is written through as soon as it is set, so
+    nothing is lost if a run crashes, and several processes can share one cache file.
+    Entries can expire after a time to live, and the least recently used are evicted
+    once the cache holds more than max_entries (only then are reads written to the file,
+    to track when each entry was last used).
+    Example use:
+        cache = SqliteGeocodeCache('geocode_cache.sqlite', ttl=90 * 24 * 3600)
+        cache.import_pickle('local_cache_google.pkl')
+        top = geocode_with_cache_google(clean_text, gmaps, cache)
+        print(cache.stats)
+    """
+    def __init__(self, path, ttl=None, max_entries=None, timeout=60.0):
+        """
+        :param path: path to the SQLite file, created if needed
+        :param ttl: seconds after which an entry is treated as missing, None to keep entries forever
+        :param max_entries: maximum number of entries to keep, None for no limit
+        :param timeout: seconds to wait for another process holding a lock on the file
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        # autocommit: every write is its own transaction
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS geocode_cache (query TEXT PRIMARY KEY, result TEXT NOT NULL, '
+                          'created REAL NOT NULL, accessed REAL NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS geocode_cache_accessed ON geocode_cache (accessed)')
+        self._count = len(self)
+
+    def get(self, query, default=None):
+        row = self.conn.execute('SELECT result, created FROM geocode_cache WHERE query = ?', (query,)).fetchone()
+        now = time.time()
+        if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+            return default
+        if self.max_entries is not None:
+            # for the least recently used to be evicted first
+            self.conn.execute('UPDATE geocode_cache SET accessed = ? WHERE query = ?', (now, query))
+        return json.loads(row[0])
+
+    def __getitem__(self, query):
+        result = self.get(query, _MISSING)
+        if result is _MISSING:
+            raise KeyError(query)
+        return result
+
+    def __contains__(self, query):
+        # a read only, not counted as a use of the entry
+        row = self.conn.execute('SELECT created FROM geocode_cache WHERE query = ?', (query,)).fetchone()
+        return row is not None and (self.ttl is None or time.time() - row[0] <= self.ttl)
+
+    def __setitem__(self, query, result):
+        self.set_many([(query, result)])
+
+    def set_many(self, items):
+        """
+        Stores many (query, result) pairs in one transaction.
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            for query, result in items:
+                # replacing an entry doesn't add to the count
+                if self.conn.execute('SELECT 1 FROM geocode_cache WHERE query = ?', (query,)).fetchone() is None:
+                    self._count += 1
+                self.conn.execute('INSERT OR REPLACE INTO geocode_cache VALUES (?, ?, ?, ?)',
+                                  (query, json.dumps(result), now, now))
+        if self.max_entries is not None and self._count > self.max_entries:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes expired entries, then the least recently used ones beyond max_entries.
+        """
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            if self.ttl is not None:
+                self.conn.execute('DELETE FROM geocode_cache WHERE created < ?', (time.time() - self.ttl,))
+            if self.max_entries is not None:
+                self.conn.execute('DELETE FROM geocode_cache WHERE query IN (SELECT query FROM geocode_cache '
+                                  'ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+        self._count = len(self)
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM geocode_cache').fetchone()[0]
+
+    def keys(self):
+        return [row[0] for row in self.conn.execute('SELECT query FROM geocode_cache')]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(query, json.loads(result)) for query, result in
+                self.conn.execute('SELECT query, result FROM geocode_cache')]
+
+    def import_dict(self, cache_dict):
+        """
+        Copies the entries of a dict cache (as used with geocode_with_cache_google) into this cache.
+        Empty results are stored as NO_RESULT_STRING.
+        :return: number of entries imported
+        """
+        self.set_many((query, result if result else NO_RESULT_STRING) for query, result in cache_dict.items())
+        return len(cache_dict)
+
+    def merge(self, other_path):
+        """
+        Copies the entries of another cache file into this one, e.g. the caches of several
+        workers. Where both have an entry for a query, the most recently created one wins.
+        :param other_path: path to the other SqliteGeocodeCache file
+        :return: number of entries in the other cache
+        """
+        self.conn.execute('ATTACH DATABASE ? AS other', (other_path,))
+        try:
+            with self.conn:
+                self.conn.execute('BEGIN IMMEDIATE')
+                count = self.conn.execute('SELECT COUNT(*) FROM other.geocode_cache').fetchone()[0]
+                # "WHERE true" keeps the parser from reading ON CONFLICT as part of a join
+                self.conn.execute('INSERT INTO geocode_cache SELECT * FROM other.geocode_cache WHERE true '
+                                  'ON CONFLICT(query) DO UPDATE SET result = excluded.result, created = excluded.created, '
+                                  'accessed = max(accessed, excluded.accessed) WHERE excluded.created > created')
+        finally:
+            self.conn.execute('DETACH DATABASE other')
+        self._count = len(self)
+        if self.max_entries is not None and self._count > self.max_entries:
+            self.evict()
+        return count
+
+    def import_pickle(self, path_to_pickle):
+        """
+        Imports a dict cache pickled with docutils.pickle_data, e.g. 'local_cache_google.pkl'.
+        :return: number of entries imported
+        """
+        return self.import_dict(du.load_data(path_to_pickle))
+
+    def close(self):
+        self.conn.close()
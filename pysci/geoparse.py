@@ -1,7 +1,13 @@
 import re
-from nltk.tokenize.moses import MosesDetokenizer
+import time
+import functools
+import collections
 
-detokenizer = MosesDetokenizer()
+from pysci import docutils as du
+from pysci import instrument
+
+# NLTK takes a while to import, so it is only imported once something needs it (see below)
+_detokenizer = None
 
 ### STRINGS AND REGULAR EXPRESSIONS ###
 NO_METHODS_STRING = "no-methods-found"
@@ -13,35 +19,213 @@ RE_ORCHARDS_METHODS_TEXT = r'[0-9.]*[ \t]{0,2}(the )?(material|method|study[ \t]
 RE_BIOMED_METHODS_TEXT = r'[0-9.]*[ \t]{0,2}(the )?(material|method|(experimental procedure)|sample|tumor|tumour|patient|specimen|subject|population|human)'
 RE_ORCHARDS_METHODS_HEADINGS = r'[0-9.]*[ \t]{0,2}(the )?(material|method|location|region|study[ \t]{0,2}(area|site|region)|(\w+[ \t]{0,2}){0,2}(orchard|location))'
 RE_BIOMED_METHODS_HEADINGS = r'[0-9.]*[ \t]{0,2}(the )?(material|method|(experimental procedure)|(\w+[ \t]{0,2}){0,2}(tumor|tumour|patient|sample|specimen|subject|population|human))'
+# the raw-text heading pattern sets, for a HeadingDetector trying all of them at once
+METHODS_TEXT_PATTERNS = {'orchards': RE_ORCHARDS_METHODS_TEXT, 'biomed': RE_BIOMED_METHODS_TEXT}
+# fixes for characters pdfminer splits into a letter and an accent, and for ligatures
+DEFAULT_REPLACEMENTS = {"u¨ ":"ü","a¨ ":"ä","o¨ ":"ö","o ¨":"ö","o´ ":"ó","aˆ ": "â","oˆ ": "ô","u¨":"ü","a¨":"ä","o¨":"ö","a´":"á","e´":"é","o´":"ó","aˆ": "â","oˆ": "ô","i´":"í","ı´":"í", "a`":"à","o`":"ò","i`":"ì","u`":"ù","e`":"è","ﬂ":"fl","a˜":"ã","¨ı":"i","ó n ":"ón ","U´ ":"Ú"}
+# token lists and patterns of the location chunker (see Chunker)
+NER_CHUNK_TAGS = frozenset(['LOCATION', 'ORGANIZATION', 'PERSON'])
+CARDINAL_DIRECTION_TOKENS = frozenset(['east', 'west', 'south', 'north', 'eastern',
+                                       'western', 'southern', 'northern', 'central',
+                                       'northeast', 'northwest', 'southeast', 'southwest',
+                                       'northeastern', 'northwestern', 'southeastern', 'southwestern'])
+SPATIAL_LANGUAGE_TOKENS = frozenset(['along', 'near', 'at'])
+FEATURE_TYPE_TOKENS = frozenset(['region', 'regions', 'county', 'counties', 'park', 'parks',
+                                 'coast', 'coasts', 'town', 'city', 'state', 'states', 'river', 'rivers'])
+# chunks with a keep word are kept whatever their tags, chunks with a discard word (companies) never are
+CHUNK_KEEP_WORDS = frozenset(['hospital', 'hospitals', 'hopital', 'hôpital', 'clinic', 'clinics', 'clinique',
+                              'university', 'universities', 'universite', 'universität',
+                              'centre', 'centres', 'centro', 'center', 'centers',
+                              'college', 'colleges',
+                              'department', 'departments', 'departamento', 'departement',
+                              'institution', 'institutions', 'institute', 'institutes', 'institut', 'instituto'])
+CHUNK_DISCARD_WORDS = frozenset(['gmbh', 'inc', 'inc.'])
+RE_CHUNK_PUNCTUATION = r'[,()]|\'s'
+RE_CHUNK_ABBREVIATION = r'\b[A-Z][A-Z]\b'
+RE_CHUNK_PREPOSITION = r'\bin\b|\bthe\b|\bupon\b|\bof\b'
+RE_CHUNK_ET = r'^et$'
+RE_CHUNK_INITIALS = r'\b[A-Z][.]([A-Z][.]?){1,2}'
+# capitalized first words of sentences which aren't place names, for SentencePrefilter
+COMMON_SENTENCE_START_WORDS = frozenset(['a', 'an', 'the', 'this', 'that', 'these', 'those', 'it', 'its', 'we', 'our',
+                                         'they', 'their', 'there', 'here', 'in', 'on', 'at', 'of', 'for', 'from', 'to',
+                                         'by', 'with', 'within', 'after', 'before', 'during', 'between', 'among',
+                                         'all', 'each', 'every', 'both', 'one', 'two', 'three', 'four', 'five',
+                                         'some', 'most', 'many', 'several', 'no', 'as', 'if', 'when', 'while',
+                                         'where', 'which', 'however', 'moreover', 'furthermore', 'finally',
+                                         'first', 'second', 'then', 'thus', 'therefore', 'also', 'since',
+                                         'although', 'because', 'samples', 'data', 'plots', 'sites', 'patients',
+                                         'table', 'fig', 'figure', 'study', 'results', 'statistical', 'total'])
+# word_tokenize writes double quotes as `` and '', so these tokens may stand for a '"' in the text
+TOKEN_TEXT_ALTERNATIVES = {'``': ('``', '"'), "''": ("''", '"')}
 
 
 ### FUNCTIONS ###
 
-def multireplace(string, replacements={"u¨ ":"ü","a¨ ":"ä","o¨ ":"ö","o ¨":"ö","o´ ":"ó","aˆ ": "â","oˆ ": "ô","u¨":"ü","a¨":"ä","o¨":"ö","a´":"á","e´":"é","o´":"ó","aˆ": "â","oˆ": "ô","i´":"í","ı´":"í", "a`":"à","o`":"ò","i`":"ì","u`":"ù","e`":"è","ﬂ":"fl","a˜":"ã","¨ı":"i","ó n ":"ón ","U´ ":"Ú"}):
+def multireplace(string, replacements=DEFAULT_REPLACEMENTS):
     """
-    Given a string and a replacement map, it returns the replaced string.
+    Given a string and a replacement map, it returns the replaced string. The compiled
+    Replacer for each replacement map is cached, so only the first call with a map compiles it.
     :param str string: string to execute replacements on
     :param dict replacements: replacement dictionary {value to find: value to replace}
     :rtype: str
     """
-    # Create a big OR regex that matches any of the substrings to replace
-    regexp = re.compile('|'.join(map(re.escape, replacements)))
-    # For each match, look up the new string in the replacements
-    return regexp.sub(lambda match: replacements[match.group(0)], string)
+    return get_replacer(replacements).replace(string)
+
+def multireplace_all(strings, replacements=DEFAULT_REPLACEMENTS):
+    """
+    Bulk version of multireplace, e.g. for all the paragraphs of an article.
+    :param strings: list of strings to execute replacements on
+    :param dict replacements: replacement dictionary {value to find: value to replace}
+    :return: list of replaced strings
+    """
+    return get_replacer(replacements).replace_all(strings)
+
+class Replacer:
+    """
+    Replaces all occurrences of the keys of a replacement map in one pass, with a regex compiled
+    once. Where several keys match at the same position, the longest one wins: the alternatives
+    are tried longest first, which gives the same result as a trie-based longest match.
+    """
+    # joins strings for replace_all: no key can match across it, as long as no key or value contains it
+    SEPARATOR = '\x00'
+
+    def __init__(self, replacements):
+        self.replacements = dict(replacements)
+        keys = sorted(self.replacements, key=len, reverse=True)
+        self.regexp = re.compile('|'.join(map(re.escape, keys))) if keys else None
+        self.bulk = not any(self.SEPARATOR in text for item in self.replacements.items() for text in item)
+
+    def _replace_match(self, match):
+        return self.replacements[match.group(0)]
+
+    def replace(self, string):
+        if self.regexp is None:
+            return string
+        return self.regexp.sub(self._replace_match, string)
+
+    def replace_all(self, strings):
+        strings = list(strings)
+        if self.regexp is None:
+            return strings
+        joined = self.SEPARATOR.join(strings)
+        if not self.bulk or joined.count(self.SEPARATOR) != len(strings) - 1:
+            return [self.replace(string) for string in strings]
+        return self.replace(joined).split(self.SEPARATOR)
+
+_replacers = {}
+
+def get_replacer(replacements):
+    """
+    Returns the (cached) Replacer for a replacement map.
+    """
+    key = frozenset(replacements.items())
+    replacer = _replacers.get(key)
+    if replacer is None:
+        replacer = _replacers[key] = Replacer(replacements)
+    return replacer
+
+def sent_tokenize(text):
+    """
+    NLTK's sent_tokenize, which replaces this function once NLTK has been imported.
+    """
+    global sent_tokenize
+    from nltk import sent_tokenize
+    return sent_tokenize(text)
+
+def word_tokenize(text):
+    """
+    NLTK's word_tokenize, which replaces this function once NLTK has been imported.
+    """
+    global word_tokenize
+    from nltk import word_tokenize
+    return word_tokenize(text)
+
+def get_detokenizer():
+    """
+    Returns the NLTK MosesDetokenizer, creating it on first use.
+    """
+    global _detokenizer
+    if _detokenizer is None:
+        from nltk.tokenize.moses import MosesDetokenizer
+        _detokenizer = MosesDetokenizer()
+    return _detokenizer
+
+def __getattr__(name):
+    # the detokenizer used to be created on import, as geoparse.detokenizer
+    if name == 'detokenizer':
+        return get_detokenizer()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 def tuple_list_to_string(tuple_list):
     """
     Given a list of (word, type) tuples, return a reconstituted (detokenized) string
     representation of the words. This function uses NLTK's MosesDetokenizer, then does
-    a brief tidy-up.
-    NOTE: assumed "detokenizer" has already been created outside the function.
+    a brief tidy-up. When the sentence the words come from is known, chunk_string gives
+    the words as they are written in it instead.
     """
-    token_list = [item[0] for item in tuple_list]
-    moses_string = detokenizer.detokenize(token_list, return_str=True)
+    return detokenize(tuple(item[0] for item in tuple_list))
+
+@functools.lru_cache(maxsize=2**16)
+def detokenize(tokens):
+    """
+    Detokenized string of a tuple of tokens (see tuple_list_to_string), cached since the same
+    place names come up again and again.
+    """
+    moses_string = (_detokenizer or get_detokenizer()).detokenize(list(tokens), return_str=True)
     # add tidying up stuff here as needed/discovered
     moses_string_clean = moses_string.replace("( ", "(")
     return moses_string_clean
 
+def token_offsets(text, tokens):
+    """
+    Finds the character offsets of tokens in the text they were tokenized from, e.g. by
+    word_tokenize: the tokens must be found in order with nothing but whitespace between them.
+    :return: list of (start, end) offsets, one per token, or None if the tokens don't line up
+    with the text (e.g. a tokenizer rewriting more than the double quotes)
+    """
+    offsets = []
+    pos = 0
+    n = len(text)
+    for token in tokens:
+        while pos < n and text[pos].isspace():
+            pos += 1
+        for written in TOKEN_TEXT_ALTERNATIVES.get(token, (token,)):
+            if text.startswith(written, pos):
+                offsets.append((pos, pos + len(written)))
+                pos += len(written)
+                break
+        else:
+            return None
+    return offsets
+
+def tokenize_with_offsets(text):
+    """
+    Tokenizes a sentence with word_tokenize.
+    :return: (tokens, offsets), offsets being the character offsets of the tokens in the
+    sentence, or None if they can't be found (see token_offsets)
+    """
+    tokens = word_tokenize(text)
+    return tokens, token_offsets(text, tokens)
+
+def chunk_string(tagged_sentence, span, sentence=None, offsets=None):
+    """
+    String of a chunk of a sentence: the slice of the sentence it covers, verbatim, so the
+    string is the place name as written in the article and a substring of its sentence (a
+    line break in it included; _add_locations makes line breaks spaces in both). Without
+    offsets, or if the tagger returned a different number of tokens than it was given, the
+    words are detokenized as in tuple_list_to_string.
+    :param tagged_sentence: list of (word, tag) tuples
+    :param span: (start, end) token index span of the chunk, see Chunker.extract_spans
+    :param sentence: the sentence the tokens come from
+    :param offsets: character offsets of the tokens in the sentence, see tokenize_with_offsets
+    """
+    start, end = span
+    if offsets is None or len(offsets) != len(tagged_sentence):
+        instrument.count('geoparse.detokenized_chunks')
+        return tuple_list_to_string(tagged_sentence[start:end])
+    return sentence[offsets[start][0]:offsets[end - 1][1]]
+
+@instrument.timed(size=len)
 def extract_methods_text(article_content, par_range=4, max_words_in_heading=8, re_to_match=RE_BIOMED_METHODS_TEXT, verbose=False):
     """
     Methods section detection function for raw-text content, which returns both the headings
@@ -53,46 +237,11 @@ def extract_methods_text(article_content, par_range=4, max_words_in_heading=8, r
     :param verbose: whether to print debug-style output
     :return: a two-item tuple: methods_titles (list), text_contents (string)
     """
-    methods_titles = []
-    # split on two or more line-break chars for 'paragraphs'
-    pars = re.split('[\n]{2,}', article_content)
-    if verbose:
-        print("article has %s 'paragraphs'" % len(pars))
-    indexes = []
-    for i, par in enumerate(pars):
-        # fix split words (but will also erroneously de-hyphen hyphenated words broken up by a line-break)
-        clean_par = re.sub(r'([a-zA-Z])-\n([a-zA-Z])', r'\1\2', par)
-        candidate_title = clean_par.split('\n')[0]
-        # check for an initial capital letter and put a somewhat arbitrary (but customizable) length restriction
-        if (re.match(RE_INITIAL_CAPITAL, candidate_title) and len(candidate_title.split(' ')) <= max_words_in_heading):
-        # now finally match our more complex RE
-            if re.match(re_to_match, candidate_title.lower()):
-                methods_titles.append(candidate_title)
-                indexes.append(i)
-                if verbose:
-                    print("Found section match: " + candidate_title)
-    # found no methods sections - exit now
-    if not indexes:
-        return ([], '')
-    # make a unique list of indexes
-    extended = []
-    for i in indexes:
-        extended.extend(list(range(i, i + par_range)))
-    paragraph_indexes = list(set(extended))
-    paragraph_indexes.sort()
-    text_contents = ''
-    for i in paragraph_indexes:
-        try:
-            par = pars[i]
-            par_temp = re.sub(r'([a-zA-Z])-\n([a-zA-Z])', r'\1\2', par)  # this fixes split words
-            par_temp = par_temp.replace('\n', ' ') # ignore single line breaks due to formatting
-            text_contents += par_temp
-            text_contents += '\n\n'
-        except IndexError:
-            # this happens if we found a dodgy heading near the end of the document
-            continue
-    return (methods_titles, text_contents)
+    # to try several pattern sets or par_range values on an article, use a HeadingDetector directly
+    headings = get_heading_detector({'methods': re_to_match}, max_words_in_heading).detect(article_content, verbose)
+    return headings.methods('methods', par_range)
 
+@instrument.timed()
 def extract_methods_xml(xml_root, re_to_match=RE_BIOMED_METHODS_HEADINGS, par_range=3, verbose=False):
     """
     Methods section detection function for XML content, which returns both the headings
@@ -107,9 +256,8 @@ def extract_methods_xml(xml_root, re_to_match=RE_BIOMED_METHODS_HEADINGS, par_ra
     # iterate over parent
     for sec in xml_root.iter('sec'):
         foundMethods = False
-        visited_pars = 0
         section_title = ''
-        text_contents = ''
+        pars = []
         for child in sec:
             if not foundMethods:
                 if child.tag == 'title':
@@ -119,23 +267,16 @@ def extract_methods_xml(xml_root, re_to_match=RE_BIOMED_METHODS_HEADINGS, par_ra
                         if verbose:
                             print("Found methods section match: %s" %child.text)
             elif foundMethods:
-                if visited_pars >= par_range:
+                if len(pars) >= par_range:
                     if verbose:
                         print("max paragraphs reached: breaking")
                     break
-                # we found a matching methods title: print/store the paragraphs in this section
+                # we found a matching methods title: store the paragraphs in this section
                 if child.tag == 'p':
-                    text_contents += child.text
-                    visited_pars += 1
                     # to get the 'rest' of the text of a 'p', we need to get the 'tail' of its child nodes :/
-                    for xref in child:
-                        # all child nodes of p should be xref...
-                        text_contents += ' '
-                        text_contents += xref.tail
-                    # end of paragraph
-                    text_contents += '\n\n'
+                    pars.append(du.xml_paragraph_text(child))
         if foundMethods:
-            methods.append((section_title, text_contents))
+            methods.append((section_title, du.join_paragraphs(pars)))
     return methods
 
 # function mainly useful in testing heading detection
@@ -147,26 +288,12 @@ def detect_methods_text(article_content, max_words_in_heading=8, verbose=False):
     :param verbose: whether to print output
     :return: list of string, where each string is (supposedly) a relevant section heading
     """
-    methods = []
-    # split on two or more line-break chars (== 'paragraphs')
-    pars = re.split('[\n]{2,}', article_content)
     if verbose:
         print("article length: %s" % len(article_content))
-        print("article has %s 'paragraphs'" % len(pars))
-    for par in pars:
-        # fix split words (but may also erroneously de-hyphen hyphenated words broken up by a line-break)
-        clean_par = re.sub(r'([a-zA-Z])-\n([a-zA-Z])', r'\1\2', par)
-        candidate_title = clean_par.split('\n')[0]
-        if verbose:
-            print("candidate title: %s" %candidate_title)
-        # check for an initial capital letter and put a somewhat arbitrary length restriction
-        if (re.match(RE_INITIAL_CAPITAL, candidate_title) and len(candidate_title.split(' ')) <= max_words_in_heading):
-        # now finally match our more complex RE
-            if re.match(RE_BIOMED_METHODS_TEXT, candidate_title.lower()):
-                methods.append(candidate_title)
-                if verbose:
-                    print("Found section match: " + candidate_title)
-    return methods
+        for clean_par in du.split_paragraphs(article_content):
+            print("candidate title: %s" % clean_par.split('\n', 1)[0])
+    headings = get_heading_detector({'biomed': RE_BIOMED_METHODS_TEXT}, max_words_in_heading).detect(article_content, verbose)
+    return headings.titles('biomed')
 
 # function mainly useful in testing heading detection
 def detect_methods_xml(xml_root):
@@ -182,166 +309,630 @@ def detect_methods_xml(xml_root):
             methods.append(title.text)
     return methods
 
+
+### HEADING DETECTION IN RAW TEXT ###
+
+class HeadingMatches:
+    """
+    The methods headings a HeadingDetector found in an article, for each of its pattern sets,
+    as indexes into the article's paragraphs: the heading strings and the text after them are
+    only built when asked for, so several par_range values can be tried without scanning again.
+    """
+    def __init__(self, pars, indexes):
+        """
+        :param pars: the article's paragraphs, from docutils.split_paragraphs
+        :param indexes: dict of pattern set name: indexes of the paragraphs starting with a matching heading
+        """
+        self.pars = pars
+        self.indexes = indexes
+
+    def found(self, name):
+        return bool(self.indexes[name])
+
+    def titles(self, name):
+        """
+        Returns the headings matched by a pattern set, in document order.
+        """
+        return [self.pars[i].split('\n', 1)[0] for i in self.indexes[name]]
+
+    def paragraph_indexes(self, name, par_range=4):
+        """
+        Returns the sorted indexes of the paragraphs in the methods sections of a pattern set: each
+        matched heading's paragraph and the ones after it, par_range paragraphs in all.
+        """
+        # those past the end come from a dodgy heading near the end of the document
+        n_pars = len(self.pars)
+        return sorted(set(j for i in self.indexes[name] for j in range(i, min(i + par_range, n_pars))))
+
+    def text(self, name, par_range=4):
+        """
+        Returns the text of the methods sections of a pattern set, as extract_methods_text does.
+        """
+        # ignore single line breaks due to formatting
+        return du.join_paragraphs(self.pars[i].replace('\n', ' ') for i in self.paragraph_indexes(name, par_range))
+
+    def methods(self, name, par_range=4):
+        """
+        Returns (methods_titles, text_contents) for a pattern set, as extract_methods_text does.
+        """
+        if not self.indexes[name]:
+            return ([], '')
+        return (self.titles(name), self.text(name, par_range))
+
+class HeadingDetector:
+    """
+    Finds the methods headings of raw-text articles for several heading pattern sets in one pass
+    over the paragraphs: the first line of each paragraph is split off, checked for an initial
+    capital and a word count, and lower-cased once, then matched against every pattern set.
+    Lines which no pattern set can match are ruled out with a single combined regex.
+    Example use:
+        detector = get_heading_detector(METHODS_TEXT_PATTERNS)
+        headings = detector.detect(scidoc.raw_contents)
+        for par_range in (2, 4, 6):
+            text = headings.text('orchards', par_range)
+    """
+    def __init__(self, patterns, max_words_in_heading=8):
+        """
+        :param patterns: dict of pattern set name: regular expression matched at the start of the
+        lower-cased heading, e.g. METHODS_TEXT_PATTERNS, with user-supplied sets added as needed
+        :param max_words_in_heading: upper limit on number of words in a heading (inclusive)
+        """
+        self.names = list(patterns)
+        self.patterns = [(name, re.compile(pattern)) for name, pattern in patterns.items()]
+        self.max_words_in_heading = max_words_in_heading
+        self.re_initial_capital = re.compile(RE_INITIAL_CAPITAL)
+        try:
+            self.re_any = re.compile('|'.join('(?:%s)' % regex.pattern for _, regex in self.patterns))
+        except re.error:
+            # e.g. patterns with inline flags, which can't be combined: try each of them
+            self.re_any = None
+
+    def detect_paragraphs(self, pars, verbose=False):
+        """
+        :param pars: the paragraphs of an article, e.g. from docutils.split_paragraphs
+        :return: dict of pattern set name: indexes of the paragraphs starting with a matching heading
+        """
+        indexes = {name: [] for name in self.names}
+        initial_capital = self.re_initial_capital.match
+        any_pattern = self.re_any.match if self.re_any is not None else None
+        max_words = self.max_words_in_heading
+        for i, clean_par in enumerate(pars):
+            candidate_title = clean_par.split('\n', 1)[0]
+            # check for an initial capital letter and put a somewhat arbitrary (but customizable) length restriction
+            if not initial_capital(candidate_title) or candidate_title.count(' ') >= max_words:
+                continue
+            lowered = candidate_title.lower()
+            if any_pattern is not None and not any_pattern(lowered):
+                continue
+            for name, regex in self.patterns:
+                if regex.match(lowered):
+                    indexes[name].append(i)
+                    if verbose:
+                        print("Found section match (%s): %s" % (name, candidate_title))
+        return indexes
+
+    def detect(self, article_content, verbose=False):
+        """
+        :param article_content: the full raw text contents of an article
+        :param verbose: whether to print debug-style output
+        :return: HeadingMatches
+        """
+        # 'paragraphs' with split words fixed (and cached, so other callers don't split again)
+        pars = du.split_paragraphs(article_content)
+        if verbose:
+            print("article has %s 'paragraphs'" % len(pars))
+        return HeadingMatches(pars, self.detect_paragraphs(pars, verbose))
+
+_heading_detectors = {}
+
+def get_heading_detector(patterns=METHODS_TEXT_PATTERNS, max_words_in_heading=8):
+    """
+    Returns the (cached) HeadingDetector for these pattern sets.
+    """
+    key = (tuple(patterns.items()), max_words_in_heading)
+    detector = _heading_detectors.get(key)
+    if detector is None:
+        detector = _heading_detectors[key] = HeadingDetector(patterns, max_words_in_heading)
+    return detector
+
 def extract_chunks_from_sentence(tagged_sentence, include_cardinal=True, include_other_spatial=True, include_types=True):
     """
     Custom NER chunker, basically grabbing consecutive sequences of tagged terms from
     a list in a format returned by NLTK's Stanford NER wrapper. We also concatenate
     commas, parentheses, and two-letter capital abbreviations (usually states) with an
-    already-found chunk.
-    """
-    chunk_tokens = []  # for the (str, type) tuples
-    tokens = []
-    concatenate = False
-    previous_token = ('', 'O')
-    cardinal_direction_tokens = ['east', 'west', 'south', 'north', 'eastern',
-                               'western', 'southern', 'northern', 'central',
-                               'northeast', 'northwest', 'southeast', 'southwest',
-                               'northeastern', 'northwestern', 'southeastern', 'southwestern']
-    spatial_language_tokens = ['along', 'near', 'at']
-    feature_type_tokens = ['region', 'regions', 'county', 'counties', 'park', 'parks',
-                           'coast', 'coasts', 'town', 'city', 'state', 'states', 'river', 'rivers']
-    for token in tagged_sentence:
-        word = token[0]
-        tag = token[1]
-        # start with a loc, org, or person (we include person bc of NER errors)
-        if tag == 'LOCATION' or tag == 'ORGANIZATION' or tag == 'PERSON':
-            if concatenate:
-                tokens.append(token)
-            else:
-                # new chunk: but include a previous "("
-                if previous_token[0] == '(':
-                    tokens.append(previous_token)
-                # also keep stuff like 'north', 'south' before a relevant NER token
-                if include_cardinal and previous_token[0] in cardinal_direction_tokens:
-                    tokens.append(previous_token)
-                tokens.append(token)
-                concatenate = True
-        # handle commas and other punctuation we want to keep when already in a chunk
-        elif concatenate and re.match(r'[,()]|\'s', word):
-            tokens.append(token)
-        # handle 2-letter abbreviations with a RE (usually states)
-        elif concatenate and re.match(r'\b[A-Z][A-Z]\b', word):
-            tokens.append(token)
-        # handle some prepositions we want to keep, some occur within placenames
-        elif concatenate and re.match(r'\bin\b|\bthe\b|\bupon\b|\bof\b', word.lower()):
-            tokens.append(token)
-        # keep cardinal direction tokens
-        elif concatenate and include_cardinal and word.lower() in cardinal_direction_tokens:
-            tokens.append(token)
-        # keep other spatial language tokens
-        elif concatenate and include_other_spatial and word.lower() in spatial_language_tokens:
-            tokens.append(token)
-        # keep feature type tokens
-        elif concatenate and include_types and word.lower() in feature_type_tokens:
-            tokens.append(token)
-        # keep 'et' because this is part of 'et al.' and we should reject these chunks down the road
-        elif concatenate and re.match(r'^et$', word):
-            tokens.append(token)
-        else:
-            # end of chunk!
-            if tokens:
-                chunk_tokens.append(tokens.copy())
-            # re-set things
-            concatenate = False
-            tokens.clear()
-        previous_token = token
-    # this is to catch a chunk which includes the very last token in a sentence (e.g. titles)
-    if concatenate:
-        chunk_tokens.append(tokens.copy())
-    #print("FINAL chunk_tokens: %s" %chunk_tokens)
-    return chunk_tokens
+    already-found chunk. See Chunker, which does the work.
+    """
+    return get_chunker(include_cardinal, include_other_spatial, include_types).extract_chunks(tagged_sentence)
 
 def filter_chunk_candidates(sentence_tokens, chunk_list, verbose=False):
     """
     Takes as arguments the original sentence as tokens, and a list of chunks
     found by our custom location candidate chunker, and tries to filter out
     chunks like company locations, erroneously tagged references (et al),
-    author initials, and so on.
+    author initials, and so on. See Chunker, which does the work.
     """
-    chunks_filtered = []
-    if len(sentence_tokens) <= 3:
-        if verbose:
-            print("sentence was too short!")
-        return chunks_filtered
-    if not chunk_list:
-        if verbose:
-            print("no chunks to filter!")
-        return chunks_filtered
-    # add more keep words as needed
-    keep_words = set(['hospital', 'hospitals', 'hopital', 'hôpital', 'clinic', 'clinics', 'clinique',
-                      'university', 'universities', 'universite', 'universität',
-                      'centre', 'centres', 'centro', 'center', 'centers',
-                      'college', 'colleges',
-                      'department', 'departments', 'departamento', 'departement',
-                      'institution', 'institutions', 'institute', 'institutes', 'institut', 'instituto'])
-    discard_words = set(['gmbh', 'inc', 'inc.'])
-    for chunk in chunk_list:
-        # filter references (this works well enough, chunking step always keeps 'et' tokens)
+    return DEFAULT_CHUNKER.filter_chunks(sentence_tokens, chunk_list, verbose=verbose)
+
+class Chunker:
+    """
+    Location candidate chunker and filter, with its token lists and patterns set up once rather
+    than on every sentence. Chunks are runs of consecutive tokens, so they are found as
+    (start, end) token index spans of the tagged sentence; extract_chunks and filter_chunks give
+    the same lists of (word, tag) tuples as extract_chunks_from_sentence and filter_chunk_candidates.
+    Example use:
+        chunker = Chunker(include_other_spatial=False)
+        for chunks, kept in chunker.chunk_sentences(tagged_sentences, token_lists):
+            print([tuple_list_to_string(chunk) for chunk in kept])
+    """
+    def __init__(self, include_cardinal=True, include_other_spatial=True, include_types=True,
+                 cardinal_direction_tokens=CARDINAL_DIRECTION_TOKENS, spatial_language_tokens=SPATIAL_LANGUAGE_TOKENS,
+                 feature_type_tokens=FEATURE_TYPE_TOKENS, keep_words=CHUNK_KEEP_WORDS,
+                 discard_words=CHUNK_DISCARD_WORDS):
+        """
+        :param include_cardinal: keep cardinal directions ('north', ...) before and inside chunks
+        :param include_other_spatial: keep spatial prepositions ('near', ...) inside chunks
+        :param include_types: keep feature types ('county', ...) inside chunks
+        :param keep_words: lower case words which make the filter keep a chunk
+        :param discard_words: lower case words which make the filter discard a chunk
+        """
+        self.cardinal_direction_tokens = frozenset(cardinal_direction_tokens)
+        self.keep_words = frozenset(keep_words)
+        self.discard_words = frozenset(discard_words)
+        # the lower case words continuing a chunk without any pattern matching
+        continuing = set()
+        if include_cardinal:
+            continuing.update(cardinal_direction_tokens)
+        if include_other_spatial:
+            continuing.update(spatial_language_tokens)
+        if include_types:
+            continuing.update(feature_type_tokens)
+        self.continuing_words = frozenset(continuing)
+        # a cardinal direction just before a chunk starts it
+        self.starting_words = self.cardinal_direction_tokens if include_cardinal else frozenset()
+        self.re_punctuation = re.compile(RE_CHUNK_PUNCTUATION)
+        self.re_abbreviation = re.compile(RE_CHUNK_ABBREVIATION)
+        self.re_preposition = re.compile(RE_CHUNK_PREPOSITION)
+        self.re_et = re.compile(RE_CHUNK_ET)
+        self.re_initials = re.compile(RE_CHUNK_INITIALS)
+
+    def _continues_chunk(self, word):
+        # 'et' is kept because it is part of 'et al.', and such chunks are rejected by the filter
+        return bool(self.re_punctuation.match(word) or self.re_abbreviation.match(word)
+                    or self.re_preposition.match(word.lower()) or word.lower() in self.continuing_words
+                    or self.re_et.match(word))
+
+    def extract_spans(self, tagged_sentence):
+        """
+        Finds the location candidate chunks of a tagged sentence.
+        :param tagged_sentence: list of (word, tag) tuples, as returned by the NER tagger
+        :return: list of (start, end) token index spans, one per chunk
+        """
+        spans = []
+        start = None
+        previous_word = ''
+        for i, token in enumerate(tagged_sentence):
+            word = token[0]
+            # start with a loc, org, or person (we include person bc of NER errors)
+            if token[1] in NER_CHUNK_TAGS:
+                if start is None:
+                    # new chunk: include a previous "(" or cardinal direction
+                    start = i - 1 if (previous_word == '(' or previous_word in self.starting_words) else i
+            elif start is not None and not self._continues_chunk(word):
+                # end of chunk!
+                spans.append((start, i))
+                start = None
+            previous_word = word
+        # a chunk which includes the very last token in a sentence (e.g. titles)
+        if start is not None:
+            spans.append((start, len(tagged_sentence)))
+        return spans
+
+    def extract_chunks(self, tagged_sentence):
+        """
+        Same as extract_chunks_from_sentence: returns the chunks as lists of (word, tag) tuples.
+        """
+        return [list(tagged_sentence[start:end]) for start, end in self.extract_spans(tagged_sentence)]
+
+    def keep_chunk(self, sentence_tokens, chunk, verbose=False):
+        """
+        Decides whether filter_chunks keeps one chunk.
+        :param sentence_tokens: tokens of the whole sentence
+        :param chunk: list of (word, tag) tuples
+        :return: True to keep the chunk
+        """
+        # filter references (this works well enough, chunking always keeps 'et' tokens)
         if chunk[-1][0] == 'et':
-            if verbose:
-                print("chunk was a reference: discard")
-        elif re.fullmatch(r'\b[A-Z][.]([A-Z][.]?){1,2}', chunk[0][0]):
-            # reject first word initials-pattern chunks
-            if verbose:
-                print("chunk was an initial: discard")
+            reason, keep = "chunk was a reference: discard", False
+        elif self.re_initials.fullmatch(chunk[0][0]):
+            reason, keep = "chunk was an initial: discard", False
         else:
             tags = [item[1] for item in chunk]
-            words = [item[0] for item in chunk]
             words_lower = [item[0].lower() for item in chunk]
             words_lower_set = set(words_lower)
-            # reject any chunk with one of our discard words (signaling companies)
-            if discard_words.intersection(words_lower_set):
-                if verbose:
-                    print("chunk had a discard word: discard")
-            # keep any chunk with one of our keep words, no matter what (except cases above)
-            elif keep_words.intersection(words_lower_set):
-                if verbose:
-                    print("chunk had a keyword: keep")
-                chunks_filtered.append(chunk.copy())
-            # rest of chunks must have at least one location and we try to block companies
-            elif 'LOCATION' in tags:
-                if ')' in words_lower_set:
-                    if not '(' in words_lower_set:
-                        # discard
-                        if verbose:
-                            print("no opening parenthesis: discard")
-                    elif 'ORGANIZATION' in tags:
-                        # TODO: check that it's actually inside the parentheses
-                        if verbose:
-                            print("ORG with both parentheses: discard")
-                    else:
-                        # no ORG: could do further triage but we just keep everything
-                        if verbose:
-                            print("both parentheses but no ORG: keep")
-                        chunks_filtered.append(chunk.copy())
+            if not self.discard_words.isdisjoint(words_lower_set):
+                # signals a company
+                reason, keep = "chunk had a discard word: discard", False
+            elif not self.keep_words.isdisjoint(words_lower_set):
+                # kept no matter what (except cases above)
+                reason, keep = "chunk had a keyword: keep", True
+            elif 'LOCATION' not in tags:
+                reason, keep = "final else: discard", False
+            elif ')' in words_lower_set:
+                if '(' not in words_lower_set:
+                    reason, keep = "no opening parenthesis: discard", False
+                elif 'ORGANIZATION' in tags:
+                    # TODO: check that it's actually inside the parentheses
+                    reason, keep = "ORG with both parentheses: discard", False
+                else:
+                    reason, keep = "both parentheses but no ORG: keep", True
+            elif '(' in words_lower_set:
+                if tags.index('LOCATION') > words_lower.index('('):
+                    reason, keep = "LOC right of opening parenthesis: discard", False
                 else:
-                    if '(' in words_lower_set:
-                        # no closing but an opening parenthesis
-                        if tags.index('LOCATION') > words_lower.index('('):
-                            if verbose:
-                                print("LOC right of opening parenthesis: discard")
-                        else:
-                            if verbose:
-                                print("LOC left of opening parenthesis: keep")
-                            chunks_filtered.append(chunk.copy())
-                    else:
-                        # filter the declaration of helsinki / helsinki declaration cases, could add more cases like this
-                        if 'helsinki' in words_lower_set:
-                            index_hel = sentence_tokens.index(('Helsinki'))
-                            context_tokens = [word.lower() for word in sentence_tokens[index_hel-2:index_hel+2]]
-                            if 'declaration' in context_tokens:
-                                if verbose:
-                                    print("Declaration alongside Helsinki: discard")
-                            else:
-                                if verbose:
-                                    print("Helsinki but no declaration: keep")
-                                chunks_filtered.append(chunk.copy())
-                        else:
-                            if verbose:
-                                print("LOC final else: keep")
-                            chunks_filtered.append(chunk.copy())
+                    reason, keep = "LOC left of opening parenthesis: keep", True
+            elif 'helsinki' in words_lower_set:
+                # the declaration of helsinki / helsinki declaration cases, could add more cases like this
+                index_hel = sentence_tokens.index('Helsinki')
+                context_tokens = [word.lower() for word in sentence_tokens[index_hel-2:index_hel+2]]
+                if 'declaration' in context_tokens:
+                    reason, keep = "Declaration alongside Helsinki: discard", False
+                else:
+                    reason, keep = "Helsinki but no declaration: keep", True
             else:
-                # no location, don't keep
-                if verbose:
-                    print("final else: discard")
-    return chunks_filtered
+                reason, keep = "LOC final else: keep", True
+        if verbose:
+            print(reason)
+        return keep
+
+    def filter_indices(self, sentence_tokens, chunk_list, verbose=False):
+        """
+        Filters chunks like filter_chunk_candidates.
+        :return: indices in chunk_list of the chunks kept
+        """
+        if len(sentence_tokens) <= 3:
+            if verbose:
+                print("sentence was too short!")
+            return []
+        if not chunk_list:
+            if verbose:
+                print("no chunks to filter!")
+            return []
+        return [i for i, chunk in enumerate(chunk_list) if self.keep_chunk(sentence_tokens, chunk, verbose)]
+
+    def filter_chunks(self, sentence_tokens, chunk_list, verbose=False):
+        """
+        Same as filter_chunk_candidates: returns copies of the chunks kept.
+        """
+        return [chunk_list[i].copy() for i in self.filter_indices(sentence_tokens, chunk_list, verbose)]
+
+    def chunk_spans(self, tagged_sentences, token_lists=None, verbose=False):
+        """
+        Extracts and filters the chunks of many tagged sentences, as token index spans.
+        :param tagged_sentences: list of tagged sentences, each a list of (word, tag) tuples
+        :param token_lists: tokens of each sentence as given to the tagger, default the tagged words
+        :return: list of (spans, indices in spans of the chunks kept) pairs, one per sentence
+        """
+        if token_lists is None:
+            token_lists = [[word for word, _ in tagged] for tagged in tagged_sentences]
+        results = []
+        for tagged, tokens in zip(tagged_sentences, token_lists):
+            spans = self.extract_spans(tagged)
+            if spans:
+                chunks = [tagged[start:end] for start, end in spans]
+                results.append((spans, self.filter_indices(tokens, chunks, verbose)))
+            else:
+                results.append((spans, []))
+        return results
+
+    def chunk_sentences(self, tagged_sentences, token_lists=None, verbose=False):
+        """
+        Extracts and filters the chunks of many tagged sentences.
+        :param tagged_sentences: list of tagged sentences, each a list of (word, tag) tuples
+        :param token_lists: tokens of each sentence as given to the tagger, default the tagged words
+        :return: list of (chunks, kept chunks) pairs, one per sentence
+        """
+        results = []
+        for tagged, (spans, kept) in zip(tagged_sentences, self.chunk_spans(tagged_sentences, token_lists, verbose)):
+            chunks = [list(tagged[start:end]) for start, end in spans]
+            results.append((chunks, [chunks[i] for i in kept]))
+        return results
+
+_chunkers = {}
+
+def get_chunker(include_cardinal=True, include_other_spatial=True, include_types=True):
+    """
+    Returns the Chunker with the default token lists for these options, creating it on first use.
+    """
+    key = (include_cardinal, include_other_spatial, include_types)
+    chunker = _chunkers.get(key)
+    if chunker is None:
+        chunker = _chunkers[key] = Chunker(*key)
+    return chunker
+
+DEFAULT_CHUNKER = get_chunker()
+
+### SENTENCE PREFILTER ###
+
+class SentencePrefilter:
+    """
+    Cheap test of whether a sentence could give a location chunk, so sentences which can't are
+    not sent to the NER tagger. A chunk starts at a token tagged as a location, organization or
+    person, and the tagger practically only tags capitalized words, so a sentence is tagged if:
+    - a token other than the first starts with a capital letter,
+    - its first token is capitalized and isn't a common sentence start ('The', 'We', ...),
+    - or a token is one of a set of known words in any case: the chunk keep words, and
+    optionally place names, e.g. from a gazetteer (see gazetteer.index_words).
+    Sentences it rules out are treated as tagged with no entities. Check its recall on tagged
+    sentences of a corpus with evaluate_prefilter before relying on it.
+    Example use:
+        prefilter = SentencePrefilter(names=gazetteer.index_words('geonames.sqlite'))
+        locate_in_documents(science_docs, tagger, prefilter=prefilter)
+    """
+    def __init__(self, names=(), keep_words=CHUNK_KEEP_WORDS, common_starts=COMMON_SENTENCE_START_WORDS):
+        """
+        :param names: words (e.g. single-word place names) which make a sentence tagged, in any case
+        :param keep_words: more such words, by default the chunk keep words ('university', ...)
+        :param common_starts: lower case words which don't make a sentence tagged when they start it
+        """
+        self.words = frozenset(word.lower() for word in names) | frozenset(word.lower() for word in keep_words)
+        self.common_starts = frozenset(common_starts)
+
+    def settings(self):
+        """
+        The word lists, sorted, e.g. to tell apart the results of different prefilters in a cache.
+        """
+        return sorted(self.words), sorted(self.common_starts)
+
+    def keep(self, tokens):
+        """
+        :param tokens: tokens of a sentence
+        :return: True if the sentence may give a chunk, so should be tagged
+        """
+        if not tokens:
+            return False
+        first = tokens[0]
+        if first[:1].isupper() and first.lower() not in self.common_starts:
+            return True
+        for token in tokens[1:]:
+            if token[:1].isupper():
+                return True
+        words = self.words
+        for token in tokens:
+            if token.lower() in words:
+                return True
+        return False
+
+    def keep_all(self, token_lists):
+        """
+        :return: list of booleans, one per sentence, see keep
+        """
+        return [self.keep(tokens) for tokens in token_lists]
+
+def evaluate_prefilter(prefilter, tagged_sentences, token_lists=None, chunker=None, max_missed=20):
+    """
+    Measures a SentencePrefilter against the unfiltered path, on sentences tagged by the NER
+    tagger (e.g. with tag_sentences): recall is the share of the sentences with chunks (or with
+    chunks kept by the filter) which the prefilter lets through.
+    :param tagged_sentences: list of tagged sentences, each a list of (word, tag) tuples
+    :param token_lists: tokens of each sentence as given to the tagger, default the tagged words
+    :param chunker: Chunker, default DEFAULT_CHUNKER
+    :param max_missed: number of missed sentences to give as examples
+    :return: dict with the numbers of sentences, sentences tagged, sentences with chunks and with
+    kept chunks, chunk counts, recalls, the share of tagger input sentences saved, and the
+    missed sentences, for a report
+    """
+    chunker = chunker or DEFAULT_CHUNKER
+    if token_lists is None:
+        token_lists = [[word for word, _ in tagged] for tagged in tagged_sentences]
+    passed = prefilter.keep_all(token_lists)
+    counts = collections.Counter()
+    missed = []
+    for tokens, keep, (spans, kept) in zip(token_lists, passed, chunker.chunk_spans(tagged_sentences, token_lists)):
+        counts['sentences'] += 1 if tokens else 0
+        counts['sentences_tagged'] += keep
+        counts['chunks'] += len(spans)
+        counts['kept_chunks'] += len(kept)
+        if spans:
+            counts['sentences_with_chunks'] += 1
+            counts['sentences_with_chunks_tagged'] += keep
+            counts['chunks_found'] += len(spans) if keep else 0
+        if kept:
+            counts['sentences_with_kept_chunks'] += 1
+            counts['kept_chunks_found'] += len(kept) if keep else 0
+        if spans and not keep and len(missed) < max_missed:
+            missed.append(' '.join(tokens))
+
+    def ratio(numerator, denominator):
+        return counts[numerator] / counts[denominator] if counts[denominator] else 1.0
+
+    report = dict(counts)
+    report.update({'sentence_recall': ratio('sentences_with_chunks_tagged', 'sentences_with_chunks'),
+                   'chunk_recall': ratio('chunks_found', 'chunks'),
+                   'kept_chunk_recall': ratio('kept_chunks_found', 'kept_chunks'),
+                   'ner_sentences_saved': 1 - ratio('sentences_tagged', 'sentences'),
+                   'missed': missed})
+    return report
+
+def print_prefilter_report(report):
+    print("sentences tagged: %d of %d (%0.1f%% of NER input saved)" % (
+        report.get('sentences_tagged', 0), report.get('sentences', 0), 100 * report['ner_sentences_saved']))
+    print("sentence recall: %0.4f, chunk recall: %0.4f, kept chunk recall: %0.4f" % (
+        report['sentence_recall'], report['chunk_recall'], report['kept_chunk_recall']))
+    for sentence in report['missed']:
+        print("missed: %s" % sentence)
+
+### BATCHED GEOPARSING OF DOCUMENTS ###
+
+def tag_sentences(tagger, token_lists, stats=None):
+    """
+    Tags tokenized sentences with a single call to the tagger's tag_sents, so with NLTK's
+    StanfordNERTagger only one Java process is launched for all of them. Any object with a
+    tag_sents method (e.g. a tagger talking to a persistent NER server) can be used.
+    :param tagger: the NER tagger
+    :param token_lists: list of sentences, each a list of tokens
+    :param stats: optional dict in which to count sentences, tagger calls and seconds spent tagging
+    :return: list of tagged sentences, each a list of (word, tag) tuples, aligned with token_lists
+    (empty for empty sentences, which aren't sent to the tagger)
+    """
+    # empty sentences would throw the tagger's one-sentence-per-line output out of line
+    to_tag = [tokens for tokens in token_lists if tokens]
+    start = time.time()
+    with instrument.timer('geoparse.ner'):
+        tagged = iter(tagger.tag_sents(to_tag) if to_tag else [])
+    instrument.count('geoparse.sentences_tagged', len(to_tag))
+    if stats is not None:
+        stats['sentences'] = stats.get('sentences', 0) + len(to_tag)
+        stats['tagger_calls'] = stats.get('tagger_calls', 0) + (1 if to_tag else 0)
+        stats['tag_seconds'] = stats.get('tag_seconds', 0.0) + time.time() - start
+    return [next(tagged) if tokens else [] for tokens in token_lists]
+
+def locate_in_documents(science_docs, tagger, batch_size=2000, stats=None, prefilter=None, verbose=False):
+    """
+    Finds the locations in the titles and relevant text of many ScienceDocs, tagging the
+    sentences of several documents at once (see tag_sentences) rather than one tagger call per
+    sentence. Sets the same attributes on each ScienceDoc as the identify-and-filter-locations
+    notebook: title_locations, content_locations, content_locations_filtered and location_sentences.
+    A document the tagger (or chunking) fails on doesn't fail the others: it gets no locations, and
+    the error as its locate_error, which is None for the documents located.
+    :param science_docs: list of ScienceDoc, with relevant_text (and title if they have xml) set
+    :param tagger: NER tagger with a tag_sents method, e.g. nltk.tag.StanfordNERTagger
+    :param batch_size: tag once this many sentences have been collected (whole documents at a time)
+    :param stats: optional dict in which to count sentences, tagger calls and time; it also gets
+    sentences_per_second, for the tagging only, and sentences_skipped by the prefilter
+    :param prefilter: optional SentencePrefilter, only the sentences it keeps are tagged
+    :param verbose: whether to print debug-style output from the chunk filtering
+    :return: the ScienceDocs
+    """
+    batch_docs = []
+    batch_sentences = []  # (document index in batch, is title, sentence, tokens, token offsets)
+    for scidoc in science_docs:
+        batch_docs.append(scidoc)
+        scidoc.locate_error = None
+        with instrument.document(getattr(scidoc, 'file_name', None)):
+            try:
+                with instrument.timer('geoparse.tokenize'):
+                    sentences = _document_sentences(len(batch_docs) - 1, scidoc)
+            except Exception as e:
+                scidoc.locate_error = repr(e)
+                sentences = []
+            instrument.count('geoparse.sentences', len(sentences))
+        batch_sentences.extend(sentences)
+        if len(batch_sentences) >= batch_size:
+            _locate_in_batch(batch_docs, batch_sentences, tagger, stats, prefilter, verbose)
+            batch_docs = []
+            batch_sentences = []
+    if batch_docs:
+        _locate_in_batch(batch_docs, batch_sentences, tagger, stats, prefilter, verbose)
+    if stats is not None and stats.get('tag_seconds'):
+        stats['sentences_per_second'] = stats['sentences'] / stats['tag_seconds']
+    return science_docs
+
+def locate_in_document(scidoc, tagger, stats=None, prefilter=None, verbose=False):
+    """
+    Single-document version of locate_in_documents: all sentences of the title and relevant
+    text are still tagged in one tagger call.
+    """
+    return locate_in_documents([scidoc], tagger, stats=stats, prefilter=prefilter, verbose=verbose)[0]
+
+def _document_sentences(doc_index, scidoc):
+    sentences = []
+    title = getattr(scidoc, 'title', None)
+    if scidoc.has_xml and title:
+        title_clean = multireplace(title)
+        sentences.append((doc_index, True, title_clean) + tokenize_with_offsets(title_clean))
+    for par_clean in multireplace_all(re.split('[\n]{2,}', getattr(scidoc, 'relevant_text', ''))):
+        for sent in sent_tokenize(par_clean):
+            sentences.append((doc_index, False, sent) + tokenize_with_offsets(sent))
+    return sentences
+
+def _tag_by_document(batch_docs, batch_sentences, to_tag, tagger, stats):
+    """
+    Tags the sentences of a batch one document at a time, once tagging the whole batch failed, so
+    only the documents the tagger fails on lose their sentences: they are left untagged, with
+    the error as the document's locate_error.
+    """
+    tagged_sentences = [[] for _ in to_tag]
+    doc_sentences = collections.defaultdict(list)
+    for i, sentence in enumerate(batch_sentences):
+        doc_sentences[sentence[0]].append(i)
+    for doc_index, indices in doc_sentences.items():
+        try:
+            tagged = tag_sentences(tagger, [to_tag[i] for i in indices], stats)
+        except Exception as e:
+            batch_docs[doc_index].locate_error = repr(e)
+            continue
+        for i, tagged_sentence in zip(indices, tagged):
+            tagged_sentences[i] = tagged_sentence
+    return tagged_sentences
+
+def _locate_in_batch(batch_docs, batch_sentences, tagger, stats, prefilter, verbose):
+    for scidoc in batch_docs:
+        if not scidoc.has_xml:
+            scidoc.title_locations = NO_XML_STRING
+        elif getattr(scidoc, 'title', None):
+            scidoc.title_locations = []
+        else:
+            scidoc.title_locations = NO_TITLE_STRING
+        scidoc.content_locations = []
+        scidoc.content_locations_filtered = []
+        scidoc.location_sentences = []
+    token_lists = [sentence[3] for sentence in batch_sentences]
+    if prefilter is not None:
+        # sentences ruled out are left empty, so aren't tagged and give no chunks
+        to_tag = [tokens if keep else [] for tokens, keep in zip(token_lists, prefilter.keep_all(token_lists))]
+        skipped = sum(1 for tokens, tagged in zip(token_lists, to_tag) if tokens and not tagged)
+        instrument.count('geoparse.sentences_skipped', skipped)
+        if stats is not None:
+            stats['sentences_skipped'] = stats.get('sentences_skipped', 0) + skipped
+    else:
+        to_tag = token_lists
+    try:
+        tagged_sentences = tag_sentences(tagger, to_tag, stats)
+    except Exception as e:
+        instrument.count('geoparse.failed_batches')
+        if len(batch_docs) == 1:
+            batch_docs[0].locate_error = repr(e)
+            tagged_sentences = [[] for _ in to_tag]
+        else:
+            # find out which documents the tagger fails on, the others are tagged again
+            tagged_sentences = _tag_by_document(batch_docs, batch_sentences, to_tag, tagger, stats)
+    doc_sentences = collections.defaultdict(list)
+    for sentence, tagged in zip(batch_sentences, tagged_sentences):
+        doc_sentences[sentence[0]].append((sentence, tagged))
+    for doc_index, scidoc in enumerate(batch_docs):
+        if scidoc.locate_error is None:
+            try:
+                _add_locations(scidoc, doc_sentences.get(doc_index, []), verbose)
+            except Exception as e:
+                scidoc.locate_error = repr(e)
+        if scidoc.locate_error is not None:
+            instrument.count('geoparse.failed_documents')
+            # no partial results
+            if isinstance(scidoc.title_locations, list):
+                scidoc.title_locations = []
+            scidoc.content_locations = []
+            scidoc.content_locations_filtered = []
+            scidoc.location_sentences = []
+
+def _add_locations(scidoc, sentences, verbose):
+    """
+    Chunks the tagged sentences of a document and adds their locations to it.
+    :param sentences: list of (sentence as made by _document_sentences, tagged sentence) pairs
+    """
+    with instrument.timer('geoparse.chunk'):
+        chunked = DEFAULT_CHUNKER.chunk_spans([tagged for _, tagged in sentences],
+                                              [sentence[3] for sentence, _ in sentences], verbose=verbose)
+    for ((doc_index, is_title, sent, sent_tok, offsets), tagged), (spans, kept_indices) in zip(sentences, chunked):
+        if not spans:
+            continue
+        # each chunk's string is made once, whether it is kept or not, with line breaks made
+        # spaces as in the location sentences, so it stays a substring of its sentence
+        strings = [chunk_string(tagged, span, sent, offsets).replace('\n', ' ') for span in spans]
+        if not is_title:
+            scidoc.content_locations.extend(strings)
+        kept = [strings[i] for i in kept_indices]
+        if is_title:
+            scidoc.title_locations.extend(kept)
+        elif kept:
+            scidoc.content_locations_filtered.extend(kept)
+            scidoc.location_sentences.append(sent.replace('\n', ' '))
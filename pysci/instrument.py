@@ -0,0 +1,285 @@
+# Lightweight timers and counters for the pysci hot paths, with a report per stage and per document.
+# Instrumentation is off unless enable() is called, and then costs one global check per call.
+import os
+import json
+import time
+import threading
+import functools
+import collections
+
+# the active Recorder, None when instrumentation is off
+_recorder = None
+# document the current thread is working on, see document()
+_current = threading.local()
+
+class Recorder:
+    """
+    Collects the timings, byte counts and counters of an instrumented run. Timings are kept
+    per call, so the report can give percentile latencies, and per document.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = collections.defaultdict(list)
+        self.bytes = collections.Counter()
+        self.counters = collections.Counter()
+        self.documents = collections.defaultdict(collections.Counter)
+        self.start = time.time()
+
+    def record(self, name, seconds, nbytes=0, doc=None):
+        with self.lock:
+            self.timings[name].append(seconds)
+            if nbytes:
+                self.bytes[name] += nbytes
+            if doc is not None:
+                self.documents[doc][name] += seconds
+
+    def count(self, name, n=1, doc=None):
+        with self.lock:
+            self.counters[name] += n
+            if doc is not None:
+                self.documents[doc][name] += n
+
+    def export(self):
+        """
+        :return: what was recorded, as plain dicts, e.g. to send from a worker process to be merged
+        into the parent's Recorder (see call_recorded)
+        """
+        with self.lock:
+            return {'timings': dict(self.timings), 'bytes': dict(self.bytes), 'counters': dict(self.counters),
+                    'documents': {doc: dict(values) for doc, values in self.documents.items()}}
+
+    def merge(self, data):
+        """
+        Adds what another Recorder recorded, given by its export().
+        """
+        with self.lock:
+            for name, timings in data['timings'].items():
+                self.timings[name].extend(timings)
+            self.bytes.update(data['bytes'])
+            self.counters.update(data['counters'])
+            for doc, values in data['documents'].items():
+                self.documents[doc].update(values)
+
+    def report(self, slowest=10):
+        """
+        :param slowest: number of slowest documents to list for each timed stage
+        :return: a dict with per-stage statistics, counters, per-document totals and the
+        slowest documents of each stage, ready to dump as JSON
+        """
+        with self.lock:
+            stages = {}
+            for name, timings in sorted(self.timings.items()):
+                total = sum(timings)
+                stats = {'calls': len(timings), 'total_seconds': total, 'mean_seconds': total / len(timings),
+                         'p50_seconds': percentile(timings, 50), 'p90_seconds': percentile(timings, 90),
+                         'p99_seconds': percentile(timings, 99), 'max_seconds': max(timings),
+                         'calls_per_second': len(timings) / total if total else None}
+                if self.bytes[name]:
+                    stats['bytes'] = self.bytes[name]
+                    stats['bytes_per_second'] = self.bytes[name] / total if total else None
+                stages[name] = stats
+            documents = {doc: dict(values) for doc, values in self.documents.items()}
+            outliers = {}
+            for name in stages:
+                per_doc = [(values[name], doc) for doc, values in documents.items() if name in values]
+                if per_doc:
+                    outliers[name] = [{'document': doc, 'seconds': seconds}
+                                      for seconds, doc in sorted(per_doc, reverse=True)[:slowest]]
+            return {'wall_seconds': time.time() - self.start, 'stages': stages, 'counters': dict(self.counters),
+                    'documents': documents, 'slowest_documents': outliers}
+
+    def summary(self, slowest=3):
+        """
+        Returns a human readable summary of the report: a table of the stages, the counters,
+        and the slowest documents of each stage.
+        """
+        report = self.report(slowest=slowest)
+        lines = ["%-36s %8s %10s %10s %10s %10s %10s %12s" % ('stage', 'calls', 'total s', 'mean ms', 'p50 ms',
+                                                             'p90 ms', 'p99 ms', 'MB/s')]
+        for name, stats in report['stages'].items():
+            mb_per_second = stats.get('bytes_per_second')
+            lines.append("%-36s %8d %10.3f %10.3f %10.3f %10.3f %10.3f %12s" % (
+                name, stats['calls'], stats['total_seconds'], 1e3 * stats['mean_seconds'], 1e3 * stats['p50_seconds'],
+                1e3 * stats['p90_seconds'], 1e3 * stats['p99_seconds'],
+                '%0.2f' % (mb_per_second / 1e6) if mb_per_second else ''))
+        for name, value in sorted(report['counters'].items()):
+            lines.append("%-36s %8s" % (name, value))
+        for name, docs in report['slowest_documents'].items():
+            lines.append("slowest for %s: %s" % (name, ', '.join('%s (%0.3fs)' % (doc['document'], doc['seconds'])
+                                                                 for doc in docs)))
+        lines.append("wall time: %0.1fs" % report['wall_seconds'])
+        return '\n'.join(lines)
+
+    def save_report(self, path, slowest=10):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(slowest=slowest), f, indent=1)
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+### SWITCHING ON AND OFF ###
+
+def enable(recorder=None):
+    """
+    Turns instrumentation on, recording into a new Recorder unless one is given.
+    :return: the Recorder
+    """
+    global _recorder
+    _recorder = recorder if recorder is not None else Recorder()
+    return _recorder
+
+def disable():
+    """
+    Turns instrumentation off.
+    :return: the Recorder which was active, if any, for its report
+    """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+def get_recorder():
+    return _recorder
+
+def enabled():
+    return _recorder is not None
+
+### RECORDING ###
+
+class _Timer:
+    __slots__ = ('recorder', 'name', 'nbytes', 'doc', 'start')
+
+    def __init__(self, recorder, name, nbytes, doc):
+        self.recorder = recorder
+        self.name = name
+        self.nbytes = nbytes
+        self.doc = doc
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.recorder.record(self.name, time.perf_counter() - self.start, self.nbytes, self.doc)
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+def current_document():
+    return getattr(_current, 'doc', None)
+
+def timer(name, nbytes=0, doc=None):
+    """
+    Context manager timing a block of code, e.g.
+        with instrument.timer('geoparse.ner'):
+            tagged = tagger.tag_sents(token_lists)
+    :param name: stage name, '<module>.<what>'
+    :param nbytes: number of bytes processed, for the throughput, or a function returning it, only
+    called when instrumentation is on (e.g. to stat a file)
+    :param doc: document to count the time against, default the current one (see document())
+    """
+    if _recorder is None:
+        return _NULL_TIMER
+    if callable(nbytes):
+        nbytes = nbytes()
+    return _Timer(_recorder, name, nbytes, doc if doc is not None else current_document())
+
+def timed(name=None, size=None):
+    """
+    Decorator timing every call of a function, e.g.
+        @instrument.timed(size=len)
+        def extract_methods_text(article_content, ...):
+    :param name: stage name, default '<module>.<function>'
+    :param size: optional function giving the number of bytes processed from the first argument
+    (e.g. len, or file_size for a path)
+    """
+    def decorate(func):
+        stage = name or '%s.%s' % (func.__module__.rsplit('.', 1)[-1], func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return func(*args, **kwargs)
+            nbytes = size(args[0]) if size is not None and args else 0
+            with _Timer(_recorder, stage, nbytes, current_document()):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def file_size(path):
+    """
+    Size of a file given by its path, 0 for anything else (e.g. an open file), for timed(size=...).
+    """
+    return os.path.getsize(path) if isinstance(path, str) and os.path.isfile(path) else 0
+
+def record(name, seconds, nbytes=0, doc=None):
+    """
+    Records a time measured elsewhere, e.g. by a worker process.
+    """
+    if _recorder is not None:
+        _recorder.record(name, seconds, nbytes, doc if doc is not None else current_document())
+
+def count(name, n=1, doc=None):
+    """
+    Adds n to a counter, e.g. cache hits, sentences tagged or chunks kept.
+    """
+    if _recorder is not None:
+        _recorder.count(name, n, doc if doc is not None else current_document())
+
+def call_recorded(record, doc, func, *args, **kwargs):
+    """
+    Calls a function in a worker process, recording its timings and counts into a Recorder of
+    its own if 'record', for the parent process to merge in, e.g.
+        future = pool.submit(instrument.call_recorded, instrument.enabled(), file_name, func, text)
+        result, recorded = future.result()
+        instrument.merge(recorded)
+    :param record: whether to record, usually whether instrumentation is on in the parent
+    :param doc: document to count the timings against
+    :return: (the function's result, the recorded data or None)
+    """
+    global _recorder
+    if not record:
+        return func(*args, **kwargs), None
+    previous, _recorder = _recorder, Recorder()
+    try:
+        with document(doc):
+            result = func(*args, **kwargs)
+        return result, _recorder.export()
+    finally:
+        _recorder = previous
+
+def merge(data):
+    """
+    Adds what was recorded elsewhere (see call_recorded) to the active Recorder, if there is one.
+    """
+    if _recorder is not None and data is not None:
+        _recorder.merge(data)
+
+class document:
+    """
+    Context manager attributing the timings and counts of the block to a document, e.g.
+        with instrument.document(scidoc.file_name):
+            record = docutils.extract_xml_fields(xml_filepath)
+    """
+    def __init__(self, doc):
+        self.doc = doc
+
+    def __enter__(self):
+        self.previous = current_document()
+        _current.doc = self.doc
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current.doc = self.previous
@@ -0,0 +1,239 @@
+# Maps of geocoded locations which stay small and fast with many points: one compact payload, popups built in the browser
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import folium
+from branca.element import MacroElement
+from jinja2 import Template
+
+MARKER_COLOR = '#3186cc'
+BASEMAP_STYLE = {'fillColor': 'white', 'color': 'black', 'weight': 1, 'fillOpacity': 0.7}
+# points are grouped into grid cells of about this many pixels at each zoom level up to
+# MAX_AGGREGATED_ZOOM; beyond it (or once no two points share a cell) each point is drawn
+CELL_PIXELS = 40
+TILE_PIXELS = 256
+MAX_AGGREGATED_ZOOM = 10
+# decimals kept for coordinates: 5 is about a metre for the points, 2 about a kilometre for the basemap
+POINT_PRECISION = 5
+BASEMAP_PRECISION = 2
+
+### POINTS AND GRID AGGREGATION ###
+
+def read_geocoded(path):
+    """
+    Reads a locations_geocoded.tsv file, with every value as a string as written.
+    """
+    return pd.read_csv(path, sep='\t', quotechar='"', encoding='utf-8', dtype=str, keep_default_na=False)
+
+def geocoded_points(df_results):
+    """
+    Returns the distinct geocoded points of a results DataFrame, with column operations only:
+    rows with no coordinates (no result, or not geocoded) are dropped, and rows with the same
+    location string, result and coordinates are counted once.
+    :param df_results: DataFrame with the columns of locations_geocoded.tsv
+    :return: DataFrame with columns lat, lon, loc, result, type and count (number of rows)
+    """
+    lat = pd.to_numeric(df_results.geocode_lat, errors='coerce')
+    lon = pd.to_numeric(df_results.geocode_lon, errors='coerce')
+    found = lat.notnull() & lon.notnull()
+    points = pd.DataFrame({'lat': lat[found].round(POINT_PRECISION), 'lon': lon[found].round(POINT_PRECISION),
+                           'loc': df_results.clean_content_loc[found].astype(str),
+                           'result': df_results.geocode_str[found].astype(str),
+                           'type': df_results.geocode_type[found].astype(str)})
+    counts = points.groupby(['lat', 'lon', 'loc', 'result', 'type'], sort=False).size()
+    return counts.rename('count').reset_index()
+
+def cell_degrees(zoom, cell_pixels=CELL_PIXELS):
+    """
+    Width in degrees of a grid cell of about cell_pixels at a zoom level (cells are square in
+    degrees, so they are taller on the map away from the equator).
+    """
+    return 360.0 / 2 ** zoom * cell_pixels / TILE_PIXELS
+
+def grid_aggregate(points, cell):
+    """
+    Groups points into square grid cells.
+    :param points: DataFrame from geocoded_points
+    :param cell: cell width in degrees
+    :return: DataFrame with one row per non-empty cell: lat and lon (the centre of its points,
+    weighted by their counts), count (sum of the counts), n_points, and point (the position of
+    one of its points, for the popup of a cell with a single point)
+    """
+    weights = points['count']
+    cells = pd.DataFrame({'row': np.floor(points.lat / cell), 'col': np.floor(points.lon / cell),
+                          'count': weights, 'lat': points.lat * weights, 'lon': points.lon * weights,
+                          'point': np.arange(len(points))})
+    grouped = cells.groupby(['row', 'col'], sort=False).agg(
+        count=('count', 'sum'), lat=('lat', 'sum'), lon=('lon', 'sum'), n_points=('point', 'size'),
+        point=('point', 'first'))
+    grouped['lat'] = (grouped.lat / grouped['count']).round(POINT_PRECISION)
+    grouped['lon'] = (grouped.lon / grouped['count']).round(POINT_PRECISION)
+    return grouped.reset_index(drop=True)
+
+def map_payload(points, max_aggregated_zoom=MAX_AGGREGATED_ZOOM, cell_pixels=CELL_PIXELS):
+    """
+    Builds the data embedded in the map, as columns rather than one object per point: the
+    distinct strings once each, the points referring to them by position, and the grid cells
+    of each zoom level. Levels stop at the first zoom where every point has a cell of its own.
+    :param points: DataFrame from geocoded_points
+    :return: dict ready to dump as JSON
+    """
+    codes, strings = pd.factorize(pd.concat([points['loc'], points.result, points.type], ignore_index=True))
+    n = len(points)
+    payload = {'strings': strings.tolist(),
+               'points': {'lat': points.lat.tolist(), 'lon': points.lon.tolist(), 'count': points['count'].tolist(),
+                          'loc': codes[:n].tolist(), 'result': codes[n:2 * n].tolist(), 'type': codes[2 * n:].tolist()},
+               'levels': []}
+    for zoom in range(max_aggregated_zoom + 1):
+        cells = grid_aggregate(points, cell_degrees(zoom, cell_pixels))
+        if len(cells) == n:
+            break
+        payload['levels'].append({'lat': cells.lat.tolist(), 'lon': cells.lon.tolist(), 'count': cells['count'].tolist(),
+                                  'n_points': cells.n_points.tolist(), 'point': cells.point.tolist()})
+    return payload
+
+### BASEMAP ###
+
+def _round_coordinates(coordinates, precision):
+    if isinstance(coordinates, (int, float)):
+        return round(coordinates, precision)
+    return [_round_coordinates(c, precision) for c in coordinates]
+
+def read_basemap(path, precision=BASEMAP_PRECISION):
+    """
+    Reads a local GeoJSON file of outlines (e.g. Natural Earth's ne_110m_admin_0_countries.geojson)
+    keeping only the geometries, rounded to a few decimals, which makes it several times smaller.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        geojson = json.load(f)
+    features = geojson['features'] if geojson.get('type') == 'FeatureCollection' else [geojson]
+    return {'type': 'FeatureCollection',
+            'features': [{'type': 'Feature', 'properties': {},
+                          'geometry': {'type': feature['geometry']['type'],
+                                       'coordinates': _round_coordinates(feature['geometry']['coordinates'], precision)}}
+                         for feature in features if feature.get('geometry')]}
+
+### MAP ###
+
+class GridMarkers(MacroElement):
+    """
+    Draws the points of a map_payload on a folium map: the grid cells of the current zoom level
+    (or the points themselves when zoomed in far enough) as circles on a canvas, redrawn on each
+    zoom change, with popups built in the browser when clicked. Optionally draws a basemap,
+    embedded (a dict, see read_basemap) or loaded by the browser (a url).
+    """
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var data = {{ this.payload }};
+            var basemap = {{ this.basemap }};
+            var basemapStyle = {{ this.basemap_style }};
+            if (typeof basemap === 'string') {
+                fetch(basemap).then(function(response) { return response.json(); }).then(function(geojson) {
+                    L.geoJson(geojson, {style: basemapStyle, interactive: false}).addTo(map).bringToBack();
+                });
+            } else if (basemap) {
+                L.geoJson(basemap, {style: basemapStyle, interactive: false}).addTo(map);
+            }
+            var renderer = L.canvas();
+            var layer = L.layerGroup().addTo(map);
+            var strings = data.strings, points = data.points;
+            function escape(text) {
+                return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+            }
+            function pointPopup(i) {
+                return 'geocoded string: ' + escape(strings[points.loc[i]]) + '<br>' +
+                    'result string: ' + escape(strings[points.result[i]]) + '<br>' +
+                    'result point: ' + points.lat[i] + ', ' + points.lon[i] + '<br>' +
+                    'result type: ' + escape(strings[points.type[i]]) + '<br>' +
+                    (points.count[i] > 1 ? 'mentions: ' + points.count[i] + '<br>' : '');
+            }
+            function cellPopup(level, j) {
+                if (level.n_points[j] == 1) {
+                    return pointPopup(level.point[j]);
+                }
+                return level.count[j] + ' mentions of ' + level.n_points[j] + ' locations<br>zoom in to see them';
+            }
+            function marker(lat, lon, count, popup) {
+                var radius = Math.min(5 + 2 * Math.log(count) / Math.LN2, 30);
+                return L.circleMarker([lat, lon], {renderer: renderer, radius: radius, color: '{{ this.color }}',
+                                                   fillColor: '{{ this.color }}', weight: 1, fillOpacity: 0.5})
+                    .bindPopup(popup, {maxWidth: 400});
+            }
+            function draw() {
+                layer.clearLayers();
+                var zoom = Math.round(map.getZoom());
+                if (zoom < data.levels.length) {
+                    var level = data.levels[zoom];
+                    level.lat.forEach(function(lat, j) {
+                        layer.addLayer(marker(lat, level.lon[j], level.count[j], function() { return cellPopup(level, j); }));
+                    });
+                } else {
+                    points.lat.forEach(function(lat, i) {
+                        layer.addLayer(marker(lat, points.lon[i], points.count[i], function() { return pointPopup(i); }));
+                    });
+                }
+            }
+            map.on('zoomend', draw);
+            draw();
+        })();
+        {% endmacro %}
+        """)
+
+    def __init__(self, payload, basemap=None, color=MARKER_COLOR):
+        """
+        :param payload: dict from map_payload
+        :param basemap: GeoJSON dict to embed, url for the browser to load, or None
+        :param color: color of the circles
+        """
+        super(GridMarkers, self).__init__()
+        self._name = 'GridMarkers'
+        self.payload = _script_json(payload)
+        self.basemap = _script_json(basemap)
+        self.basemap_style = json.dumps(BASEMAP_STYLE)
+        self.color = color
+
+def _script_json(value):
+    # compact, and never closing the script tag it is embedded in
+    return json.dumps(value, separators=(',', ':')).replace('</', '<\\/')
+
+def write_map(df_results, path, basemap=None, max_aggregated_zoom=MAX_AGGREGATED_ZOOM, cell_pixels=CELL_PIXELS):
+    """
+    Writes a map of the geocoded locations, with the popups of the map-results notebook. Points are
+    aggregated into grid cells at low zoom levels and the data is embedded once, so the html
+    file grows slowly with the number of points and stays quick to open.
+    :param df_results: DataFrame with the columns of locations_geocoded.tsv
+    :param path: path of the html file
+    :param basemap: path of a local GeoJSON file of outlines (e.g. country borders), embedded in the
+    map instead of map tiles; a url is loaded by the browser when the map is opened
+    :param max_aggregated_zoom: highest zoom level at which points are grouped into cells
+    :param cell_pixels: approximate size of the grid cells on screen
+    :return: number of distinct points drawn
+    """
+    points = geocoded_points(df_results)
+    if basemap and '://' not in basemap:
+        basemap = read_basemap(basemap)
+    # tiles are loaded by the browser, so writing the map needs no network access
+    result_map = folium.Map(tiles=None if basemap else 'OpenStreetMap', location=[30, 0], zoom_start=2)
+    GridMarkers(map_payload(points, max_aggregated_zoom, cell_pixels), basemap=basemap).add_to(result_map)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    result_map.save(path)
+    return len(points)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pysci.mapping', description="Writes a map of geocoded locations.")
+    parser.add_argument('geocoded_tsv', help="locations_geocoded.tsv")
+    parser.add_argument('map_path', help="html file to write")
+    parser.add_argument('--basemap', help="local GeoJSON file of outlines to draw instead of map tiles")
+    parser.add_argument('--max-aggregated-zoom', type=int, default=MAX_AGGREGATED_ZOOM)
+    parser.add_argument('--cell-pixels', type=int, default=CELL_PIXELS)
+    args = parser.parse_args(argv)
+    n_points = write_map(read_geocoded(args.geocoded_tsv), args.map_path, basemap=args.basemap,
+                         max_aggregated_zoom=args.max_aggregated_zoom, cell_pixels=args.cell_pixels)
+    print("Mapped %s distinct points into %s" % (n_points, args.map_path))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,829 @@
+# Incremental runner for the notebook stages over a directory of pdfs: python -m pysci.pipeline pdfs
+import io
+import os
+import sys
+import time
+import pickle
+import hashlib
+import argparse
+import subprocess
+import pandas as pd
+
+from pysci import docutils as du
+from pysci import convertpdf as pdf
+from pysci import geoparse as gp
+from pysci import geocode as gc
+from pysci import coordinates as co
+from pysci import results
+from pysci import instrument
+
+# each stage and the stages whose outputs it reads, in the order they run
+STAGE_DEPENDENCIES = {'convert': (),
+                      'extract': ('convert',),
+                      'locate': ('extract',),
+                      'geocode': ('locate',),
+                      'map': ('geocode',)}
+STAGES = tuple(STAGE_DEPENDENCIES)
+# bump a stage's version when a code change alters its output, so cached outputs are recomputed
+STAGE_VERSIONS = {'convert': 1, 'extract': 1, 'locate': 2, 'geocode': 2, 'map': 1}
+# methods section regular expressions for the text and xml of each kind of corpus
+METHODS_PATTERNS = {'orchards': (gp.RE_ORCHARDS_METHODS_TEXT, gp.RE_ORCHARDS_METHODS_HEADINGS),
+                    'biomed': (gp.RE_BIOMED_METHODS_TEXT, gp.RE_BIOMED_METHODS_HEADINGS)}
+# the ScienceDoc fields read by the locate stage: a change in any other field (e.g. the year) doesn't rerun NER
+LOCATE_INPUT_FIELDS = ('has_xml', 'title', 'relevant_text')
+LOCATE_FIELDS = ('title_locations', 'content_locations', 'content_locations_filtered', 'location_sentences')
+ARTICLES_COLUMNS = ['filename_only', 'use_xml', 'title', 'title_locations', 'methods_sections', 'content_locations',
+                    'content_locations_filtered', 'location_sentences']
+LOCATIONS_COLUMNS = ['filename', 'content_locations', 'use_xml', 'location_sentences']
+GEOCODED_COLUMNS = ['filename', 'content_locations', 'clean_content_loc', 'geocode_str', 'geocode_type',
+                    'geocode_lat', 'geocode_lon', 'use_xml', 'location_sentences']
+# the results TSVs, and the name of their file name column
+RESULTS_TSVS = (('articles_geoparsed.tsv', 'filename_only'), ('locations.tsv', 'filename'),
+                ('locations_geocoded.tsv', 'filename'))
+# what to do with the locations whose sentence states coordinates: not geocode them (unless the
+# signs of the coordinates are a guess), or geocode them and keep the stated point if the result is near it
+COORDINATE_MODES = ('skip', 'check')
+SHARDS_DIR = 'shards'
+SHARD_MANIFEST = 'documents.tsv'
+COUNTRY_GEOJSON_URL = 'https://d2ad6b4ur7yvpq.cloudfront.net/naturalearth-3.3.0/ne_110m_admin_0_countries.geojson'
+
+### HASHING AND CACHING ###
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def hash_value(value):
+    """
+    Hash of any picklable value without reference cycles, e.g. a stage's output. Equal values
+    built the same way (same dict insertion order) hash the same.
+    """
+    data = io.BytesIO()
+    pickler = pickle.Pickler(data, protocol=4)
+    # no memo: whether equal strings are the same object or not (e.g. fresh or unpickled) mustn't matter
+    pickler.fast = True
+    pickler.dump(value)
+    return hash_bytes(data.getvalue())
+
+def hash_file(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def stage_key(stage, params, inputs):
+    """
+    Cache key of one stage's output for one document: a hash of the stage (and its version),
+    its parameters, and the hashes of its inputs.
+    """
+    return hash_value((stage, STAGE_VERSIONS[stage], sorted(params.items()), inputs))
+
+class StageCache:
+    """
+    Stage outputs pickled one file per (stage, key) under a cache directory. Files are written
+    to a temporary name first, so a killed run never leaves a half-written output behind.
+    File hashes are remembered by path, size and modification time, so unchanged pdfs and
+    xml files aren't read again on every run.
+    """
+    FILE_HASHES = 'file_hashes.pkl'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.file_hashes_path = os.path.join(cache_dir, self.FILE_HASHES)
+        try:
+            self.file_hashes = du.load_data(self.file_hashes_path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.file_hashes = {}
+
+    def _path(self, stage, key):
+        return os.path.join(self.cache_dir, stage, key[:2], key + '.pkl')
+
+    def get(self, stage, key, default=None):
+        try:
+            return du.load_data(self._path(stage, key))
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+
+    def put(self, stage, key, value):
+        path = self._path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # several workers may share the cache directory
+        part_path = '%s.%d.part' % (path, os.getpid())
+        with open(part_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(part_path, path)
+
+    def file_hash(self, path):
+        """
+        Returns the hash of a file's contents, or None if there is no such file.
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        abspath = os.path.abspath(path)
+        known = self.file_hashes.get(abspath)
+        if known and known[:2] == (stat.st_size, stat.st_mtime_ns):
+            return known[2]
+        file_hash = hash_file(path)
+        self.file_hashes[abspath] = (stat.st_size, stat.st_mtime_ns, file_hash)
+        return file_hash
+
+    def save_file_hashes(self):
+        part_path = '%s.%d.part' % (self.file_hashes_path, os.getpid())
+        with open(part_path, 'wb') as f:
+            pickle.dump(self.file_hashes, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(part_path, self.file_hashes_path)
+
+### DOCUMENTS ###
+
+class PipelineDoc:
+    """
+    One pdf going through the pipeline: its ScienceDoc, the paths of its files, and the
+    output of each stage that has run, with the hash of that output for the stages after it.
+    """
+    def __init__(self, pdf_filepath, corpus_name):
+        self.pdf_filepath = pdf_filepath
+        self.txt_filepath = pdf.txt_filepath_for(pdf_filepath)
+        self.xml_filepath = du.remove_extension(pdf_filepath) + du.XML_extension
+        self.file_name = du.remove_extension(os.path.basename(pdf_filepath))
+        self.scidoc = du.ScienceDoc(corpus_name=corpus_name, file_name=self.file_name)
+        self.outputs = {}
+        self.output_hashes = {}
+
+    def set_output(self, stage, output):
+        self.outputs[stage] = output
+        self.output_hashes[stage] = hash_value(output)
+
+def locations_table(scidocs):
+    """
+    One row per filtered content location, or a placeholder row for documents without any,
+    as written to results/locations.tsv by the identify-and-filter-locations notebook.
+    :return: a DataFrame with columns filename, content_locations, use_xml, location_sentences
+    """
+    rows = []
+    for doc in scidocs:
+        if not doc.content_locations_filtered:
+            # store the 'no location' case!
+            rows.append((doc.file_name, gp.NO_LOCATIONS_STRING, doc.use_xml, gp.NO_LOCATIONS_STRING))
+        elif doc.content_locations_filtered == gp.NO_METHODS_STRING:
+            rows.append((doc.file_name, gp.NO_METHODS_STRING, doc.use_xml, gp.NO_METHODS_STRING))
+        else:
+            for location in doc.content_locations_filtered:
+                sentence = next((sentence for sentence in doc.location_sentences if location in sentence),
+                                results.NO_SENTENCE_STRING)
+                rows.append((doc.file_name, location, doc.use_xml, sentence))
+    return pd.DataFrame(rows, columns=LOCATIONS_COLUMNS)
+
+def articles_table(scidocs):
+    """
+    One row per document with its title, methods sections and locations, as written to
+    results/articles_geoparsed.tsv by the identify-and-filter-locations notebook.
+    """
+    def joined(locations):
+        if not locations:
+            return ''
+        if locations == gp.NO_METHODS_STRING:
+            return locations
+        return '; '.join(locations)
+
+    rows = []
+    for doc in scidocs:
+        if doc.title_locations in (gp.NO_XML_STRING, gp.NO_TITLE_STRING):
+            title_locations = doc.title_locations
+        else:
+            title_locations = '; '.join(doc.title_locations)
+        rows.append((doc.file_name, doc.use_xml, getattr(doc, 'title', gp.NO_TITLE_STRING), title_locations,
+                     getattr(doc, 'methods_sections', ''), joined(doc.content_locations),
+                     joined(doc.content_locations_filtered), doc.location_sentences or ''))
+    return pd.DataFrame(rows, columns=ARTICLES_COLUMNS)
+
+def extract_fields(text, xml_filepath, params):
+    """
+    Same steps as the extract-text notebook, for one document.
+    :param text: the text converted from the pdf, None if the conversion failed
+    :param xml_filepath: path of the Cermine xml, which may not exist
+    :param params: the extract stage's parameters (see Pipeline.params)
+    :return: dict of the ScienceDoc fields set
+    """
+    fields = {'has_text': False, 'has_xml': False}
+    if text is not None:
+        fields['has_text'] = True
+        fields['raw_contents'] = text
+        section_titles_txt, relevant_text_txt = gp.extract_methods_text(
+            text, par_range=params['par_range_text'], max_words_in_heading=params['max_words_in_heading'],
+            re_to_match=params['re_text'])
+    else:
+        section_titles_txt, relevant_text_txt = [], ''
+    if os.path.isfile(xml_filepath):
+        fields['has_xml'] = True
+        record = du.extract_xml_fields(xml_filepath, re_to_match=params['re_headings'],
+                                       par_range=params['par_range_xml'])
+        for field in ('title', 'year', 'journal', 'xml_contents', 'authors', 'affiliations', 'countries'):
+            fields[field] = record[field]
+        section_titles_xml = [section_title for section_title, _ in record['methods']]
+        relevant_text_xml = '\n\n'.join(text_contents for _, text_contents in record['methods'])
+    else:
+        section_titles_xml, relevant_text_xml = [], ''
+    # use the xml unless we found no relevant headings in it, or too little text under them
+    fields['use_xml'] = bool(section_titles_xml) and len(relevant_text_xml) >= params['min_characters']
+    if fields['use_xml']:
+        fields['methods_sections'], fields['relevant_text'] = section_titles_xml, relevant_text_xml
+    else:
+        fields['methods_sections'], fields['relevant_text'] = section_titles_txt, relevant_text_txt
+    return fields
+
+def location_queries(locations):
+    """
+    Returns the strings to geocode for the content locations of a document (the content_locations
+    column of its locations_table), None for the placeholders, which aren't geocoded.
+    """
+    return [None if location in (gp.NO_METHODS_STRING, gp.NO_LOCATIONS_STRING) else gc.clean_for_geocode(location)
+            for location in locations]
+
+def location_points(locations, sentences):
+    """
+    Returns the point stated in the sentence of each content location (see coordinates.find_points),
+    the one nearest to the location if there are several, None if there are none.
+    :param locations: content_locations of rows of a locations_table
+    :param sentences: location_sentences of the same rows
+    """
+    found = co.points_in_texts(sentences)
+    return [co.nearest_point(found[sentence], sentence, location) if sentence in found else None
+            for location, sentence in zip(locations, sentences)]
+
+def geocode_queries(queries, points, coordinates=None):
+    """
+    Returns the queries (from location_queries) to send to the geocoder: all of them but the
+    placeholders, and with coordinates='skip', but those of locations with a stated point whose
+    signs aren't a guess.
+    :param points: stated point of each location, from location_points, or None
+    """
+    return [query for query, point in zip(queries, points)
+            if query is not None and not (coordinates == 'skip' and point is not None and not point.ambiguous)]
+
+def geocoded_location(location, query, top, point=None):
+    """
+    Returns (clean text, address, location type, lat, lon) for a content location, as the
+    clean-and-geocode notebook does. A location with a point stated in its sentence is placed
+    there, with the stated text as address and coordinates.COORDINATES_TYPE as type, unless
+    it was geocoded to somewhere else (see coordinates.check_point). A point whose signs are a
+    guess is only used once a geocoding result agrees with it.
+    :param query: its string to geocode, from location_queries
+    :param top: the top geocoding result for the query, empty or None if there was none
+    :param point: the point stated in its sentence, from location_points, or None
+    """
+    if query is None:
+        return (location,) * 5
+    if point is not None:
+        if top:
+            location_found = top['geometry']['location']
+            stated = co.check_point(point, location_found['lat'], location_found['lng'])
+        elif point.ambiguous:
+            # nothing to tell its signs by, nor whether it is a point at all ("Table 3.141, 2.718")
+            stated = None
+        else:
+            stated = (point.lat, point.lon)
+        if stated is not None:
+            instrument.count('geocode.stated_points')
+            return (query, point.text, co.COORDINATES_TYPE) + stated
+        instrument.count('geocode.stated_points_mismatched')
+    if top:
+        geometry = top['geometry']
+        return (query, top['formatted_address'], geometry['location_type'],
+                geometry['location']['lat'], geometry['location']['lng'])
+    return (query,) + (gc.NO_RESULT_STRING,) * 4
+
+def geocoded_rows(scidoc, geocoded):
+    """
+    Returns the rows of locations_geocoded.tsv (GEOCODED_COLUMNS) for a document.
+    :param geocoded: (clean text, address, location type, lat, lon) per row of its locations_table
+    """
+    rows = []
+    for row, (clean_text, geocode_str, geocode_type, lat, lon) in zip(locations_table([scidoc]).itertuples(index=False),
+                                                                      geocoded):
+        rows.append((row.filename, row.content_locations, clean_text, geocode_str, geocode_type,
+                     lat, lon, row.use_xml, row.location_sentences))
+    return rows
+
+def write_tsv(df, path):
+    # same format as the notebooks' exports
+    df.to_csv(path, sep='\t', index=False, quotechar='"', encoding='utf-8')
+
+### PIPELINE ###
+
+class Pipeline:
+    """
+    Runs the stages of the notebooks over a directory of pdfs: convert (pdf to text), extract
+    (text and Cermine xml to a ScienceDoc with its methods sections), locate (NER and location
+    chunks), geocode and map. Each stage's output is cached per document under a key hashing the
+    stage's inputs and parameters (e.g. the methods regular expressions and par_range), so a
+    rerun only recomputes what changed: adding pdfs only runs NER on the new ones, changing the
+    regular expressions reruns extract for all documents but NER only where the relevant text
+    actually changed. Cermine xml files are read if present next to the pdfs (see cermine.CerminePool).
+    The results TSVs are written to results_dir as the notebooks write them.
+    Example use:
+        pipeline = Pipeline('pdfs', corpus='orchards', tagger=StanfordNERTagger(...), tagger_name='3class',
+                            geocoder=gazetteer.GazetteerGeocoder('geonames.sqlite'), geocoder_name='geonames')
+        docs = pipeline.run()
+        pipeline.print_report()
+    """
+    def __init__(self, pdf_dir, cache_dir='pipeline_cache', results_dir='results', map_path=None,
+                 corpus_name='corpus', corpus='orchards', par_range_text=4, par_range_xml=3,
+                 max_words_in_heading=8, min_characters=100, tagger=None, tagger_name=None, batch_size=2000,
+                 prefilter=None, geocoder=None, geocoder_name=None, geocode_cache=None, coordinates=None,
+                 canonicalize=False, results_store=None, country_geojson=None, processes=None,
+                 timeout=600, force=(), shard=None, n_shards=1, verbose=False):
+        """
+        :param pdf_dir: directory of the pdfs (and of their txt and .cermxml files)
+        :param cache_dir: directory of the stage cache
+        :param results_dir: directory for the results TSVs
+        :param map_path: path of the map html file, default maps/result_map.html
+        :param corpus: key of METHODS_PATTERNS choosing the methods regular expressions
+        :param tagger: NER tagger with a tag_sents method, only needed if some documents need locating
+        :param tagger_name: identifies the tagger and its model in the cache keys
+        :param prefilter: optional geoparse.SentencePrefilter, only the sentences it keeps are tagged
+        :param geocoder: geocoder (googlemaps.Client, gazetteer.GazetteerGeocoder), only needed if some
+        locations need geocoding
+        :param geocoder_name: identifies the geocoder in the cache keys
+        :param geocode_cache: SqliteGeocodeCache or dict, default a SqliteGeocodeCache in the cache directory
+        :param coordinates: None, or what to do with locations whose sentence states coordinates (see
+        COORDINATE_MODES): 'skip' places them there without geocoding, 'check' geocodes them too
+        :param canonicalize: geocode each canonical form of the location strings once (see
+        geocode.canonical_key), rather than each distinct string
+        :param results_store: if given, also write the geocoded results to a results store in this
+        directory (see results.ResultsWriter), rewritten on each run as the TSVs are
+        :param country_geojson: country outlines for the map (see write_map)
+        :param processes: number of processes converting pdfs
+        :param timeout: per-pdf conversion timeout in seconds
+        :param force: stages to recompute for all documents, whatever is cached
+        :param shard: if given, only process the documents of this shard (see shard_of), writing the
+        results TSVs and geocode cache to the shard's own directory under results_dir, for merge_shards
+        :param n_shards: number of shards the corpus is split into
+        """
+        self.pdf_dir = pdf_dir
+        self.cache = StageCache(cache_dir)
+        self.shard = shard
+        self.n_shards = n_shards
+        if shard is not None:
+            if not 0 <= shard < n_shards:
+                raise ValueError("shard must be in 0..%s, not %s" % (n_shards - 1, shard))
+            results_dir = shard_dir(results_dir, shard, n_shards)
+            if results_store:
+                # each shard writes a store of its own documents, with its results
+                results_store = os.path.join(results_dir, os.path.basename(os.path.normpath(results_store)))
+        self.results_dir = results_dir
+        self.map_path = map_path or os.path.join('maps', 'result_map.html')
+        self.country_geojson = country_geojson
+        self.corpus_name = corpus_name
+        self.tagger = tagger
+        self.prefilter = prefilter
+        self.geocoder = geocoder
+        if coordinates is not None and coordinates not in COORDINATE_MODES:
+            raise ValueError("coordinates must be one of %s, not %r" % (COORDINATE_MODES, coordinates))
+        self.coordinates = coordinates
+        self.canonicalize = canonicalize
+        self.results_store = results_store
+        if geocode_cache is None:
+            # a shard's cache goes with its results, to be merged with the others
+            geocode_dir = cache_dir if shard is None else results_dir
+            os.makedirs(geocode_dir, exist_ok=True)
+            geocode_cache = gc.SqliteGeocodeCache(os.path.join(geocode_dir, 'geocode_cache.sqlite'))
+        self.geocode_cache = geocode_cache
+        self.processes = processes
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.force = set(force)
+        self.verbose = verbose
+        re_text, re_headings = METHODS_PATTERNS[corpus]
+        self.params = {'convert': {},
+                       'extract': {'re_text': re_text, 're_headings': re_headings, 'par_range_text': par_range_text,
+                                   'par_range_xml': par_range_xml, 'max_words_in_heading': max_words_in_heading,
+                                   'min_characters': min_characters},
+                       'locate': {'tagger': tagger_name},
+                       'geocode': {'geocoder': geocoder_name},
+                       'map': {'country_geojson': country_geojson}}
+        if prefilter is not None:
+            # only set with a prefilter, so the cache of runs without one stays valid
+            self.params['locate']['prefilter'] = hash_value(prefilter.settings())
+        if coordinates is not None:
+            self.params['geocode']['coordinates'] = coordinates
+        if canonicalize:
+            self.params['geocode']['canonicalize'] = True
+        self.report = {}
+
+    def run(self, until='map'):
+        """
+        Runs the stages up to and including 'until' over all the pdfs in pdf_dir (or in the
+        pipeline's shard of them). A shard stops before the map, which merge_shards draws.
+        :return: list of PipelineDoc
+        """
+        pdf_filepaths = pdf.find_pdf_files(self.pdf_dir)
+        if self.shard is not None:
+            pdf_filepaths = [pdf_filepath for pdf_filepath in pdf_filepaths
+                             if shard_of(du.remove_extension(os.path.basename(pdf_filepath)), self.n_shards) == self.shard]
+            os.makedirs(self.results_dir, exist_ok=True)
+            write_tsv(pd.DataFrame({'pdf_path': [os.path.relpath(path, self.pdf_dir) for path in pdf_filepaths]}),
+                      os.path.join(self.results_dir, SHARD_MANIFEST))
+            if until == 'map':
+                until = 'geocode'
+        docs = [PipelineDoc(pdf_filepath, self.corpus_name) for pdf_filepath in pdf_filepaths]
+        for stage in STAGES[:STAGES.index(until) + 1]:
+            start = time.time()
+            with instrument.timer('pipeline.' + stage):
+                getattr(self, '_run_' + stage)(docs)
+            self.report.setdefault(stage, {})['seconds'] = time.time() - start
+        self.cache.save_file_hashes()
+        return docs
+
+    def _run_cached(self, stage, docs, inputs, compute):
+        """
+        Fills in a document stage: cached outputs where there are some, compute(missing docs)
+        for the rest. Outputs which are None (e.g. a failed conversion) are not cached.
+        :param inputs: function returning the input hashes of a document for this stage
+        :param compute: function returning the outputs for a list of documents, aligned with it
+        """
+        params = self.params[stage]
+        missing = []
+        keys = {}
+        for doc in docs:
+            keys[doc] = key = stage_key(stage, params, inputs(doc))
+            output = self.cache.get(stage, key, default=None) if stage not in self.force else None
+            if output is None:
+                missing.append(doc)
+            else:
+                doc.set_output(stage, output)
+        if missing:
+            for doc, output in zip(missing, compute(missing)):
+                doc.set_output(stage, output)
+                if output is not None:
+                    self.cache.put(stage, keys[doc], output)
+        self.report[stage] = {'cached': len(docs) - len(missing), 'computed': len(missing)}
+        if self.verbose:
+            print("%s: %s cached, %s computed" % (stage, len(docs) - len(missing), len(missing)))
+
+    def _run_convert(self, docs):
+        self._run_cached('convert', docs, lambda doc: (self.cache.file_hash(doc.pdf_filepath),), self._convert)
+
+    def _convert(self, docs):
+        # a txt file at least as recent as its pdf was converted from this version of it
+        to_convert = [doc for doc in docs if not (os.path.isfile(doc.txt_filepath) and
+                      os.path.getmtime(doc.txt_filepath) >= os.path.getmtime(doc.pdf_filepath))]
+        if to_convert:
+            pdf.convert_pdfs([doc.pdf_filepath for doc in to_convert], processes=self.processes,
+                             timeout=self.timeout, skip_existing=False, verbose=self.verbose)
+        texts = []
+        for doc in docs:
+            try:
+                with open(doc.txt_filepath, 'r', encoding='utf-8') as f:
+                    texts.append(f.read())
+            except OSError:
+                # conversion failed: tried again next time
+                texts.append(None)
+        return texts
+
+    def _run_extract(self, docs):
+        self._run_cached('extract', docs,
+                         lambda doc: (doc.output_hashes['convert'], self.cache.file_hash(doc.xml_filepath)),
+                         lambda missing: [self._extract_one(doc) for doc in missing])
+        for doc in docs:
+            for field, value in doc.outputs['extract'].items():
+                setattr(doc.scidoc, field, value)
+
+    def _extract_one(self, doc):
+        with instrument.document(doc.file_name):
+            return self._extract(doc)
+
+    def _extract(self, doc):
+        return extract_fields(doc.outputs['convert'], doc.xml_filepath, self.params['extract'])
+
+    def _run_locate(self, docs):
+        self._run_cached('locate', docs,
+                         lambda doc: (hash_value([doc.outputs['extract'].get(field) for field in LOCATE_INPUT_FIELDS]),),
+                         self._locate)
+        for doc in docs:
+            # a document locating failed on gets no locations this run, and is located again next run
+            for field, value in (doc.outputs['locate'] or {field: [] for field in LOCATE_FIELDS}).items():
+                setattr(doc.scidoc, field, value)
+        os.makedirs(self.results_dir, exist_ok=True)
+        scidocs = [doc.scidoc for doc in docs]
+        write_tsv(articles_table(scidocs), os.path.join(self.results_dir, 'articles_geoparsed.tsv'))
+        write_tsv(locations_table(scidocs), os.path.join(self.results_dir, 'locations.tsv'))
+
+    def _locate(self, docs):
+        if self.tagger is None and any(doc.outputs['extract'].get('relevant_text') for doc in docs):
+            raise ValueError("%s documents need locating, but the pipeline has no NER tagger" % len(docs))
+        scidocs = []
+        for doc in docs:
+            # only what the locate stage reads, so the outputs only depend on its inputs
+            scidoc = du.ScienceDoc(self.corpus_name, doc.file_name)
+            for field in LOCATE_INPUT_FIELDS:
+                if field in doc.outputs['extract']:
+                    setattr(scidoc, field, doc.outputs['extract'][field])
+            scidocs.append(scidoc)
+        gp.locate_in_documents(scidocs, self.tagger, batch_size=self.batch_size, prefilter=self.prefilter,
+                               verbose=self.verbose)
+        # failed documents have no outputs, so aren't cached
+        self.report['locate_errors'] = [(scidoc.file_name, scidoc.locate_error) for scidoc in scidocs
+                                        if scidoc.locate_error is not None]
+        return [None if scidoc.locate_error is not None else {field: getattr(scidoc, field) for field in LOCATE_FIELDS}
+                for scidoc in scidocs]
+
+    def _run_geocode(self, docs):
+        self._run_cached('geocode', docs, self._geocode_inputs, self._geocode)
+        doc_rows = [geocoded_rows(doc.scidoc, doc.outputs['geocode']) for doc in docs]
+        self.geocoded = pd.DataFrame([row for rows in doc_rows for row in rows], columns=GEOCODED_COLUMNS)
+        os.makedirs(self.results_dir, exist_ok=True)
+        write_tsv(self.geocoded, os.path.join(self.results_dir, 'locations_geocoded.tsv'))
+        if self.results_store:
+            results.write_results_store(self.results_store, [doc.scidoc for doc in docs], doc_rows)
+
+    def _geocode_inputs(self, doc):
+        table = locations_table([doc.scidoc])
+        if self.coordinates:
+            # the points stated in the sentences change the results too
+            return hash_value(list(table.content_locations)), hash_value(list(table.location_sentences))
+        return (hash_value(list(table.content_locations)),)
+
+    def _geocode(self, docs):
+        """
+        Geocodes the locations of the documents as the clean-and-geocode notebook does, sending
+        the queries of all the documents in one geocode_batch.
+        :return: per document, a list of (clean text, address, location type, lat, lon) per location
+        """
+        tables = [locations_table([doc.scidoc]) for doc in docs]
+        doc_locations = [list(table.content_locations) for table in tables]
+        doc_queries = [location_queries(locations) for locations in doc_locations]
+        if self.coordinates:
+            doc_points = [location_points(locations, list(table.location_sentences))
+                          for locations, table in zip(doc_locations, tables)]
+        else:
+            doc_points = [[None] * len(locations) for locations in doc_locations]
+        doc_to_send = [geocode_queries(queries, points, self.coordinates)
+                       for queries, points in zip(doc_queries, doc_points)]
+        queries = [query for to_send in doc_to_send for query in to_send]
+        instrument.count('geocode.queries_skipped',
+                         sum(1 for queries in doc_queries for query in queries if query is not None) - len(queries))
+        if queries and self.geocoder is None:
+            raise ValueError("%s locations need geocoding, but the pipeline has no geocoder" % len(queries))
+        geocoded_results = {}
+        sent_as = {}  # the variant geocoded for each query, when canonicalizing
+        if queries and self.canonicalize:
+            index = gc.CanonicalIndex(queries)
+            representatives = {key: index.representative(key, self.geocode_cache) for key in index.variants}
+            sent_as = {query: representatives[key] for query, key in index.keys.items()}
+            to_geocode = list(representatives.values())
+            geocoded_results = index.fan_out(dict(zip(to_geocode, gc.geocode_batch(to_geocode, self.geocoder,
+                                                                                    cache=self.geocode_cache,
+                                                                                    verbose=self.verbose))))
+            self.report['canonical'] = index.report()
+        elif queries:
+            geocoded_results = dict(zip(queries, gc.geocode_batch(queries, self.geocoder, cache=self.geocode_cache,
+                                                                  verbose=self.verbose)))
+        outputs = []
+        for locations, queries, points, to_send in zip(doc_locations, doc_queries, doc_points, doc_to_send):
+            geocoded = [geocoded_location(location, query, geocoded_results.get(query), point)
+                        for location, query, point in zip(locations, queries, points)]
+            # queries which failed (rather than had no result) aren't in the geocode cache: try again next time
+            failed = any(sent_as.get(query, query) not in self.geocode_cache for query in to_send)
+            outputs.append(None if failed else geocoded)
+        return outputs
+
+    def _run_map(self, docs):
+        key = stage_key('map', self.params['map'], (hash_value(self.geocoded.values.tolist()),))
+        if 'map' not in self.force and os.path.isfile(self.map_path) and self.cache.get('map', key):
+            self.report['map'] = {'cached': 1, 'computed': 0}
+            return
+        write_map(self.geocoded, self.map_path, self.country_geojson)
+        self.cache.put('map', key, self.map_path)
+        self.report['map'] = {'cached': 0, 'computed': 1}
+
+    def print_report(self, out=sys.stdout):
+        for stage in STAGES:
+            if stage in self.report:
+                counts = self.report[stage]
+                out.write("%-8s %6s cached %6s computed %8.1fs\n" % (stage, counts.get('cached', 0),
+                                                                   counts.get('computed', 0), counts['seconds']))
+        if 'canonical' in self.report:
+            out.write(canonical_summary(self.report['canonical']) + '\n')
+        for file_name, error in self.report.get('locate_errors', []):
+            out.write("%s failed in locate: %s\n" % (file_name, error))
+
+def canonical_summary(report):
+    """
+    One line summing up a geocode.CanonicalIndex report.
+    """
+    return ("geocoded %s canonical forms of %s distinct location strings (dedup ratio %0.2f)"
+            % (report['keys'], report['variants'], report['dedup_ratio']))
+
+def write_map(df_results, path, country_geojson=None):
+    """
+    Writes a map of the geocoded locations, with popups as in the map-results notebook (see
+    mapping.write_map, which keeps it small with many points).
+    :param df_results: DataFrame with the columns of locations_geocoded.tsv
+    :param path: path of the html file
+    :param country_geojson: local GeoJSON file of country outlines to draw instead of map tiles;
+    a url, e.g. COUNTRY_GEOJSON_URL as in the notebook, is loaded by the browser
+    """
+    # folium is only imported when a map is drawn
+    from pysci import mapping
+    mapping.write_map(df_results, path, basemap=country_geojson)
+
+### SHARDING ###
+
+def shard_of(file_name, n_shards):
+    """
+    Shard of a document: a hash of its ScienceDoc.file_name, so every worker agrees on it
+    without talking to the others, and a document stays in its shard as the corpus grows.
+    """
+    return int(hashlib.md5(file_name.encode('utf-8')).hexdigest(), 16) % n_shards
+
+def shard_dir(results_dir, shard, n_shards):
+    return os.path.join(results_dir, SHARDS_DIR, 'shard-%03d-of-%03d' % (shard, n_shards))
+
+def _walk_order(pdf_path):
+    # position of a pdf in find_pdf_files: files in a directory come before those in its sub-directories
+    parts = os.path.normpath(pdf_path).split(os.sep)
+    return tuple(parts[:-1]), parts[-1]
+
+def _read_tsv(path):
+    # everything as the exact strings written, so merging doesn't reformat any value
+    return pd.read_csv(path, sep='\t', quotechar='"', encoding='utf-8', dtype=str, keep_default_na=False)
+
+def merge_shards(results_dir, n_shards, map_path=None, country_geojson=None, cache_dir='pipeline_cache'):
+    """
+    Merges the outputs of the shards of a corpus into the results TSVs of results_dir, and
+    their geocode caches into the geocode cache (geocode_cache.sqlite) of cache_dir, where an
+    unsharded Pipeline with that cache_dir finds it. The rows come out in the order the
+    unsharded pipeline writes them, so the merged TSVs are the same as from a single run.
+    :param results_dir: the results_dir given to the shards' pipelines
+    :param n_shards: number of shards; all of them must have finished
+    :param map_path: if given, also draw the map of all the geocoded locations there
+    :param country_geojson: country outlines for the map (see write_map)
+    :param cache_dir: the stage cache directory of the pipelines to reuse the geocode cache
+    :return: number of documents merged
+    """
+    shard_dirs = [shard_dir(results_dir, shard, n_shards) for shard in range(n_shards)]
+    missing = [path for path in shard_dirs if not os.path.isfile(os.path.join(path, SHARD_MANIFEST))]
+    if missing:
+        raise ValueError("Shards not run yet: %s" % ', '.join(missing))
+    # (walk order, shard, file name) of every document
+    documents = []
+    for shard, path in enumerate(shard_dirs):
+        for pdf_path in _read_tsv(os.path.join(path, SHARD_MANIFEST))['pdf_path']:
+            documents.append((_walk_order(pdf_path), shard, du.remove_extension(os.path.basename(pdf_path))))
+    documents.sort()
+    for tsv_name, filename_column in RESULTS_TSVS:
+        tsv_paths = [os.path.join(path, tsv_name) for path in shard_dirs]
+        if not all(os.path.isfile(tsv_path) for tsv_path in tsv_paths):
+            continue
+        frames = [_read_tsv(tsv_path) for tsv_path in tsv_paths]
+        all_rows = pd.concat(frames, ignore_index=True)
+        # row positions in all_rows of each (shard, document)
+        rows = {}
+        offset = 0
+        for shard, frame in enumerate(frames):
+            for position, file_name in enumerate(frame[filename_column], offset):
+                rows.setdefault((shard, file_name), []).append(position)
+            offset += len(frame)
+        order = [position for _, shard, file_name in documents for position in rows.get((shard, file_name), [])]
+        os.makedirs(results_dir, exist_ok=True)
+        write_tsv(all_rows.iloc[order], os.path.join(results_dir, tsv_name))
+    os.makedirs(cache_dir, exist_ok=True)
+    geocode_cache = gc.SqliteGeocodeCache(os.path.join(cache_dir, 'geocode_cache.sqlite'))
+    for path in shard_dirs:
+        cache_path = os.path.join(path, 'geocode_cache.sqlite')
+        if os.path.isfile(cache_path):
+            geocode_cache.merge(cache_path)
+    geocode_cache.close()
+    geocoded_path = os.path.join(results_dir, 'locations_geocoded.tsv')
+    if map_path and os.path.isfile(geocoded_path):
+        write_map(_read_tsv(geocoded_path), map_path, country_geojson)
+    return len(documents)
+
+def run_local_shards(n_shards, args):
+    """
+    Runs each shard in its own process on this machine, as separate nodes would: each process
+    runs the pipeline's command line with the given arguments and its --shard.
+    :param args: the command line arguments for the shards, including --shards
+    :return: exit codes of the shard processes
+    """
+    command = [sys.executable, '-m', 'pysci.pipeline'] + list(args)
+    procs = [subprocess.Popen(command + ['--shard', str(shard)]) for shard in range(n_shards)]
+    return [proc.wait() for proc in procs]
+
+### COMMAND LINE ###
+
+def make_tagger(model, jar=None):
+    """
+    Creates NLTK's StanfordNERTagger, e.g. for model 'english.all.3class.distsim.crf.ser.gz'
+    (found through the STANFORD_MODELS environment variable, as in the notebooks).
+    """
+    from nltk.tag import StanfordNERTagger
+    return StanfordNERTagger(model, path_to_jar=jar)
+
+def make_prefilter(gazetteer_index=None):
+    """
+    Creates the sentence prefilter for the command line, knowing the single-word names of the
+    bigger places of the gazetteer if an index is given.
+    """
+    if gazetteer_index:
+        from pysci import gazetteer
+        return gp.SentencePrefilter(names=gazetteer.index_words(gazetteer_index))
+    return gp.SentencePrefilter()
+
+def make_geocoder(gazetteer_index=None, google_key_file=None):
+    """
+    Creates the geocoder for the command line: the offline gazetteer if an index is given,
+    else googlemaps with the key in the file.
+    :return: (geocoder, name identifying it in the cache keys), or (None, None)
+    """
+    if gazetteer_index:
+        from pysci import gazetteer
+        return gazetteer.GazetteerGeocoder(gazetteer_index), 'gazetteer:' + os.path.basename(gazetteer_index)
+    if google_key_file:
+        return gc.create_google_geocoder(gc.get_api_key(google_key_file)), 'google'
+    return None, None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pysci.pipeline', description=Pipeline.__doc__.split('\n')[1].strip())
+    parser.add_argument('pdf_dir', help="directory of the pdfs")
+    parser.add_argument('--until', choices=STAGES, default='map', help="last stage to run")
+    parser.add_argument('--corpus', choices=sorted(METHODS_PATTERNS), default='orchards',
+                        help="which methods section regular expressions to use")
+    parser.add_argument('--corpus-name', default='corpus')
+    parser.add_argument('--par-range-text', type=int, default=4)
+    parser.add_argument('--par-range-xml', type=int, default=3)
+    parser.add_argument('--min-characters', type=int, default=100)
+    parser.add_argument('--cache-dir', default='pipeline_cache')
+    parser.add_argument('--results-dir', default='results')
+    parser.add_argument('--map-path', default=os.path.join('maps', 'result_map.html'))
+    parser.add_argument('--country-geojson', help="country outlines to draw on the map instead of tiles, e.g. "
+                                                  + COUNTRY_GEOJSON_URL)
+    parser.add_argument('--ner-model', help="Stanford NER model, e.g. english.all.3class.distsim.crf.ser.gz")
+    parser.add_argument('--ner-jar', help="path to stanford-ner.jar, if not on the CLASSPATH")
+    parser.add_argument('--prefilter', action='store_true',
+                        help="only tag the sentences which may contain a location (see geoparse.SentencePrefilter)")
+    parser.add_argument('--gazetteer-index', help="gazetteer index for offline geocoding (see gazetteer.py)")
+    parser.add_argument('--google-key-file', help="file with the googlemaps API key line")
+    parser.add_argument('--coordinates', choices=COORDINATE_MODES,
+                        help="place locations at the coordinates stated in their sentence, without geocoding "
+                             "them (skip) or if geocoding them agrees (check)")
+    parser.add_argument('--canonicalize', action='store_true',
+                        help="geocode each canonical form of the location strings once (see geocode.canonical_key)")
+    parser.add_argument('--results-store', help="also write the results to a typed results store in this directory, "
+                                                "for queries by article and bounding box (see results.py)")
+    parser.add_argument('--processes', type=int, help="processes converting pdfs")
+    parser.add_argument('--timeout', type=float, default=600, help="per-pdf conversion timeout in seconds")
+    parser.add_argument('--force', action='append', choices=STAGES, default=[],
+                        help="recompute a stage for all documents (can be repeated)")
+    parser.add_argument('--shards', type=int, default=1, help="number of shards the corpus is split into")
+    parser.add_argument('--shard', type=int, help="only process this shard (0 to shards - 1)")
+    parser.add_argument('--merge', action='store_true', help="merge the outputs of all the shards")
+    parser.add_argument('--local-shards', action='store_true',
+                        help="run all the shards as processes on this machine, then merge them")
+    parser.add_argument('--instrument', metavar='REPORT_JSON',
+                        help="time the stages and hot paths, and write the report to this file")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    if args.merge:
+        count = merge_shards(args.results_dir, args.shards, map_path=args.map_path,
+                             country_geojson=args.country_geojson, cache_dir=args.cache_dir)
+        print("Merged %s documents from %s shards into %s" % (count, args.shards, args.results_dir))
+        return
+    if args.local_shards:
+        shard_argv = [arg for arg in (sys.argv[1:] if argv is None else argv) if arg != '--local-shards']
+        exit_codes = run_local_shards(args.shards, shard_argv)
+        if any(exit_codes):
+            sys.exit("Shards failed, with exit codes %s" % exit_codes)
+        main(shard_argv + ['--merge'])
+        return
+    tagger = make_tagger(args.ner_model, args.ner_jar) if args.ner_model else None
+    prefilter = make_prefilter(args.gazetteer_index) if args.prefilter else None
+    geocoder, geocoder_name = make_geocoder(args.gazetteer_index, args.google_key_file)
+    pipeline = Pipeline(args.pdf_dir, cache_dir=args.cache_dir, results_dir=args.results_dir,
+                        map_path=args.map_path, corpus_name=args.corpus_name, corpus=args.corpus,
+                        par_range_text=args.par_range_text, par_range_xml=args.par_range_xml,
+                        min_characters=args.min_characters, tagger=tagger,
+                        tagger_name=args.ner_model, prefilter=prefilter, geocoder=geocoder,
+                        geocoder_name=geocoder_name, coordinates=args.coordinates, canonicalize=args.canonicalize,
+                        results_store=args.results_store, country_geojson=args.country_geojson,
+                        processes=args.processes, timeout=args.timeout, force=args.force, shard=args.shard,
+                        n_shards=args.shards, verbose=args.verbose)
+    if args.instrument:
+        instrument.enable()
+    pipeline.run(until=args.until)
+    pipeline.print_report()
+    if args.instrument:
+        report_path = args.instrument
+        if args.shard is not None:
+            # shards run side by side write a report each
+            report_path = '%s.shard%d%s' % (os.path.splitext(report_path)[0], args.shard,
+                                            os.path.splitext(report_path)[1])
+        recorder = instrument.disable()
+        recorder.save_report(report_path)
+        print(recorder.summary())
+
+if __name__ == '__main__':
+    main()
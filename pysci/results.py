@@ -0,0 +1,391 @@
+# Typed results store: articles and geocoded locations as columns, indexed by article and by grid cell for spatial queries
+import os
+import math
+import array
+import pickle
+import shutil
+import argparse
+
+from pysci import columnstore
+from pysci import geoparse as gp
+from pysci import geocode as gc
+
+ARTICLES_DIR = 'articles'
+LOCATIONS_DIR = 'locations'
+INDEX_FILE = 'index.pkl'
+# one row per document; lists are stored as lists, and None stands for the placeholder strings of the TSVs
+# (title_locations: no-xml or no-title, content locations: no-methods-found)
+ARTICLE_COLUMNS = ['filename', 'use_xml', 'has_xml', 'title', 'title_locations', 'methods_sections',
+                   'content_locations', 'content_locations_filtered', 'location_sentences',
+                   'first_location', 'n_locations']
+# one row per row of locations_geocoded.tsv: lat and lon are floats, or None if the location has no coordinates,
+# and status tells why (see LOCATION_STATUSES); article is the row of its document in the articles
+LOCATION_COLUMNS = ['article', 'filename', 'status', 'content_location', 'clean_content_loc', 'geocode_str',
+                    'geocode_type', 'lat', 'lon', 'use_xml', 'location_sentence']
+GEOCODED_STATUS = 'geocoded'
+LOCATION_STATUSES = (GEOCODED_STATUS, gc.NO_RESULT_STRING, gp.NO_LOCATIONS_STRING, gp.NO_METHODS_STRING)
+# the sentence of a location not found in any of its document's location sentences
+NO_SENTENCE_STRING = 'no exact sentence match'
+# width in degrees of the cells of the spatial index: about 110 km, so a query for a region reads few others
+GRID_CELL_DEGREES = 1.0
+
+### RECORDS ###
+
+def article_record(scidoc):
+    """
+    The typed row of a located ScienceDoc (see ARTICLE_COLUMNS), without its location range.
+    """
+    title_locations = scidoc.title_locations
+    if title_locations in (gp.NO_XML_STRING, gp.NO_TITLE_STRING):
+        title_locations = None
+    content = [None if locations == gp.NO_METHODS_STRING else list(locations or [])
+               for locations in (scidoc.content_locations, scidoc.content_locations_filtered)]
+    return {'filename': scidoc.file_name, 'use_xml': scidoc.use_xml, 'has_xml': scidoc.has_xml,
+            'title': getattr(scidoc, 'title', None), 'title_locations': title_locations,
+            'methods_sections': getattr(scidoc, 'methods_sections', None), 'content_locations': content[0],
+            'content_locations_filtered': content[1], 'location_sentences': list(scidoc.location_sentences or [])}
+
+def location_record(row):
+    """
+    The typed row (see LOCATION_COLUMNS) of a row of locations_geocoded.tsv, as from pipeline.geocoded_rows.
+    """
+    filename, location, clean_text, geocode_str, geocode_type, lat, lon, use_xml, sentence = row
+    record = {'filename': filename, 'status': GEOCODED_STATUS, 'content_location': location,
+              'clean_content_loc': clean_text, 'geocode_str': geocode_str, 'geocode_type': geocode_type,
+              'lat': None, 'lon': None, 'use_xml': use_xml,
+              'location_sentence': None if sentence == NO_SENTENCE_STRING else sentence}
+    if location in (gp.NO_LOCATIONS_STRING, gp.NO_METHODS_STRING):
+        record.update(status=location, content_location=None, clean_content_loc=None, geocode_str=None,
+                      geocode_type=None, location_sentence=None)
+    elif geocode_str == gc.NO_RESULT_STRING:
+        record.update(status=gc.NO_RESULT_STRING, geocode_str=None, geocode_type=None)
+    else:
+        record.update(lat=float(lat), lon=float(lon))
+    return record
+
+def article_row(record):
+    """
+    The row of articles_geoparsed.tsv of a typed article row, as pipeline.articles_table writes it.
+    """
+    def joined(locations):
+        return gp.NO_METHODS_STRING if locations is None else '; '.join(locations)
+
+    title_locations = record['title_locations']
+    if title_locations is None:
+        title_locations = gp.NO_TITLE_STRING if record['has_xml'] else gp.NO_XML_STRING
+    else:
+        title_locations = '; '.join(title_locations)
+    methods_sections = record['methods_sections']
+    return (record['filename'], record['use_xml'],
+            gp.NO_TITLE_STRING if record['title'] is None else record['title'], title_locations,
+            '' if methods_sections is None else methods_sections, joined(record['content_locations']),
+            joined(record['content_locations_filtered']), record['location_sentences'] or '')
+
+def geocoded_row(record):
+    """
+    The row of locations_geocoded.tsv of a typed location row, with the placeholder strings back.
+    """
+    status = record['status']
+    if status in (gp.NO_LOCATIONS_STRING, gp.NO_METHODS_STRING):
+        return (record['filename'],) + (status,) * 6 + (record['use_xml'], status)
+    if status == gc.NO_RESULT_STRING:
+        found = (gc.NO_RESULT_STRING,) * 4
+    else:
+        found = (record['geocode_str'], record['geocode_type'], record['lat'], record['lon'])
+    sentence = record['location_sentence']
+    return ((record['filename'], record['content_location'], record['clean_content_loc']) + found +
+            (record['use_xml'], NO_SENTENCE_STRING if sentence is None else sentence))
+
+### INDEXES ###
+
+def grid_cell(lat, lon, cell=GRID_CELL_DEGREES):
+    return math.floor(lat / cell), math.floor(lon / cell)
+
+class ResultsIndex:
+    """
+    The indexes of a results store: article rows by file name, and the rows of the located locations
+    by grid cell. They are a cache of the columns, saved when a writer closes: an index behind the
+    store (e.g. after a writer was killed) is brought up to date from the rows added since.
+    """
+    def __init__(self, cell=GRID_CELL_DEGREES):
+        self.cell = cell
+        self.n_articles = 0
+        self.by_filename = {}
+        self.grid = {}
+
+    def add_article(self, article, filename, locations):
+        """
+        :param article: row of the article
+        :param locations: (row, lat, lon) of each of its locations
+        """
+        self.by_filename.setdefault(filename, []).append(article)
+        for row, lat, lon in locations:
+            if lat is not None and lon is not None:
+                self.grid.setdefault(grid_cell(lat, lon, self.cell), array.array('Q')).append(row)
+        self.n_articles = article + 1
+
+    def update(self, articles, locations):
+        """
+        Indexes the rows of the stores which aren't yet: only the locations in the range of an
+        article, so rows written by a writer killed before their article are left out.
+        :param articles: ColumnStore of the articles
+        :param locations: ColumnStore of the locations
+        :return: number of articles indexed
+        """
+        start = self.n_articles
+        for article in range(start, len(articles)):
+            first, n = articles.get(article, 'first_location'), articles.get(article, 'n_locations')
+            self.add_article(article, articles.get(article, 'filename'),
+                             [(row, locations.get(row, 'lat'), locations.get(row, 'lon'))
+                              for row in range(first, first + n)])
+        return self.n_articles - start
+
+    @classmethod
+    def load(cls, path, cell=GRID_CELL_DEGREES):
+        """
+        Reads the index saved in a store, or returns an empty one if there is none or its cells
+        have another size.
+        """
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.isfile(index_path):
+            with open(index_path, 'rb') as f:
+                index = pickle.load(f)
+            if index.cell == cell:
+                return index
+        return cls(cell)
+
+    def save(self, path):
+        # written aside and renamed, so readers never see half an index
+        index_path = os.path.join(path, INDEX_FILE)
+        with open(index_path + '.tmp', 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(index_path + '.tmp', index_path)
+
+    def cells_in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        The non-empty cells overlapping a bounding box; a box with min_lon > max_lon crosses the antimeridian.
+        """
+        rows = range(math.floor(min_lat / self.cell), math.floor(max_lat / self.cell) + 1)
+        lon_ranges = [(min_lon, max_lon)] if min_lon <= max_lon else [(min_lon, 180.0), (-180.0, max_lon)]
+        cols = [col for low, high in lon_ranges
+                for col in range(math.floor(low / self.cell), math.floor(high / self.cell) + 1)]
+        if len(rows) * len(cols) > len(self.grid):
+            # a big box: going through the non-empty cells is quicker
+            return [cell for cell in self.grid if cell[0] in rows and cell[1] in cols]
+        return [(row, col) for row in rows for col in cols if (row, col) in self.grid]
+
+### WRITING ###
+
+class ResultsWriter:
+    """
+    Appends the results of documents to a results store, a directory with a column store of the
+    articles, one of their geocoded locations, and their indexes (see ResultsIndex). Each document
+    is readable as soon as it is flushed, without rewriting what is already there.
+    Example use:
+        with ResultsWriter('results/store') as writer:
+            for scidoc, geocoded in documents:
+                writer.append(scidoc, pipeline.geocoded_rows(scidoc, geocoded))
+    """
+    def __init__(self, path, cell=GRID_CELL_DEGREES, overwrite=False):
+        """
+        :param path: directory of the store, appended to if it exists
+        :param cell: width in degrees of the cells of the spatial index
+        :param overwrite: start a new store, removing the one at path
+        """
+        if overwrite and os.path.isdir(path):
+            shutil.rmtree(path)
+        self.path = path
+        self.articles = columnstore.ColumnWriter(os.path.join(path, ARTICLES_DIR), ARTICLE_COLUMNS)
+        self.locations = columnstore.ColumnWriter(os.path.join(path, LOCATIONS_DIR), LOCATION_COLUMNS)
+        # the rows already there, once the writers have dropped any half-written one
+        with columnstore.ColumnStore(self.articles.path) as articles, \
+                columnstore.ColumnStore(self.locations.path) as locations:
+            self.index = ResultsIndex.load(path, cell)
+            if self.index.n_articles > len(articles):
+                self.index = ResultsIndex(cell)
+            self.index.update(articles, locations)
+            self.n_articles = len(articles)
+            self.n_locations = len(locations)
+
+    def append(self, scidoc, rows):
+        """
+        Appends a document and its locations.
+        :param scidoc: the located ScienceDoc
+        :param rows: its rows of locations_geocoded.tsv, from pipeline.geocoded_rows
+        """
+        first = self.n_locations
+        records = [location_record(row) for row in rows]
+        # locations before their article: the article's range only refers to rows fully written
+        for record in records:
+            record['article'] = self.n_articles
+            self.locations.append(record)
+        self.n_locations += len(records)
+        record = article_record(scidoc)
+        record.update(first_location=first, n_locations=len(records))
+        self.articles.append(record)
+        self.index.add_article(self.n_articles, scidoc.file_name,
+                               [(row, location['lat'], location['lon']) for row, location in enumerate(records, first)])
+        self.n_articles += 1
+
+    def flush(self):
+        self.locations.flush()
+        self.articles.flush()
+
+    def close(self):
+        self.locations.close()
+        self.articles.close()
+        self.index.save(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def write_results_store(path, scidocs, geocoded_rows, cell=GRID_CELL_DEGREES):
+    """
+    Writes a new results store (replacing any at path) for documents and their rows of locations_geocoded.tsv.
+    :param geocoded_rows: list of the rows of each document, from pipeline.geocoded_rows
+    :return: number of documents written
+    """
+    with ResultsWriter(path, cell=cell, overwrite=True) as writer:
+        for scidoc, rows in zip(scidocs, geocoded_rows):
+            writer.append(scidoc, rows)
+        return writer.n_articles
+
+### READING ###
+
+class ResultsStore:
+    """
+    A results store opened for reading. Queries read only the rows they return, plus the
+    coordinates of the locations in the grid cells of a bounding box:
+        store = ResultsStore('results/store')
+        store.article_locations('Liu_et_al-2015')  # all locations of an article
+        store.articles_in_bbox(45.8, 5.9, 47.8, 10.5)  # articles with locations in Switzerland
+        store.export_tsv('results')  # the results TSVs, as the pipeline writes them
+    """
+    def __init__(self, path, cell=GRID_CELL_DEGREES):
+        self.path = path
+        self.articles = columnstore.ColumnStore(os.path.join(path, ARTICLES_DIR))
+        self.locations = columnstore.ColumnStore(os.path.join(path, LOCATIONS_DIR))
+        self.index = ResultsIndex.load(path, cell)
+        if self.index.n_articles > len(self.articles):
+            self.index = ResultsIndex(cell)
+        self.index.update(self.articles, self.locations)
+
+    def __len__(self):
+        return len(self.articles)
+
+    def article_rows(self, filename):
+        """
+        Rows of the articles with a file name (one, unless a document was appended twice).
+        """
+        return self.index.by_filename.get(filename, [])
+
+    def article(self, i, columns=None):
+        """
+        Returns the typed row of article i as a dict (see ARTICLE_COLUMNS).
+        """
+        return self.articles.row(i, columns)
+
+    def location_rows(self, i):
+        """
+        Rows of the locations of article i.
+        """
+        first = self.articles.get(i, 'first_location')
+        return range(first, first + self.articles.get(i, 'n_locations'))
+
+    def location(self, row, columns=None):
+        """
+        Returns a typed location row as a dict (see LOCATION_COLUMNS).
+        """
+        return self.locations.row(row, columns)
+
+    def article_locations(self, filename, columns=None):
+        """
+        All the locations of the article(s) with a file name, as dicts.
+        """
+        return [self.location(row, columns) for i in self.article_rows(filename) for row in self.location_rows(i)]
+
+    def location_rows_in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Rows of the located locations in a bounding box, in the order they were written. A box
+        with min_lon > max_lon crosses the antimeridian.
+        """
+        lat, lon = self.locations.column('lat'), self.locations.column('lon')
+        if min_lon <= max_lon:
+            in_lon = lambda value: min_lon <= value <= max_lon
+        else:
+            in_lon = lambda value: value >= min_lon or value <= max_lon
+        rows = [row for cell in self.index.cells_in_bbox(min_lat, min_lon, max_lat, max_lon)
+                for row in self.index.grid[cell] if min_lat <= lat[row] <= max_lat and in_lon(lon[row])]
+        return sorted(rows)
+
+    def locations_in_bbox(self, min_lat, min_lon, max_lat, max_lon, columns=None):
+        """
+        The located locations in a bounding box, as dicts.
+        """
+        return [self.location(row, columns) for row in self.location_rows_in_bbox(min_lat, min_lon, max_lat, max_lon)]
+
+    def articles_in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        File names of the articles with any location in a bounding box, in the order they were written.
+        """
+        article = self.locations.column('article')
+        articles = sorted(set(article[row] for row in self.location_rows_in_bbox(min_lat, min_lon, max_lat, max_lon)))
+        return [self.articles.get(i, 'filename') for i in articles]
+
+    def export_tsv(self, results_dir):
+        """
+        Writes the results TSVs (articles_geoparsed.tsv, locations.tsv and locations_geocoded.tsv)
+        of the store to results_dir, the same as the pipeline writes them for the same documents.
+        """
+        # the layouts are the pipeline's, which imports this module
+        import pandas as pd
+        from pysci import pipeline as pl
+        geocoded = [geocoded_row(record) for record in
+                    (self.location(row) for i in range(len(self)) for row in self.location_rows(i))]
+        locations = [(row[0], row[1], row[7], row[8]) for row in geocoded]
+        articles = [article_row(self.article(i)) for i in range(len(self))]
+        os.makedirs(results_dir, exist_ok=True)
+        pl.write_tsv(pd.DataFrame(articles, columns=pl.ARTICLES_COLUMNS),
+                     os.path.join(results_dir, 'articles_geoparsed.tsv'))
+        pl.write_tsv(pd.DataFrame(locations, columns=pl.LOCATIONS_COLUMNS), os.path.join(results_dir, 'locations.tsv'))
+        pl.write_tsv(pd.DataFrame(geocoded, columns=pl.GEOCODED_COLUMNS),
+                     os.path.join(results_dir, 'locations_geocoded.tsv'))
+        return len(articles)
+
+    def close(self):
+        self.articles.close()
+        self.locations.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+### COMMAND LINE ###
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pysci.results',
+                                     description="Queries a results store, or exports it to the results TSVs.")
+    parser.add_argument('store', help="directory of the results store")
+    parser.add_argument('--article', action='append', default=[], help="print the locations of this file name")
+    parser.add_argument('--bbox', nargs=4, type=float, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'),
+                        help="print the articles with locations in this bounding box")
+    parser.add_argument('--export-tsv', metavar='RESULTS_DIR', help="write the results TSVs to this directory")
+    args = parser.parse_args(argv)
+    with ResultsStore(args.store) as store:
+        for filename in args.article:
+            for location in store.article_locations(filename):
+                print('\t'.join(str(location[column]) for column in ('content_location', 'status', 'lat', 'lon')))
+        if args.bbox:
+            for filename in store.articles_in_bbox(*args.bbox):
+                print(filename)
+        if args.export_tsv:
+            count = store.export_tsv(args.export_tsv)
+            print("Exported %s articles to %s" % (count, args.export_tsv))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,557 @@
+# Streaming pipeline: each document goes from pdf to geocoded locations through stages joined by bounded queues
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+import concurrent.futures
+import pandas as pd
+
+from pysci import docutils as du
+from pysci import convertpdf as pdf
+from pysci import geoparse as gp
+from pysci import geocode as gc
+from pysci import pipeline as pl
+from pysci import results
+from pysci import instrument
+
+STREAM_STAGES = ('convert', 'extract', 'locate', 'geocode')
+# end of the stream, passed down the queues after the last document
+_END = object()
+# seconds the geocoding stage waits for a new document while it has queries in flight
+GEOCODE_POLL = 0.05
+
+class StreamDoc:
+    """
+    One pdf going through the streaming pipeline, with what each stage made of it.
+    """
+    def __init__(self, index, pdf_filepath, corpus_name):
+        self.index = index
+        self.pdf_filepath = pdf_filepath
+        self.txt_filepath = pdf.txt_filepath_for(pdf_filepath)
+        self.xml_filepath = du.remove_extension(pdf_filepath) + du.XML_extension
+        self.file_name = du.remove_extension(os.path.basename(pdf_filepath))
+        self.scidoc = du.ScienceDoc(corpus_name=corpus_name, file_name=self.file_name)
+        self.text = None
+        self.geocoded = None
+        # (stage, error) if a stage failed on the document; the later stages then pass it on untouched
+        self.error = None
+
+class StreamingPipeline:
+    """
+    Runs the convert, extract, locate and geocode stages of Pipeline as a stream: each stage
+    works on a document as soon as the stage before it is done with it, so conversion, NER and
+    geocoding all run at the same time, and the results TSVs grow as documents come out of the
+    last stage. The stages are joined by bounded queues, so a slow stage holds up the ones
+    before it rather than letting documents pile up in memory. Each stage has its own
+    concurrency: pdfs are converted in worker processes (as convertpdf.convert_pdfs does, with
+    its timeout), extraction runs in a process pool, NER in a few threads each tagging a batch
+    of documents in one tagger call (the Stanford tagger runs in its own Java process), and
+    geocoding sends the queries of many documents at once from a thread pool, within a rate limit.
+    Unlike Pipeline, nothing is cached per stage, apart from the geocode cache and the txt files
+    of pdfs converted before.
+    Example use:
+        stream = StreamingPipeline('pdfs', tagger=tagger, geocoder=gazetteer.GazetteerGeocoder('geonames.sqlite'))
+        stream.run()
+        stream.print_report()
+    """
+    def __init__(self, pdf_dir, results_dir='results', map_path=None, basemap=None, corpus_name='corpus',
+                 corpus='orchards', par_range_text=4, par_range_xml=3, max_words_in_heading=8, min_characters=100,
+                 tagger=None, prefilter=None, geocoder=None, geocode_cache=None, coordinates=None, canonicalize=False,
+                 results_store=None, convert_workers=2, timeout=600,
+                 extract_processes=2, ner_workers=1, ner_batch_docs=20, ner_batch_wait=1.0, geocode_workers=8,
+                 rate=10.0, burst=1, max_retries=5, queue_size=8, ordered=True, max_held=32, verbose=False):
+        """
+        :param pdf_dir: directory of the pdfs (and of their txt and .cermxml files)
+        :param results_dir: where to write the results TSVs
+        :param map_path: where to write the map once all documents are done, None for no map
+        :param basemap: outlines for the map (see mapping.write_map)
+        :param corpus: key of pipeline.METHODS_PATTERNS choosing the methods regular expressions
+        :param tagger: NER tagger with a tag_sents method, only needed if some documents need locating
+        :param prefilter: optional geoparse.SentencePrefilter, only the sentences it keeps are tagged
+        :param geocoder: geocoder (googlemaps.Client, gazetteer.GazetteerGeocoder), only needed if some
+        locations need geocoding
+        :param geocode_cache: dict, default a SqliteGeocodeCache in results_dir (the cache is only
+        used from the geocoding stage's thread, which opens the SqliteGeocodeCache itself)
+        :param coordinates: None, or what to do with locations whose sentence states coordinates (see
+        pipeline.COORDINATE_MODES)
+        :param canonicalize: geocode each canonical form of the location strings once (see
+        geocode.canonical_key), the first variant seen being sent for all of them
+        :param results_store: if given, also append each document's results to a new results store in
+        this directory (see results.ResultsWriter), readable while the pipeline runs
+        :param convert_workers: pdfs converted at once, each in its own process
+        :param timeout: per-pdf conversion timeout in seconds
+        :param extract_processes: processes extracting the methods sections, 0 to extract in the
+        stage's thread
+        :param ner_workers: threads running the tagger, each on its own batch of documents
+        :param ner_batch_docs: most documents tagged in one tagger call
+        :param ner_batch_wait: seconds a NER worker waits for more documents to fill a batch
+        :param geocode_workers: geocoding queries in flight at once
+        :param rate: maximum geocoding queries per second
+        :param burst: number of queries which may be sent at once after a quiet spell
+        :param max_retries: retries per query for retriable errors
+        :param queue_size: documents waiting between two stages before the earlier one has to wait
+        :param ordered: write the documents in the order of their pdfs, rather than as they are done
+        :param max_held: if ordered, most documents let into the stream ahead of the next one to write,
+        so a slow document holds up the stream rather than letting the writer hold back ever more
+        :param verbose: print a line per document written
+        """
+        self.pdf_dir = pdf_dir
+        self.results_dir = results_dir
+        self.map_path = map_path
+        self.basemap = basemap
+        self.corpus_name = corpus_name
+        re_text, re_headings = pl.METHODS_PATTERNS[corpus]
+        self.extract_params = {'re_text': re_text, 're_headings': re_headings, 'par_range_text': par_range_text,
+                               'par_range_xml': par_range_xml, 'max_words_in_heading': max_words_in_heading,
+                               'min_characters': min_characters}
+        self.tagger = tagger
+        self.prefilter = prefilter
+        self.geocoder = geocoder
+        self.geocode_cache = geocode_cache
+        if coordinates is not None and coordinates not in pl.COORDINATE_MODES:
+            raise ValueError("coordinates must be one of %s, not %r" % (pl.COORDINATE_MODES, coordinates))
+        self.coordinates = coordinates
+        self.canonicalize = canonicalize
+        self.results_store = results_store
+        self.convert_workers = convert_workers
+        self.timeout = timeout
+        self.extract_processes = extract_processes
+        self.ner_workers = ner_workers
+        self.ner_batch_docs = ner_batch_docs
+        self.ner_batch_wait = ner_batch_wait
+        self.geocode_workers = geocode_workers
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.queue_size = queue_size
+        self.ordered = ordered
+        if max_held < 1:
+            raise ValueError("max_held must be at least 1, not %r" % max_held)
+        self.max_held = max_held
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.report = {}
+        self.errors = []
+
+    ### STAGES ###
+
+    def _convert(self, docs):
+        for doc in docs:
+            # a txt file at least as recent as its pdf was converted from this version of it
+            if not (os.path.isfile(doc.txt_filepath) and
+                    os.path.getmtime(doc.txt_filepath) >= os.path.getmtime(doc.pdf_filepath)):
+                pdf.convert_pdfs([doc.pdf_filepath], processes=1, timeout=self.timeout, skip_existing=False)
+            if os.path.isfile(doc.txt_filepath):
+                with open(doc.txt_filepath, 'r', encoding='utf-8') as f:
+                    doc.text = f.read()
+
+    def _extract(self, docs):
+        for doc in docs:
+            if self.extract_pool is not None:
+                # what the worker process recorded is merged into this process's report
+                fields, recorded = self.extract_pool.submit(instrument.call_recorded, instrument.enabled(),
+                                                            doc.file_name, pl.extract_fields, doc.text,
+                                                            doc.xml_filepath, self.extract_params).result()
+                instrument.merge(recorded)
+            else:
+                with instrument.document(doc.file_name):
+                    fields = pl.extract_fields(doc.text, doc.xml_filepath, self.extract_params)
+            for field, value in fields.items():
+                setattr(doc.scidoc, field, value)
+            # the text is in the ScienceDoc now
+            doc.text = None
+
+    def _locate(self, docs):
+        if self.tagger is None and any(getattr(doc.scidoc, 'relevant_text', '') for doc in docs):
+            raise ValueError("%s documents need locating, but the pipeline has no NER tagger" % len(docs))
+        gp.locate_in_documents([doc.scidoc for doc in docs], self.tagger, batch_size=sys.maxsize,
+                               prefilter=self.prefilter)
+        # a document the tagger failed on doesn't fail the rest of its batch
+        for doc in docs:
+            if doc.scidoc.locate_error is not None:
+                doc.error = ('locate', doc.scidoc.locate_error)
+
+    def _run_stage(self, stage, func, docs):
+        """
+        Runs a stage function on the documents which no stage failed on yet, timing it.
+        """
+        docs = [doc for doc in docs if doc.error is None]
+        if not docs:
+            return
+        start = time.time()
+        try:
+            with instrument.timer('streaming.' + stage):
+                func(docs)
+        except Exception as e:
+            for doc in docs:
+                doc.error = (stage, repr(e))
+        with self.lock:
+            report = self.report.setdefault(stage, {'documents': 0, 'calls': 0, 'busy_seconds': 0.0})
+            report['documents'] += len(docs)
+            report['calls'] += 1
+            report['busy_seconds'] += time.time() - start
+
+    def _take(self, in_queue, max_docs, wait):
+        """
+        Takes the next document off a queue, then up to max_docs - 1 more which arrive within
+        'wait' seconds.
+        :return: (list of documents, whether the end of the stream was reached)
+        """
+        doc = in_queue.get()
+        if doc is _END:
+            return [], True
+        docs = [doc]
+        deadline = time.time() + wait
+        while len(docs) < max_docs:
+            try:
+                doc = in_queue.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if doc is _END:
+                return docs, True
+            docs.append(doc)
+        return docs, False
+
+    def _start_stage(self, stage, func, n_workers, in_queue, out_queue, max_docs=1, wait=0.0):
+        """
+        Starts the worker threads of a stage. Each takes documents off in_queue (max_docs at a time),
+        runs func on them and puts them on out_queue; the last one to see the end of the stream
+        passes it on.
+        """
+        remaining = [n_workers]
+
+        def work():
+            while True:
+                docs, ended = self._take(in_queue, max_docs, wait)
+                self._run_stage(stage, func, docs)
+                for doc in docs:
+                    out_queue.put(doc)
+                if ended:
+                    # for the other workers of the stage
+                    in_queue.put(_END)
+                    with self.lock:
+                        remaining[0] -= 1
+                        last = not remaining[0]
+                    if last:
+                        out_queue.put(_END)
+                    return
+
+        threads = [threading.Thread(target=work, name='%s-%d' % (stage, i), daemon=True) for i in range(n_workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _geocode_stage(self, in_queue, out_queue):
+        self.geocode_held = {}  # index: document taken off in_queue and not passed on yet
+        self.geocode_ended = False
+        try:
+            self._geocode(in_queue, out_queue)
+        except Exception as e:
+            # run() raises it once the writer is done; meanwhile every document not written yet
+            # is passed on as failed, so none goes missing and the stages before don't block
+            self.geocode_error = e
+            for doc in self.geocode_held.values():
+                doc.error = ('geocode', repr(e))
+                out_queue.put(doc)
+            while not self.geocode_ended:
+                doc = in_queue.get()
+                if doc is _END:
+                    break
+                if doc.error is None:
+                    doc.error = ('geocode', repr(e))
+                out_queue.put(doc)
+        finally:
+            # even if geocoding broke down, so the writer doesn't wait forever
+            out_queue.put(_END)
+
+    def _geocode(self, in_queue, out_queue):
+        """
+        Geocodes the documents as they come: queries not in the cache are sent to a thread pool
+        straight away (once, however many documents are waiting for them), and each document is
+        passed on as soon as all of its queries are answered, whatever the order. The cache is
+        only used from this thread.
+        """
+        cache = self.geocode_cache
+        if cache is None:
+            os.makedirs(self.results_dir, exist_ok=True)
+            cache = gc.SqliteGeocodeCache(os.path.join(self.results_dir, 'geocode_cache.sqlite'))
+        rate_limiter = gc.TokenBucket(self.rate, self.burst)
+        index = gc.CanonicalIndex() if self.canonicalize else None
+        sent_as = {}  # canonical key: the variant geocoded for all of them
+        in_flight = {}  # query: future, until its result is in the cache
+        waiting = []  # (document, locations, queries, points, {query: cached result or future})
+        ended = False
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.geocode_workers) as geocode_pool:
+            while not ended or waiting:
+                if not ended and len(waiting) < self.queue_size:
+                    try:
+                        doc = in_queue.get(timeout=GEOCODE_POLL if waiting else None)
+                    except queue.Empty:
+                        doc = None
+                    if doc is _END:
+                        ended = self.geocode_ended = True
+                    elif doc is not None and doc.error is not None:
+                        out_queue.put(doc)
+                    elif doc is not None:
+                        self.geocode_held[doc.index] = doc
+                        start = time.time()
+                        table = pl.locations_table([doc.scidoc])
+                        locations = list(table.content_locations)
+                        queries = pl.location_queries(locations)
+                        if self.coordinates:
+                            points = pl.location_points(locations, list(table.location_sentences))
+                        else:
+                            points = [None] * len(locations)
+                        answers = {}
+                        for query in pl.geocode_queries(queries, points, self.coordinates):
+                            if query in answers:
+                                continue
+                            # the variant actually looked up, the same for all the variants of a canonical form
+                            lookup = query
+                            if index is not None:
+                                key = index.add(query)
+                                if key not in sent_as:
+                                    sent_as[key] = index.representative(key, cache)
+                                lookup = sent_as[key]
+                            if lookup in in_flight:
+                                answers[query] = in_flight[lookup]
+                                continue
+                            cached = cache.get(lookup, gc._MISSING)
+                            if cached is gc._MISSING:
+                                if self.geocoder is None:
+                                    doc.error = ('geocode', "locations need geocoding, but the pipeline has no geocoder")
+                                    break
+                                answers[query] = in_flight[lookup] = geocode_pool.submit(
+                                    gc.geocode_with_retry, lookup, self.geocoder, rate_limiter, self.max_retries)
+                                instrument.count('geocode.cache_misses')
+                            else:
+                                answers[query] = [] if cached == gc.NO_RESULT_STRING else cached
+                                instrument.count('geocode.cache_hits')
+                        if doc.error is not None:
+                            del self.geocode_held[doc.index]
+                            out_queue.put(doc)
+                        else:
+                            waiting.append((doc, locations, queries, points, answers))
+                        self._add_busy('geocode', time.time() - start)
+                elif in_flight:
+                    concurrent.futures.wait(list(in_flight.values()), timeout=GEOCODE_POLL,
+                                            return_when=concurrent.futures.FIRST_COMPLETED)
+                # answered queries go into the cache (failed ones don't, so they are tried again next time)
+                for query, future in list(in_flight.items()):
+                    if future.done():
+                        del in_flight[query]
+                        if future.exception() is None:
+                            top_result = future.result()
+                            cache[query] = top_result if top_result else gc.NO_RESULT_STRING
+                        else:
+                            instrument.count('geocode.failures')
+                still_waiting = []
+                for doc, locations, queries, points, answers in waiting:
+                    futures = [answer for answer in answers.values() if isinstance(answer, concurrent.futures.Future)]
+                    if any(not future.done() for future in futures):
+                        still_waiting.append((doc, locations, queries, points, answers))
+                        continue
+                    geocoded_results = {}
+                    for query, answer in answers.items():
+                        if isinstance(answer, concurrent.futures.Future):
+                            answer = answer.result() if answer.exception() is None else []
+                        geocoded_results[query] = answer
+                    doc.geocoded = [pl.geocoded_location(location, query, geocoded_results.get(query), point)
+                                    for location, query, point in zip(locations, queries, points)]
+                    del self.geocode_held[doc.index]
+                    out_queue.put(doc)
+                waiting = still_waiting
+        if index is not None:
+            with self.lock:
+                self.report['canonical'] = index.report()
+        if self.geocode_cache is None:
+            cache.close()
+
+    def _add_busy(self, stage, seconds):
+        with self.lock:
+            report = self.report.setdefault(stage, {'documents': 0, 'calls': 0, 'busy_seconds': 0.0})
+            report['documents'] += 1
+            report['calls'] += 1
+            report['busy_seconds'] += seconds
+
+    ### OUTPUT ###
+
+    def _write(self, in_queue):
+        """
+        Appends the rows of each finished document to the results TSVs (and results store), in the order
+        of the pdfs if the pipeline is ordered (holding back documents which finish early), else as they come.
+        :return: number of documents written (not counting the failed ones)
+        """
+        os.makedirs(self.results_dir, exist_ok=True)
+        names = ('articles_geoparsed.tsv', 'locations.tsv', 'locations_geocoded.tsv')
+        files = [open(os.path.join(self.results_dir, name), 'w', encoding='utf-8', newline='') for name in names]
+        store = results.ResultsWriter(self.results_store, overwrite=True) if self.results_store else None
+        held = {}
+        next_index = 0
+        written = 0
+        try:
+            while True:
+                doc = in_queue.get()
+                if doc is _END:
+                    break
+                if not self.ordered:
+                    written += self._write_doc(doc, files, written == 0, store)
+                    continue
+                held[doc.index] = doc
+                while next_index in held:
+                    written += self._write_doc(held.pop(next_index), files, written == 0, store)
+                    next_index += 1
+                    # lets the next document into the stream
+                    self.admitted.release()
+        finally:
+            for f in files:
+                f.close()
+            if store is not None:
+                store.close()
+        return written
+
+    def _write_doc(self, doc, files, header, store=None):
+        """
+        Appends the rows of a document to the results TSVs, with the header rows if 'header'.
+        :return: whether the document's rows were written, False if a stage failed on it
+        """
+        if self.report.get('first_result_seconds') is None:
+            self.report['first_result_seconds'] = time.time() - self.start
+        if doc.error is not None:
+            self.errors.append((doc.file_name,) + doc.error)
+            if self.verbose:
+                print("%s failed in %s: %s" % ((doc.file_name,) + doc.error))
+            return False
+        rows = pl.geocoded_rows(doc.scidoc, doc.geocoded)
+        tables = (pl.articles_table([doc.scidoc]), pl.locations_table([doc.scidoc]),
+                  pd.DataFrame(rows, columns=pl.GEOCODED_COLUMNS))
+        for table, f in zip(tables, files):
+            # same format as write_tsv, one document at a time
+            table.to_csv(f, sep='\t', index=False, quotechar='"', header=header)
+            f.flush()
+        if store is not None:
+            store.append(doc.scidoc, rows)
+            store.flush()
+        if self.verbose:
+            print("%s: %s locations (%0.1fs)" % (doc.file_name, len(doc.geocoded), time.time() - self.start))
+        return True
+
+    ### RUNNING ###
+
+    def run(self):
+        """
+        Streams all the pdfs in pdf_dir through the stages, writes the results TSVs (and the map,
+        if there is a map_path), and returns the number of documents written.
+        """
+        self.start = time.time()
+        self.report = {}
+        self.errors = []
+        pdf_filepaths = pdf.find_pdf_files(self.pdf_dir)
+        # into convert, extract, locate, geocode, and the writer
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(STREAM_STAGES) + 1)]
+        self.geocode_error = None
+        # released by the writer as it writes each document in order
+        self.admitted = threading.Semaphore(self.max_held)
+        self.extract_pool = (concurrent.futures.ProcessPoolExecutor(self.extract_processes)
+                             if self.extract_processes else None)
+        try:
+            self._start_stage('convert', self._convert, self.convert_workers, queues[0], queues[1])
+            self._start_stage('extract', self._extract, max(1, self.extract_processes), queues[1], queues[2])
+            self._start_stage('locate', self._locate, self.ner_workers, queues[2], queues[3],
+                              max_docs=self.ner_batch_docs, wait=self.ner_batch_wait)
+            threading.Thread(target=self._geocode_stage, args=(queues[3], queues[4]), name='geocode',
+                             daemon=True).start()
+
+            def feed():
+                # blocks while the convert stage is behind
+                for i, pdf_filepath in enumerate(pdf_filepaths):
+                    if self.ordered:
+                        self.admitted.acquire()
+                    queues[0].put(StreamDoc(i, pdf_filepath, self.corpus_name))
+                queues[0].put(_END)
+
+            threading.Thread(target=feed, name='feed', daemon=True).start()
+            written = self._write(queues[-1])
+        finally:
+            if self.extract_pool is not None:
+                self.extract_pool.shutdown()
+        self.report['documents'] = written
+        self.report['wall_seconds'] = time.time() - self.start
+        if self.geocode_error is not None:
+            # the failed documents are in self.errors, and the TSVs have the others
+            raise self.geocode_error
+        if self.map_path:
+            geocoded_path = os.path.join(self.results_dir, 'locations_geocoded.tsv')
+            # folium is only imported when a map is drawn
+            from pysci import mapping
+            mapping.write_map(mapping.read_geocoded(geocoded_path), self.map_path, basemap=self.basemap)
+        return written
+
+    def print_report(self, out=sys.stdout):
+        for stage in STREAM_STAGES:
+            if stage in self.report:
+                report = self.report[stage]
+                out.write("%-8s %6d documents %6d calls %10.1fs busy\n"
+                          % (stage, report['documents'], report['calls'], report['busy_seconds']))
+        if self.report.get('first_result_seconds') is not None:
+            out.write("first result after %0.1fs\n" % self.report['first_result_seconds'])
+        if 'canonical' in self.report:
+            out.write(pl.canonical_summary(self.report['canonical']) + '\n')
+        out.write("%s documents in %0.1fs\n" % (self.report.get('documents', 0), self.report.get('wall_seconds', 0.0)))
+        for file_name, stage, error in self.errors:
+            out.write("%s failed in %s: %s\n" % (file_name, stage, error))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pysci.streaming', description=StreamingPipeline.__doc__.split('\n')[1].strip())
+    parser.add_argument('pdf_dir', help="directory of the pdfs")
+    parser.add_argument('--corpus', choices=sorted(pl.METHODS_PATTERNS), default='orchards',
+                        help="which methods section regular expressions to use")
+    parser.add_argument('--corpus-name', default='corpus')
+    parser.add_argument('--results-dir', default='results')
+    parser.add_argument('--map-path', help="map to write once all documents are done")
+    parser.add_argument('--basemap', help="local GeoJSON file of outlines to draw on the map instead of tiles")
+    parser.add_argument('--ner-model', help="Stanford NER model, e.g. english.all.3class.distsim.crf.ser.gz")
+    parser.add_argument('--ner-jar', help="path to stanford-ner.jar, if not on the CLASSPATH")
+    parser.add_argument('--prefilter', action='store_true',
+                        help="only tag the sentences which may contain a location (see geoparse.SentencePrefilter)")
+    parser.add_argument('--gazetteer-index', help="gazetteer index for offline geocoding (see gazetteer.py)")
+    parser.add_argument('--google-key-file', help="file with the googlemaps API key line")
+    parser.add_argument('--coordinates', choices=pl.COORDINATE_MODES,
+                        help="place locations at the coordinates stated in their sentence, without geocoding "
+                             "them (skip) or if geocoding them agrees (check)")
+    parser.add_argument('--canonicalize', action='store_true',
+                        help="geocode each canonical form of the location strings once (see geocode.canonical_key)")
+    parser.add_argument('--results-store', help="also write the results to a typed results store in this directory, "
+                                                "for queries by article and bounding box (see results.py)")
+    parser.add_argument('--convert-workers', type=int, default=2, help="pdfs converted at once")
+    parser.add_argument('--timeout', type=float, default=600, help="per-pdf conversion timeout in seconds")
+    parser.add_argument('--extract-processes', type=int, default=2)
+    parser.add_argument('--ner-workers', type=int, default=1, help="tagger calls running at once")
+    parser.add_argument('--ner-batch-docs', type=int, default=20, help="most documents per tagger call")
+    parser.add_argument('--geocode-workers', type=int, default=8, help="geocoding queries in flight at once")
+    parser.add_argument('--rate', type=float, default=10.0, help="maximum geocoding queries per second")
+    parser.add_argument('--queue-size', type=int, default=8, help="documents waiting between two stages")
+    parser.add_argument('--unordered', action='store_true', help="write documents as they are done")
+    parser.add_argument('--max-held', type=int, default=32,
+                        help="documents let into the stream ahead of the next one to write, if ordered")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    tagger = pl.make_tagger(args.ner_model, args.ner_jar) if args.ner_model else None
+    prefilter = pl.make_prefilter(args.gazetteer_index) if args.prefilter else None
+    geocoder, _ = pl.make_geocoder(args.gazetteer_index, args.google_key_file)
+    stream = StreamingPipeline(args.pdf_dir, results_dir=args.results_dir, map_path=args.map_path,
+                               basemap=args.basemap, corpus_name=args.corpus_name, corpus=args.corpus,
+                               tagger=tagger, prefilter=prefilter, geocoder=geocoder, coordinates=args.coordinates,
+                               canonicalize=args.canonicalize, results_store=args.results_store,
+                               convert_workers=args.convert_workers, timeout=args.timeout,
+                               extract_processes=args.extract_processes, ner_workers=args.ner_workers,
+                               ner_batch_docs=args.ner_batch_docs,
+                               geocode_workers=args.geocode_workers, rate=args.rate, queue_size=args.queue_size,
+                               ordered=not args.unordered, max_held=args.max_held, verbose=args.verbose)
+    stream.run()
+    stream.print_report()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# The Chunker against the chunker and filter functions it replaced, copied below from before the rewrite
+import re
+import random
+
+import pytest
+
+from pysci import geoparse as gp
+
+def legacy_extract_chunks(tagged_sentence, include_cardinal=True, include_other_spatial=True, include_types=True):
+    chunk_tokens = []
+    tokens = []
+    concatenate = False
+    previous_token = ('', 'O')
+    cardinal_direction_tokens = ['east', 'west', 'south', 'north', 'eastern',
+                                 'western', 'southern', 'northern', 'central',
+                                 'northeast', 'northwest', 'southeast', 'southwest',
+                                 'northeastern', 'northwestern', 'southeastern', 'southwestern']
+    spatial_language_tokens = ['along', 'near', 'at']
+    feature_type_tokens = ['region', 'regions', 'county', 'counties', 'park', 'parks',
+                           'coast', 'coasts', 'town', 'city', 'state', 'states', 'river', 'rivers']
+    for token in tagged_sentence:
+        word = token[0]
+        tag = token[1]
+        if tag == 'LOCATION' or tag == 'ORGANIZATION' or tag == 'PERSON':
+            if concatenate:
+                tokens.append(token)
+            else:
+                if previous_token[0] == '(':
+                    tokens.append(previous_token)
+                if include_cardinal and previous_token[0] in cardinal_direction_tokens:
+                    tokens.append(previous_token)
+                tokens.append(token)
+                concatenate = True
+        elif concatenate and re.match(r'[,()]|\'s', word):
+            tokens.append(token)
+        elif concatenate and re.match(r'\b[A-Z][A-Z]\b', word):
+            tokens.append(token)
+        elif concatenate and re.match(r'\bin\b|\bthe\b|\bupon\b|\bof\b', word.lower()):
+            tokens.append(token)
+        elif concatenate and include_cardinal and word.lower() in cardinal_direction_tokens:
+            tokens.append(token)
+        elif concatenate and include_other_spatial and word.lower() in spatial_language_tokens:
+            tokens.append(token)
+        elif concatenate and include_types and word.lower() in feature_type_tokens:
+            tokens.append(token)
+        elif concatenate and re.match(r'^et$', word):
+            tokens.append(token)
+        else:
+            if tokens:
+                chunk_tokens.append(tokens.copy())
+            concatenate = False
+            tokens.clear()
+        previous_token = token
+    if concatenate:
+        chunk_tokens.append(tokens.copy())
+    return chunk_tokens
+
+def legacy_filter_chunks(sentence_tokens, chunk_list):
+    chunks_filtered = []
+    if len(sentence_tokens) <= 3 or not chunk_list:
+        return chunks_filtered
+    keep_words = set(['hospital', 'hospitals', 'hopital', 'hôpital', 'clinic', 'clinics', 'clinique',
+                      'university', 'universities', 'universite', 'universität',
+                      'centre', 'centres', 'centro', 'center', 'centers',
+                      'college', 'colleges',
+                      'department', 'departments', 'departamento', 'departement',
+                      'institution', 'institutions', 'institute', 'institutes', 'institut', 'instituto'])
+    discard_words = set(['gmbh', 'inc', 'inc.'])
+    for chunk in chunk_list:
+        if chunk[-1][0] == 'et':
+            pass
+        elif re.fullmatch(r'\b[A-Z][.]([A-Z][.]?){1,2}', chunk[0][0]):
+            pass
+        else:
+            tags = [item[1] for item in chunk]
+            words_lower = [item[0].lower() for item in chunk]
+            words_lower_set = set(words_lower)
+            if discard_words.intersection(words_lower_set):
+                pass
+            elif keep_words.intersection(words_lower_set):
+                chunks_filtered.append(chunk.copy())
+            elif 'LOCATION' in tags:
+                if ')' in words_lower_set:
+                    if not '(' in words_lower_set:
+                        pass
+                    elif 'ORGANIZATION' in tags:
+                        pass
+                    else:
+                        chunks_filtered.append(chunk.copy())
+                else:
+                    if '(' in words_lower_set:
+                        if not tags.index('LOCATION') > words_lower.index('('):
+                            chunks_filtered.append(chunk.copy())
+                    else:
+                        if 'helsinki' in words_lower_set:
+                            index_hel = sentence_tokens.index(('Helsinki'))
+                            context_tokens = [word.lower() for word in sentence_tokens[index_hel-2:index_hel+2]]
+                            if 'declaration' not in context_tokens:
+                                chunks_filtered.append(chunk.copy())
+                        else:
+                            chunks_filtered.append(chunk.copy())
+    return chunks_filtered
+
+def tagged(text):
+    # "Word/TAG" tokens, the tag O if left out
+    return [tuple(token.rsplit('/', 1)) if '/' in token else (token, 'O') for token in text.split()]
+
+SENTENCES = [
+    tagged("Samples were collected in Miyun/LOCATION County , Beijing/LOCATION , China/LOCATION ."),
+    tagged("The study was approved by the Declaration of Helsinki/LOCATION and local boards ."),
+    tagged("Tumours were obtained from Peking/ORGANIZATION University/ORGANIZATION Cancer/ORGANIZATION Hospital/ORGANIZATION ."),
+    tagged("As reported by Smith/PERSON et al. in 2010 , orchards differ ."),
+    tagged("Reagents came from Sigma/ORGANIZATION GmbH/ORGANIZATION ( Munich/LOCATION , Germany/LOCATION ) ."),
+    tagged("Plots near northern Hebei/LOCATION Province/LOCATION along the Chaobai/LOCATION river were sampled ."),
+    tagged("Sites in State/ORGANIZATION College/ORGANIZATION , PA ( USA/LOCATION ) were used ."),
+    tagged("Orchards ( Beijing/LOCATION ) and ( near Tianjin/LOCATION were sampled ."),
+    tagged("J.K./PERSON Rowling/PERSON visited Edinburgh/LOCATION ."),
+    tagged("Fieldwork at Rock/LOCATION Springs/LOCATION , Pennsylvania/LOCATION"),
+    tagged("Helsinki/LOCATION hosted it ."),
+    tagged("In Paris/LOCATION ."),
+]
+
+def random_sentences(n, seed=0):
+    words = ['the', 'of', 'in', 'upon', 'et', 'al.', ',', '(', ')', "'s", 'PA', 'NY', 'north', 'Northern', 'central',
+             'near', 'along', 'at', 'county', 'City', 'river', 'Helsinki', 'Declaration', 'declaration', 'GmbH',
+             'Inc.', 'University', 'hospital', 'J.K.', 'A.B', 'Beijing', 'Miyun', 'orchard', 'sampled', '.', 'et']
+    tags = ['O', 'O', 'O', 'LOCATION', 'ORGANIZATION', 'PERSON']
+    rng = random.Random(seed)
+    sentences = []
+    for _ in range(n):
+        sentences.append([(rng.choice(words), rng.choice(tags)) for _ in range(rng.randint(0, 25))])
+    return sentences
+
+CORPUS = SENTENCES + random_sentences(2000)
+
+@pytest.mark.parametrize('options', [(True, True, True), (False, True, True), (True, False, False), (False, False, False)])
+def test_extract_chunks_matches_legacy(options):
+    chunker = gp.Chunker(*options)
+    for sentence in CORPUS:
+        assert chunker.extract_chunks(sentence) == legacy_extract_chunks(sentence, *options)
+
+def test_chunk_sentences_matches_legacy():
+    token_lists = [[word for word, _ in sentence] for sentence in CORPUS]
+    results = gp.get_chunker().chunk_sentences(CORPUS, token_lists)
+    for sentence, tokens, (chunks, kept) in zip(CORPUS, token_lists, results):
+        legacy_chunks = legacy_extract_chunks(sentence)
+        assert chunks == legacy_chunks
+        assert kept == legacy_filter_chunks(tokens, legacy_chunks)
+
+def test_legacy_function_names_use_chunker():
+    for sentence in SENTENCES:
+        tokens = [word for word, _ in sentence]
+        chunks = gp.extract_chunks_from_sentence(sentence)
+        assert chunks == legacy_extract_chunks(sentence)
+        assert gp.filter_chunk_candidates(tokens, chunks) == legacy_filter_chunks(tokens, chunks)
+
+def test_sample_sentences_kept_chunks():
+    kept = [[' '.join(word for word, _ in chunk) for chunk in kept]
+            for _, kept in gp.get_chunker().chunk_sentences(SENTENCES)]
+    assert kept[0] == ['Miyun County , Beijing , China']
+    assert kept[1] == []
+    assert kept[2] == ['Peking University Cancer Hospital']
+    assert kept[4] == []
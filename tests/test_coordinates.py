@@ -0,0 +1,48 @@
+import pytest
+
+from pysci import coordinates as co
+from pysci import geocode as gc
+from pysci import pipeline as pl
+
+RUSSO = "Samples were collected in an orchard (coordinates; 40.712019, 77.934192) in Rock Springs, Pennsylvania."
+LIU = "The orchards were located in Beijing (40 210–40 250N, 116 420– 116 470E)."
+FALSE_POSITIVE = "Values for Beijing are given in Table 3.141, 2.718 being the mean."
+
+def top_result(lat, lng, address):
+    return {'formatted_address': address, 'geometry': {'location': {'lat': lat, 'lng': lng},
+                                                       'location_type': 'APPROXIMATE'}}
+
+def test_find_points_decimal_pair_is_ambiguous():
+    [point] = co.find_points(RUSSO)
+    assert (point.lat, point.lon, point.ambiguous) == (40.712019, 77.934192, True)
+
+def test_find_points_mangled_ranges():
+    [point] = co.find_points(LIU)
+    assert not point.ambiguous
+    assert point.lat == pytest.approx(40 + 23 / 60)
+    assert point.lon == pytest.approx(116 + 44.5 / 60)
+
+def test_ambiguous_point_takes_signs_of_agreeing_result():
+    point = pl.location_points(["Rock Springs"], [RUSSO])[0]
+    pennsylvania = top_result(40.72, -77.93, "Rock Springs, PA, USA")
+    geocoded = pl.geocoded_location("Rock Springs", "Rock Springs", pennsylvania, point)
+    assert geocoded[2:] == (co.COORDINATES_TYPE, 40.712019, -77.934192)
+
+def test_ambiguous_point_without_result_is_not_used():
+    point = pl.location_points(["Rock Springs"], [RUSSO])[0]
+    assert pl.geocoded_location("Rock Springs", "Rock Springs", None, point) == \
+        ("Rock Springs",) + (gc.NO_RESULT_STRING,) * 4
+
+def test_unambiguous_point_used_without_result():
+    point = pl.location_points(["Beijing"], [LIU])[0]
+    geocoded = pl.geocoded_location("Beijing", "Beijing", None, point)
+    assert geocoded[2] == co.COORDINATES_TYPE
+    assert geocoded[3:] == (point.lat, point.lon)
+
+def test_false_positive_pair_falls_back():
+    point = pl.location_points(["Beijing"], [FALSE_POSITIVE])[0]
+    assert point.ambiguous
+    beijing = top_result(39.9042, 116.4074, "Beijing, China")
+    assert pl.geocoded_location("Beijing", "Beijing", beijing, point) == \
+        ("Beijing", "Beijing, China", 'APPROXIMATE', 39.9042, 116.4074)
+    assert pl.geocoded_location("Beijing", "Beijing", None, point) == ("Beijing",) + (gc.NO_RESULT_STRING,) * 4
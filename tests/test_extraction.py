@@ -0,0 +1,150 @@
+# Methods and content extraction against the string-concatenating versions they replaced, copied below
+import io
+import re
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from pysci import docutils as du
+from pysci import geoparse as gp
+from pysci import benchmark
+
+def legacy_extract_methods_text(article_content, par_range=4, max_words_in_heading=8, re_to_match=gp.RE_BIOMED_METHODS_TEXT):
+    methods_titles = []
+    pars = re.split('[\n]{2,}', article_content)
+    indexes = []
+    for i, par in enumerate(pars):
+        clean_par = re.sub(r'([a-zA-Z])-\n([a-zA-Z])', r'\1\2', par)
+        candidate_title = clean_par.split('\n')[0]
+        if (re.match(gp.RE_INITIAL_CAPITAL, candidate_title) and len(candidate_title.split(' ')) <= max_words_in_heading):
+            if re.match(re_to_match, candidate_title.lower()):
+                methods_titles.append(candidate_title)
+                indexes.append(i)
+    if not indexes:
+        return ([], '')
+    extended = []
+    for i in indexes:
+        extended.extend(list(range(i, i + par_range)))
+    paragraph_indexes = list(set(extended))
+    paragraph_indexes.sort()
+    text_contents = ''
+    for i in paragraph_indexes:
+        try:
+            par = pars[i]
+            par_temp = re.sub(r'([a-zA-Z])-\n([a-zA-Z])', r'\1\2', par)
+            par_temp = par_temp.replace('\n', ' ')
+            text_contents += par_temp
+            text_contents += '\n\n'
+        except IndexError:
+            continue
+    return (methods_titles, text_contents)
+
+def legacy_extract_methods_xml(xml_root, re_to_match=gp.RE_BIOMED_METHODS_HEADINGS, par_range=3):
+    methods = []
+    for sec in xml_root.iter('sec'):
+        foundMethods = False
+        visited_pars = 0
+        section_title = ''
+        text_contents = ''
+        for child in sec:
+            if not foundMethods:
+                if child.tag == 'title':
+                    if re.match(re_to_match, child.text.lower()):
+                        foundMethods = True
+                        section_title = child.text
+            elif foundMethods:
+                if visited_pars >= par_range:
+                    break
+                if child.tag == 'p':
+                    text_contents += child.text
+                    visited_pars += 1
+                    for xref in child:
+                        text_contents += ' '
+                        text_contents += xref.tail
+                    text_contents += '\n\n'
+        if foundMethods:
+            methods.append((section_title, text_contents))
+    return methods
+
+def legacy_extract_content_text(xml_root):
+    xml_par_text = ''
+    for par in xml_root.iter('p'):
+        if len(par):
+            xml_par_text += par.text
+            xml_par_text += '\n\n'
+    return xml_par_text
+
+SAMPLE_TEXT = """Insect Conservation and Diversity
+
+Abstract. Carabid beetles were sampled in apple orchards around Beij-
+ing, China.
+
+1. Introduction
+Orchards are an important habitat for carab-
+ids in agricultural landscapes.
+
+2. Materials and methods
+
+Study area
+The study was conducted in Miyun County, north-
+east of Beijing (40 210–40 250N, 116 420– 116 470E).
+Orchards were at least 1 km apart.
+
+Sampling
+Pitfall traps were set in each orchard.
+
+3. Results
+We caught 5000 carabids.
+
+Study site"""
+
+@pytest.mark.parametrize('text', [SAMPLE_TEXT] + [benchmark.synthetic_text_article(n, seed=n) for n in (1, 7, 40, 300)])
+@pytest.mark.parametrize('re_to_match', [gp.RE_ORCHARDS_METHODS_TEXT, gp.RE_BIOMED_METHODS_TEXT])
+@pytest.mark.parametrize('par_range', [1, 4])
+def test_extract_methods_text_matches_legacy(text, re_to_match, par_range):
+    du.split_paragraphs.cache_clear()
+    expected = legacy_extract_methods_text(text, par_range=par_range, re_to_match=re_to_match)
+    assert gp.extract_methods_text(text, par_range=par_range, re_to_match=re_to_match) == expected
+    # again, with the paragraphs from the cache
+    assert gp.extract_methods_text(text, par_range=par_range, re_to_match=re_to_match) == expected
+
+def test_sample_text_methods():
+    titles, text = gp.extract_methods_text(SAMPLE_TEXT, re_to_match=gp.RE_ORCHARDS_METHODS_TEXT)
+    assert titles == ['2. Materials and methods', 'Study area', 'Study site']
+    assert 'Miyun County, northeast of Beijing (40 210–40 250N, 116 420– 116 470E). Orchards' in text
+    assert text.endswith('Study site\n\n')
+
+SAMPLE_XML = """<article><front><article-meta><title-group><article-title>Carabids in orchards</article-title></title-group>
+</article-meta></front><body>
+<sec><title>Introduction</title><p>Orchards matter <xref>Smith 2015</xref> a lot.</p></sec>
+<sec><title>Materials and methods</title>
+<p>Plots were in Miyun County <xref>Liu 2014</xref>, Beijing<xref>Fig. 1</xref>.</p>
+<p>No references here.</p>
+<p>Traps <xref>Table 1</xref> were emptied weekly.</p>
+<p>Too far <xref>1</xref> to be kept.</p></sec>
+<sec><title>Study sites</title><p>Near Tianjin <xref>2</xref>.</p></sec>
+</body></article>"""
+
+def xml_samples():
+    return [ET.fromstring(SAMPLE_XML)] + [benchmark.synthetic_xml_article(n, seed=n) for n in (1, 8, 60)]
+
+@pytest.mark.parametrize('index', range(4))
+@pytest.mark.parametrize('par_range', [1, 3, 5])
+def test_extract_methods_xml_matches_legacy(index, par_range):
+    xml_root = xml_samples()[index]
+    for re_to_match in (gp.RE_ORCHARDS_METHODS_HEADINGS, gp.RE_BIOMED_METHODS_HEADINGS):
+        assert gp.extract_methods_xml(xml_root, re_to_match=re_to_match, par_range=par_range) == \
+            legacy_extract_methods_xml(xml_root, re_to_match=re_to_match, par_range=par_range)
+
+@pytest.mark.parametrize('index', range(4))
+def test_extract_content_text_matches_legacy(index):
+    xml_root = xml_samples()[index]
+    assert du.extract_content_text(xml_root) == legacy_extract_content_text(xml_root)
+
+@pytest.mark.parametrize('index', range(4))
+def test_extract_xml_fields_matches_legacy(index):
+    xml_root = xml_samples()[index]
+    source = io.BytesIO(ET.tostring(xml_root))
+    record = du.extract_xml_fields(source, re_to_match=gp.RE_ORCHARDS_METHODS_HEADINGS, par_range=3)
+    assert record['xml_contents'] == legacy_extract_content_text(xml_root)
+    assert record['methods'] == legacy_extract_methods_xml(xml_root, re_to_match=gp.RE_ORCHARDS_METHODS_HEADINGS)
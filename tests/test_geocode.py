@@ -0,0 +1,69 @@
+import pytest
+
+from pysci import geocode as gc
+
+@pytest.mark.parametrize('variant, name', [
+    ("Northeastern Miyun County (", "Miyun County"),
+    ("Miyun county", "Miyun"),
+    ("Pinggu District region", "Pinggu District"),
+    ("Western Miyun County", "Miyun"),
+    ("Beijing , China", "Beijing, China"),
+])
+def test_canonical_key_merges_variants(variant, name):
+    assert gc.canonical_key(variant) == gc.canonical_key(name)
+
+@pytest.mark.parametrize('name, other', [
+    ("Mexico City", "Mexico"),
+    ("Kansas City", "Kansas"),
+    ("Quebec City", "Quebec"),
+    ("New York City", "New York"),
+    ("Washington State", "Washington"),
+    ("North Carolina State University", "South Carolina State University"),
+    ("North Carolina", "Carolina"),
+    ("Southern Ontario region", "Ontario"),
+    ("West Virginia", "Virginia"),
+    ("Washington County", "Washington"),
+    ("Ohio River", "Ohio"),
+    ("Mississippi River", "Mississippi"),
+    ("Georgia Coast", "Georgia"),
+    ("Ontario region", "Ontario"),
+    ("Yellowstone Park", "Yellowstone"),
+])
+def test_canonical_key_keeps_other_places_apart(name, other):
+    assert gc.canonical_key(name) != gc.canonical_key(other)
+
+def test_canonical_index_fans_out_per_key():
+    index = gc.CanonicalIndex(["Mexico City", "Mexico", "Miyun County", "Miyun"])
+    assert len(index.queries()) == 3
+    results = index.fan_out({"Mexico City": 'city', "Mexico": 'country', "Miyun County": 'miyun'})
+    assert results == {"Mexico City": 'city', "Mexico": 'country', "Miyun County": 'miyun', "Miyun": 'miyun'}
+
+def test_sqlite_cache_reads_write_nothing_without_eviction(tmp_path):
+    cache = gc.SqliteGeocodeCache(str(tmp_path / 'cache.sqlite'))
+    cache['Beijing'] = {'formatted_address': 'Beijing, China'}
+    changes = cache.conn.total_changes
+    assert 'Beijing' in cache
+    assert 'Paris' not in cache
+    assert cache['Beijing'] == {'formatted_address': 'Beijing, China'}
+    assert cache.conn.total_changes == changes
+    cache.close()
+
+def test_sqlite_cache_replacing_entries_does_not_evict(tmp_path):
+    cache = gc.SqliteGeocodeCache(str(tmp_path / 'cache.sqlite'), max_entries=2)
+    cache['Beijing'] = gc.NO_RESULT_STRING
+    cache['Paris'] = gc.NO_RESULT_STRING
+    for _ in range(3):
+        cache.set_many([('Beijing', {'formatted_address': 'Beijing, China'}), ('Paris', gc.NO_RESULT_STRING)])
+    assert cache._count == 2
+    assert sorted(cache.keys()) == ['Beijing', 'Paris']
+    cache.close()
+
+def test_sqlite_cache_evicts_least_recently_used(tmp_path):
+    cache = gc.SqliteGeocodeCache(str(tmp_path / 'cache.sqlite'), max_entries=2)
+    cache['Beijing'] = gc.NO_RESULT_STRING
+    cache['Paris'] = gc.NO_RESULT_STRING
+    cache.conn.execute("UPDATE geocode_cache SET accessed = 0")
+    cache.get('Beijing')
+    cache['Miyun'] = gc.NO_RESULT_STRING
+    assert sorted(cache.keys()) == ['Beijing', 'Miyun']
+    cache.close()
@@ -0,0 +1,11 @@
+from pysci import benchmark
+
+def test_modules_dont_load_their_heavy_dependencies_on_import():
+    # only what gets loaded is asserted, the import times are too noisy on a shared machine
+    violations = benchmark.check_import_budget(repeat=1)
+    assert [(module, loaded) for module, _, _, loaded in violations if loaded] == []
+
+def test_check_import_budget_reports_forbidden_modules():
+    # os is loaded by every interpreter, so it stands in for a heavy dependency
+    violations = benchmark.check_import_budget({'pysci.instrument': (60.0, ['os', 'folium'])}, repeat=1)
+    assert [(module, loaded) for module, _, _, loaded in violations] == [('pysci.instrument', ['os'])]
@@ -0,0 +1,53 @@
+import concurrent.futures
+
+import pytest
+
+from pysci import geoparse as gp
+from pysci import instrument
+
+TEXT = "Introduction\n\nSome text.\n\nMaterials and methods\nSamples came from Beijing.\n\nResults\nMany."
+
+@pytest.fixture
+def recorder():
+    recorder = instrument.enable()
+    yield recorder
+    instrument.disable()
+
+def test_timer_size_function_only_called_when_enabled():
+    calls = []
+
+    def size():
+        calls.append(1)
+        return 100
+
+    with instrument.timer('test.stage', nbytes=size):
+        pass
+    assert calls == []
+    recorder = instrument.enable()
+    try:
+        with instrument.timer('test.stage', nbytes=size):
+            pass
+    finally:
+        instrument.disable()
+    assert calls == [1]
+    assert recorder.report()['stages']['test.stage']['bytes'] == 100
+
+def test_call_recorded_without_recording():
+    assert instrument.call_recorded(False, 'doc', len, 'abc') == (3, None)
+
+def test_worker_recordings_are_merged(recorder):
+    with concurrent.futures.ProcessPoolExecutor(1) as pool:
+        result, recorded = pool.submit(instrument.call_recorded, instrument.enabled(), 'doc1',
+                                       gp.extract_methods_text, TEXT, re_to_match=gp.RE_ORCHARDS_METHODS_TEXT).result()
+    assert result == gp.extract_methods_text(TEXT, re_to_match=gp.RE_ORCHARDS_METHODS_TEXT)
+    instrument.merge(recorded)
+    report = recorder.report()
+    # one call in the worker, one here
+    assert report['stages']['geoparse.extract_methods_text']['calls'] == 2
+    assert report['stages']['geoparse.extract_methods_text']['bytes'] == 2 * len(TEXT)
+    assert 'geoparse.extract_methods_text' in report['documents']['doc1']
+
+def test_call_recorded_restores_the_active_recorder(recorder):
+    instrument.call_recorded(True, 'doc1', gp.extract_methods_text, TEXT)
+    assert instrument.get_recorder() is recorder
+    assert 'geoparse.extract_methods_text' not in recorder.report()['stages']
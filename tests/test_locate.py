@@ -0,0 +1,77 @@
+import re
+
+import pytest
+
+from pysci import docutils as du
+from pysci import geoparse as gp
+
+# known place and organization words, standing in for what the NER model tags
+TAGS = {'Beijing': 'LOCATION', 'China': 'LOCATION', 'Miyun': 'LOCATION', 'County': 'LOCATION',
+        'Ontario': 'LOCATION', 'Canada': 'LOCATION', 'Peking': 'ORGANIZATION', 'University': 'ORGANIZATION',
+        'Hospital': 'ORGANIZATION', 'Smith': 'PERSON', 'Helsinki': 'LOCATION'}
+
+class FakeTagger:
+    """
+    Tags the words of TAGS, fails on any sentence with a word in 'failing', and counts its calls.
+    """
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = 0
+
+    def tag_sents(self, sentences):
+        self.calls += 1
+        if any(token in self.failing for tokens in sentences for token in tokens):
+            raise RuntimeError("tagger failed")
+        return [[(token, TAGS.get(token, 'O')) for token in tokens] for tokens in sentences]
+
+@pytest.fixture(autouse=True)
+def simple_tokenizers(monkeypatch):
+    # NLTK's punkt models may not be installed: split sentences on full stops and words on punctuation
+    monkeypatch.setattr(gp, 'sent_tokenize', lambda text: re.split(r'(?<=\.)\s+', text.strip()))
+    monkeypatch.setattr(gp, 'word_tokenize', lambda text: re.findall(r'\w+|[^\w\s]', text))
+
+TEXTS = ["Samples were collected in Miyun County, Beijing, China. Traps were emptied weekly.",
+         "The protocol followed the Declaration of Helsinki. Patients were treated at Peking University Hospital.",
+         "",
+         "Plots were small.\n\nAs Smith et al. showed, sites in Ontario, Canada differ.",
+         "Orchards near Beijing were sampled.\nThey were organic."]
+
+def make_docs(texts=TEXTS):
+    docs = []
+    for i, text in enumerate(texts):
+        doc = du.ScienceDoc('corpus', 'doc%d' % i, has_text=True, has_xml=i % 2 == 0)
+        doc.title = "Carabids of Beijing" if i % 2 == 0 else None
+        doc.relevant_text = text
+        docs.append(doc)
+    return docs
+
+def located(doc):
+    return doc.title_locations, doc.content_locations, doc.content_locations_filtered, doc.location_sentences
+
+def test_batched_tagging_matches_per_document():
+    one_by_one = [gp.locate_in_document(doc, FakeTagger()) for doc in make_docs()]
+    tagger = FakeTagger()
+    batched = gp.locate_in_documents(make_docs(), tagger)
+    assert tagger.calls == 1
+    assert [located(doc) for doc in batched] == [located(doc) for doc in one_by_one]
+    assert batched[0].content_locations_filtered == ['Miyun County, Beijing, China']
+    assert all(doc.locate_error is None for doc in batched)
+
+@pytest.mark.parametrize('batch_size', [1, 3, 1000])
+def test_batch_size_does_not_change_locations(batch_size):
+    expected = [located(doc) for doc in gp.locate_in_documents(make_docs(), FakeTagger())]
+    assert [located(doc) for doc in gp.locate_in_documents(make_docs(), FakeTagger(), batch_size=batch_size)] == expected
+
+def test_failing_document_does_not_fail_its_batch():
+    expected = [located(doc) for doc in gp.locate_in_documents(make_docs(), FakeTagger())]
+    docs = gp.locate_in_documents(make_docs(), FakeTagger(failing={'Helsinki'}))
+    assert 'tagger failed' in docs[1].locate_error
+    assert (docs[1].content_locations, docs[1].content_locations_filtered, docs[1].location_sentences) == ([], [], [])
+    for i in (0, 2, 3, 4):
+        assert docs[i].locate_error is None
+        assert located(docs[i]) == expected[i]
+
+def test_failing_single_document():
+    doc = gp.locate_in_document(make_docs()[0], FakeTagger(failing={'Miyun'}))
+    assert 'tagger failed' in doc.locate_error
+    assert doc.content_locations_filtered == []
@@ -0,0 +1,25 @@
+import os
+
+import pandas as pd
+
+from pysci import geocode as gc
+from pysci import pipeline as pl
+
+def make_shard(results_dir, shard, n_shards, pdf_paths, cached):
+    path = pl.shard_dir(str(results_dir), shard, n_shards)
+    os.makedirs(path)
+    pl.write_tsv(pd.DataFrame({'pdf_path': pdf_paths}), os.path.join(path, pl.SHARD_MANIFEST))
+    cache = gc.SqliteGeocodeCache(os.path.join(path, 'geocode_cache.sqlite'))
+    cache.import_dict(cached)
+    cache.close()
+
+def test_merged_geocode_cache_is_reused_by_pipeline(tmp_path):
+    results_dir = tmp_path / 'results'
+    cache_dir = str(tmp_path / 'pipeline_cache')
+    make_shard(results_dir, 0, 2, ['a.pdf'], {'Beijing': {'formatted_address': 'Beijing, China'}})
+    make_shard(results_dir, 1, 2, ['b.pdf'], {'Miyun': []})
+    assert pl.merge_shards(str(results_dir), 2, cache_dir=cache_dir) == 2
+    pipeline = pl.Pipeline(str(tmp_path / 'pdfs'), cache_dir=cache_dir, results_dir=str(results_dir))
+    assert pipeline.geocode_cache['Beijing'] == {'formatted_address': 'Beijing, China'}
+    assert pipeline.geocode_cache['Miyun'] == gc.NO_RESULT_STRING
+    pipeline.geocode_cache.close()
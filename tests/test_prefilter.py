@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from pysci import geoparse as gp
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+def read_tagged_sentences(path):
+    sentences = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                sentences.append([tuple(token.rsplit('/', 1)) if '/' in token else (token, 'O')
+                                  for token in line.split()])
+    return sentences
+
+@pytest.fixture(scope='module')
+def tagged_sentences():
+    return read_tagged_sentences(os.path.join(DATA_DIR, 'tagged_sentences.txt'))
+
+def test_prefilter_misses_no_sentence_with_chunks(tagged_sentences):
+    report = gp.evaluate_prefilter(gp.SentencePrefilter(), tagged_sentences)
+    assert report['sentences_with_chunks'] > 0
+    assert report['sentence_recall'] == 1.0
+    assert report['chunk_recall'] == 1.0
+    assert report['kept_chunk_recall'] == 1.0
+    assert report['missed'] == []
+
+def test_prefilter_saves_ner_calls(tagged_sentences):
+    report = gp.evaluate_prefilter(gp.SentencePrefilter(), tagged_sentences)
+    assert report['ner_sentences_saved'] > 0
+
+def test_prefilter_keep_rules():
+    prefilter = gp.SentencePrefilter(names=['beijing'])
+    assert prefilter.keep('Samples came from Miyun .'.split())
+    assert prefilter.keep('Miyun was sampled .'.split())
+    assert not prefilter.keep('The plots were small .'.split())
+    assert prefilter.keep('samples from the university hospital .'.split())
+    assert prefilter.keep('samples from beijing .'.split())
+    assert not prefilter.keep([])
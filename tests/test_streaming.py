@@ -0,0 +1,42 @@
+import sqlite3
+
+import pytest
+
+from pysci import streaming
+
+class BrokenCache(dict):
+    """
+    Geocode cache which breaks down on its second lookup.
+    """
+    def get(self, query, default=None):
+        if self.setdefault('lookups', 0) >= 1:
+            raise sqlite3.OperationalError("database is locked")
+        self['lookups'] += 1
+        return {'formatted_address': query,
+                'geometry': {'location_type': 'APPROXIMATE', 'location': {'lat': 40.0, 'lng': 116.0}}}
+
+def locate(docs):
+    for doc in docs:
+        doc.scidoc.use_xml = False
+        doc.scidoc.title = doc.file_name
+        doc.scidoc.title_locations = []
+        doc.scidoc.relevant_text = ''
+        doc.scidoc.content_locations = doc.scidoc.content_locations_filtered = [doc.file_name.title()]
+        doc.scidoc.location_sentences = []
+
+def test_geocode_failure_fails_undelivered_documents_and_is_raised(tmp_path, monkeypatch):
+    pdf_dir = tmp_path / 'pdfs'
+    pdf_dir.mkdir()
+    for name in ('beijing', 'miyun', 'pinggu'):
+        (pdf_dir / (name + '.pdf')).write_bytes(b'')
+    stream = streaming.StreamingPipeline(str(pdf_dir), results_dir=str(tmp_path / 'results'),
+                                         geocode_cache=BrokenCache(), extract_processes=0, ner_batch_wait=0.0)
+    monkeypatch.setattr(stream, '_convert', lambda docs: None)
+    monkeypatch.setattr(stream, '_extract', lambda docs: None)
+    monkeypatch.setattr(stream, '_locate', locate)
+    with pytest.raises(sqlite3.OperationalError):
+        stream.run()
+    assert stream.report['documents'] == 1
+    assert [(name, stage) for name, stage, _ in stream.errors] == [('miyun', 'geocode'), ('pinggu', 'geocode')]
+    with open(tmp_path / 'results' / 'locations_geocoded.tsv', encoding='utf-8') as f:
+        assert 'Beijing' in f.read()